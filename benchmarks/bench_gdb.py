@@ -0,0 +1,182 @@
+# encoding: utf-8
+
+# Printer benchmarks, run inside gdb by benchmarks/run.py:
+#
+#   gdb -batch -nx -x benchmarks/bench_gdb.py fixture [core]
+#
+# Settings come from the environment:
+#
+#   BENCH_OUTPUT     file the JSON results are written to (required)
+#   BENCH_REPEAT     number of warm runs per case (default 20)
+#   BENCH_LIBSTDCXX  directory holding gcc's libstdcxx python printers
+#   BENCH_FILTER     regex; only cases whose name matches are run
+#   BENCH_TARGET     "core" if gdb was given a core file of the fixture,
+#                    otherwise the fixture is run to bench_ready() first
+
+import gdb
+
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, expression, how the value is rendered)
+#   "print": value.format_string(), what `print EXPR` does
+#   "json":  the printer's to_py_value(), what `rippled-json EXPR` does
+CASES = [
+    ("AccountID", "*account", "print"),
+    ("uint256", "*hash", "print"),
+    ("STAmount/XRP", "*xrp_amount", "print"),
+    ("STAmount/IOU", "*iou_amount", "print"),
+    ("IOUAmount", "*iou_value", "print"),
+    ("XRPAmount", "*xrp_value", "print"),
+    ("STObject/small", "*small_object", "print"),
+    ("STObject/small/json", "*small_object", "json"),
+    ("STObject/large", "*large_object", "print"),
+    ("STObject/large/json", "*large_object", "json"),
+    ("Buffer/small", "*small_buffer", "print"),
+    ("Buffer/large", "*large_buffer", "print"),
+    ("Json::Value", "*json_object", "print"),
+    ("Json::Value/json", "*json_object", "json"),
+]
+
+
+def setup_paths():
+    libstdcxx = os.environ.get("BENCH_LIBSTDCXX")
+    if libstdcxx:
+        sys.path.insert(0, libstdcxx)
+    sys.path.insert(0, ROOT)
+    from libstdcxx.v6.printers import register_libstdcxx_printers
+
+    register_libstdcxx_printers(None)
+    from rippled.pretty_printers.printers import register_rippled_printers
+
+    register_rippled_printers(None)
+
+
+def clear_caches():
+    "Drop every cache the printers keep, so the next print runs cold."
+    from rippled.pretty_printers import (
+        amount_format,
+        base58,
+        decode_cache,
+        json_value,
+        layout,
+        payment_engine,
+        printers,
+        rbtree,
+        rtti,
+        stobject,
+        uint_format,
+    )
+
+    printers.printer_gen.clear_cache()
+    decode_cache.decode_cache.clear()
+    layout.clear()
+    rtti.resolver.clear()
+    rbtree._layouts.clear()
+    json_value._walker.clear()
+    stobject._fast_decoder.clear()
+    stobject._sfield_registry.clear()
+    payment_engine._step_decoder.clear()
+    base58.encode_account_id.cache_clear()
+    uint_format.base_uint_params.cache_clear()
+    amount_format.to_decimal.cache_clear()
+    amount_format.amount_to_string.cache_clear()
+
+
+def render(value, how):
+    if how == "json":
+        from rippled.pretty_printers.printers import printer_gen
+
+        return json.dumps(printer_gen(value).to_py_value())
+    return value.format_string()
+
+
+def count_fields(value):
+    "Number of children the printer shows for value, or 1 for scalars."
+    from rippled.pretty_printers.printers import printer_gen
+
+    printer = printer_gen(value)
+    if printer is None or not hasattr(printer, "children"):
+        return 1
+    n = sum(1 for _ in printer.children())
+    # map children come in (key, value) pairs
+    if getattr(printer, "display_hint", lambda: None)() == "map":
+        n //= 2
+    return max(n, 1)
+
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def run_case(name, expr, how, repeat):
+    clear_caches()
+    value = gdb.parse_and_eval(expr)
+    cold = timed(lambda: render(value, how))
+    warm = []
+    for _ in range(repeat):
+        value = gdb.parse_and_eval(expr)
+        warm.append(timed(lambda: render(value, how)))
+    fields = count_fields(gdb.parse_and_eval(expr))
+    warm_median = statistics.median(warm)
+    return {
+        "name": name,
+        "expr": expr,
+        "render": how,
+        "fields": fields,
+        "cold_ms": cold * 1e3,
+        "warm_ms": warm_median * 1e3,
+        "warm_min_ms": min(warm) * 1e3,
+        "warm_max_ms": max(warm) * 1e3,
+        "per_field_us": warm_median * 1e6 / fields,
+    }
+
+
+def main():
+    output = os.environ["BENCH_OUTPUT"]
+    repeat = int(os.environ.get("BENCH_REPEAT", "20"))
+    name_filter = re.compile(os.environ.get("BENCH_FILTER", ""))
+
+    gdb.execute("set pagination off")
+    gdb.execute("set confirm off")
+    gdb.execute("set print elements unlimited")
+    setup_paths()
+
+    target = os.environ.get("BENCH_TARGET", "live")
+    if target == "live":
+        gdb.execute("break bench_ready")
+        gdb.execute("run")
+    results = [
+        run_case(name, expr, how, repeat)
+        for name, expr, how in CASES
+        if name_filter.search(name)
+    ]
+    report = {
+        "gdb": gdb.VERSION,
+        "python": platform.python_version(),
+        "target": target,
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+try:
+    main()
+except Exception as e:
+    gdb.write(f"benchmark failed: {e!r}\n", gdb.STDERR)
+    raise
+finally:
+    if gdb.selected_inferior().pid:
+        gdb.execute("kill", to_string=True)
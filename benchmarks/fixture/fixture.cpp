@@ -0,0 +1,434 @@
+// Fixture for benchmarking the rippled pretty printers.
+//
+// This mimics the memory layout of the rippled types the printers decode
+// (base_uint, STAmount, STObject and friends, Json::Value, Buffer) closely
+// enough for the printers to treat them as the real thing, without needing a
+// rippled build. The objects are built in main() and bench_ready() is where
+// the benchmark stops to print them.
+//
+// Build: g++ -g -O0 -std=c++17 -o fixture fixture.cpp
+
+#include <array>
+#include <cstdint>
+#include <cstring>
+#include <map>
+#include <memory>
+#include <new>
+#include <string>
+#include <type_traits>
+#include <utility>
+#include <vector>
+
+namespace ripple {
+
+template <std::size_t Bits, class Tag = void>
+class base_uint
+{
+public:
+    std::array<std::uint32_t, Bits / 32> data_{};
+
+    static base_uint
+    filled(std::uint8_t seed)
+    {
+        base_uint r;
+        auto p = reinterpret_cast<std::uint8_t*>(r.data_.data());
+        for (std::size_t i = 0; i < Bits / 8; ++i)
+            p[i] = static_cast<std::uint8_t>(seed + i * 7);
+        return r;
+    }
+};
+
+namespace detail {
+class AccountIDTag
+{
+};
+class CurrencyTag
+{
+};
+}  // namespace detail
+
+using AccountID = base_uint<160, detail::AccountIDTag>;
+using Currency = base_uint<160, detail::CurrencyTag>;
+using uint256 = base_uint<256>;
+
+inline Currency
+currencyFromCode(char const* code)
+{
+    Currency c;
+    std::memcpy(reinterpret_cast<char*>(c.data_.data()) + 12, code, 3);
+    return c;
+}
+
+struct Issue
+{
+    Currency currency;
+    AccountID account;
+};
+
+class IOUAmount
+{
+public:
+    std::int64_t mantissa_;
+    int exponent_;
+};
+
+class XRPAmount
+{
+public:
+    std::int64_t drops_;
+};
+
+class Buffer
+{
+public:
+    std::unique_ptr<std::uint8_t[]> p_;
+    std::size_t size_ = 0;
+
+    explicit Buffer(std::size_t size)
+        : p_(new std::uint8_t[size]), size_(size)
+    {
+        for (std::size_t i = 0; i < size; ++i)
+            p_[i] = static_cast<std::uint8_t>(i * 31);
+    }
+};
+
+class SField
+{
+public:
+    int const fieldCode;
+    std::string const fieldName;
+
+    SField(int type, int field, char const* name)
+        : fieldCode((type << 16) | field), fieldName(name)
+    {
+        knownCodeToField[fieldCode] = this;
+    }
+
+    static std::map<int, SField const*> knownCodeToField;
+};
+
+std::map<int, SField const*> SField::knownCodeToField;
+
+class STBase
+{
+public:
+    SField const* fName;
+
+    explicit STBase(SField const& n) : fName(&n)
+    {
+    }
+    virtual ~STBase() = default;
+    virtual STBase*
+    move(std::size_t n, void* buf) = 0;
+};
+
+template <class T>
+class STInteger : public STBase
+{
+public:
+    T value_;
+
+    STInteger(SField const& n, T v) : STBase(n), value_(v)
+    {
+    }
+    STBase*
+    move(std::size_t, void* buf) override
+    {
+        return new (buf) STInteger(std::move(*this));
+    }
+};
+
+template <int Bits>
+class STBitString : public STBase
+{
+public:
+    base_uint<Bits> value_;
+
+    STBitString(SField const& n, base_uint<Bits> v) : STBase(n), value_(v)
+    {
+    }
+    STBase*
+    move(std::size_t, void* buf) override
+    {
+        return new (buf) STBitString(std::move(*this));
+    }
+};
+
+class STAccount : public STBase
+{
+public:
+    AccountID value_;
+    bool default_ = false;
+
+    STAccount(SField const& n, AccountID v) : STBase(n), value_(v)
+    {
+    }
+    STBase*
+    move(std::size_t, void* buf) override
+    {
+        return new (buf) STAccount(std::move(*this));
+    }
+};
+
+class STAmount : public STBase
+{
+public:
+    Issue mIssue;
+    std::uint64_t mValue;
+    int mOffset;
+    bool mIsNative;
+    bool mIsNegative;
+
+    STAmount(SField const& n, Issue issue, std::uint64_t v, int o, bool native)
+        : STBase(n)
+        , mIssue(issue)
+        , mValue(v)
+        , mOffset(o)
+        , mIsNative(native)
+        , mIsNegative(false)
+    {
+    }
+    STBase*
+    move(std::size_t, void* buf) override
+    {
+        return new (buf) STAmount(std::move(*this));
+    }
+};
+
+namespace detail {
+
+class STVar
+{
+public:
+    static std::size_t constexpr max_size = 72;
+
+    std::aligned_storage<max_size>::type d_;
+    STBase* p_ = nullptr;
+
+    template <class T>
+    explicit STVar(T&& t)
+    {
+        using U = std::decay_t<T>;
+        if (sizeof(U) <= max_size)
+            p_ = new (&d_) U(std::forward<T>(t));
+        else
+            p_ = new U(std::forward<T>(t));
+    }
+    STVar(STVar&& other)
+    {
+        if (other.p_ == reinterpret_cast<STBase*>(&other.d_))
+            p_ = other.p_->move(max_size, &d_);
+        else
+            p_ = std::exchange(other.p_, nullptr);
+    }
+    STVar(STVar const&) = delete;
+    ~STVar() = default;  // the fixture never destroys its objects
+};
+
+}  // namespace detail
+
+class STObject : public STBase
+{
+public:
+    std::vector<detail::STVar> v_;
+    void const* mType = nullptr;
+
+    explicit STObject(SField const& n) : STBase(n)
+    {
+    }
+    STBase*
+    move(std::size_t, void* buf) override
+    {
+        return new (buf) STObject(std::move(*this));
+    }
+    template <class T>
+    void
+    add(T&& t)
+    {
+        v_.emplace_back(std::forward<T>(t));
+    }
+};
+
+}  // namespace ripple
+
+namespace Json {
+
+enum ValueType {
+    nullValue = 0,
+    intValue,
+    uintValue,
+    realValue,
+    stringValue,
+    booleanValue,
+    arrayValue,
+    objectValue
+};
+
+class Value
+{
+public:
+    class CZString
+    {
+    public:
+        char const* cstr_;
+        int index_;
+
+        bool
+        operator<(CZString const& o) const
+        {
+            if (cstr_ && o.cstr_)
+                return std::strcmp(cstr_, o.cstr_) < 0;
+            return index_ < o.index_;
+        }
+    };
+
+    using ObjectValues = std::map<CZString, Value>;
+
+    union ValueHolder {
+        std::int64_t int_;
+        std::uint64_t uint_;
+        double real_;
+        bool bool_;
+        char* string_;
+        ObjectValues* map_;
+    } value_;
+    ValueType type_ : 8;
+    int allocated_ : 1;
+
+    Value(ValueType t = nullValue) : type_(t), allocated_(0)
+    {
+        value_.map_ = nullptr;
+        if (t == arrayValue || t == objectValue)
+            value_.map_ = new ObjectValues;
+    }
+    static Value
+    integer(std::int64_t i)
+    {
+        Value v(intValue);
+        v.value_.int_ = i;
+        return v;
+    }
+    static Value
+    string(char const* s)
+    {
+        Value v(stringValue);
+        v.value_.string_ = strdup(s);
+        return v;
+    }
+    Value&
+    operator[](char const* key)
+    {
+        return (*value_.map_)[CZString{strdup(key), 0}];
+    }
+    Value&
+    operator[](int index)
+    {
+        return (*value_.map_)[CZString{nullptr, index}];
+    }
+};
+
+}  // namespace Json
+
+using namespace ripple;
+
+// Field definitions, with rippled's (type, field) codes
+SField const sfTransactionType(1, 2, "TransactionType");
+SField const sfFlags(2, 2, "Flags");
+SField const sfSequence(2, 4, "Sequence");
+SField const sfLedgerIndex(5, 6, "LedgerIndex");
+SField const sfAmount(6, 1, "Amount");
+SField const sfBalance(6, 2, "Balance");
+SField const sfFee(6, 8, "Fee");
+SField const sfAccount(8, 1, "Account");
+SField const sfDestination(8, 3, "Destination");
+SField const sfMemo(14, 10, "Memo");
+
+Issue const xrpIssue{};
+
+// Objects printed by the benchmark
+STObject* small_object;
+STObject* large_object;
+STAmount* xrp_amount;
+STAmount* iou_amount;
+IOUAmount* iou_value;
+XRPAmount* xrp_value;
+AccountID* account;
+uint256* hash;
+Buffer* small_buffer;
+Buffer* large_buffer;
+Json::Value* json_object;
+
+static STObject
+makeObject(int n, int seed)
+{
+    Issue usd{currencyFromCode("USD"), AccountID::filled(seed + 1)};
+    STObject obj(sfMemo);
+    obj.add(STInteger<std::uint16_t>(sfTransactionType, 0));
+    obj.add(STInteger<std::uint32_t>(sfFlags, 0x80000000u));
+    obj.add(STAccount(sfAccount, AccountID::filled(seed)));
+    for (int i = 0; i < n; ++i)
+    {
+        switch (i % 4)
+        {
+            case 0:
+                obj.add(STInteger<std::uint32_t>(sfSequence, seed + i));
+                break;
+            case 1:
+                obj.add(STAmount(sfAmount, usd, 1234567890123456ull + i, -15 + i % 7, false));
+                break;
+            case 2:
+                obj.add(STAccount(sfDestination, AccountID::filled(seed + i)));
+                break;
+            case 3:
+                obj.add(STBitString<256>(sfLedgerIndex, uint256::filled(seed + i)));
+                break;
+        }
+    }
+    obj.add(STAmount(sfFee, xrpIssue, 12, -6, true));
+    return obj;
+}
+
+extern "C" void
+bench_ready()
+{
+    // The benchmark stops here. Keep the call from being optimized out.
+    asm volatile("" ::: "memory");
+}
+
+int
+main()
+{
+    small_object = new STObject(makeObject(8, 1));
+    large_object = new STObject(makeObject(400, 2));
+    STObject inner = makeObject(4, 3);
+    large_object->add(std::move(inner));
+
+    xrp_amount = new STAmount(sfBalance, xrpIssue, 99999989999999970ull, -6, true);
+    iou_amount = new STAmount(
+        sfAmount,
+        Issue{currencyFromCode("EUR"), AccountID::filled(9)},
+        1000000000000000ull,
+        -13,
+        false);
+    iou_value = new IOUAmount{-5000000000000000, -15};
+    xrp_value = new XRPAmount{12345678};
+    account = new AccountID(AccountID::filled(42));
+    hash = new uint256(uint256::filled(7));
+    small_buffer = new Buffer(64);
+    large_buffer = new Buffer(64 * 1024);
+
+    json_object = new Json::Value(Json::objectValue);
+    (*json_object)["status"] = Json::Value::string("success");
+    (*json_object)["ledger_index"] = Json::Value::integer(123456);
+    Json::Value& lines = (*json_object)["lines"] = Json::Value(Json::arrayValue);
+    for (int i = 0; i < 200; ++i)
+    {
+        Json::Value& line = lines[i] = Json::Value(Json::objectValue);
+        line["account"] = Json::Value::string("rHb9CJAWyB4rj91VRWn96DkukG4bwdtyTh");
+        line["balance"] = Json::Value::integer(i * 1000);
+        line["currency"] = Json::Value::string("USD");
+    }
+
+    bench_ready();
+    return 0;
+}
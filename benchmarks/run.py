@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+
+"""Benchmark the rippled pretty printers.
+
+Builds the fixture program, runs gdb in batch mode with bench_gdb.py against
+it (or against a core file of it) and writes the timings as JSON:
+
+    benchmarks/run.py [--core] [--repeat N] [--filter RE] [--output FILE]
+                      [--baseline FILE] [--libstdcxx DIR]
+
+With --baseline, the results are compared with an earlier run, for example
+one made on another commit. Without --output, the JSON goes to stdout unless
+there is a comparison to show.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+FIXTURE = os.path.join(HERE, "fixture", "fixture.cpp")
+BUILD = os.path.join(HERE, "build")
+
+
+def build_fixture(cxx):
+    os.makedirs(BUILD, exist_ok=True)
+    binary = os.path.join(BUILD, "fixture")
+    stale = not os.path.exists(binary)
+    if not stale:
+        stale = os.path.getmtime(binary) < os.path.getmtime(FIXTURE)
+    if stale:
+        cmd = [cxx, "-g", "-O0", "-std=c++17", "-o", binary, FIXTURE]
+        subprocess.run(cmd, check=True)
+    return binary
+
+
+def make_core(gdb, binary):
+    "Run the fixture to bench_ready() and save a core file of it."
+    core = os.path.join(BUILD, "fixture.core")
+    cmd = [
+        gdb,
+        "-batch",
+        "-nx",
+        "-ex",
+        "break bench_ready",
+        "-ex",
+        "run",
+        "-ex",
+        f"gcore {core}",
+        "-ex",
+        "kill",
+        binary,
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+    return core
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "-C", ROOT, "status", "--porcelain", "--untracked-files=no"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        return out + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_gdb(gdb, binary, core, args):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    env = dict(os.environ)
+    env["BENCH_OUTPUT"] = output
+    env["BENCH_REPEAT"] = str(args.repeat)
+    env["BENCH_FILTER"] = args.filter
+    env["BENCH_TARGET"] = "core" if core else "live"
+    if args.libstdcxx:
+        env["BENCH_LIBSTDCXX"] = args.libstdcxx
+    cmd = [gdb, "-batch", "-nx", "-x", os.path.join(HERE, "bench_gdb.py"), binary]
+    if core:
+        cmd.append(core)
+    try:
+        subprocess.run(cmd, check=True, env=env, stdout=subprocess.DEVNULL)
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        os.unlink(output)
+
+
+def compare(baseline, report):
+    "Print warm and cold times against a baseline run."
+    old = {r["name"]: r for r in baseline["results"]}
+    print(
+        f"{'case':<22} {'warm ms':>10} {'base':>10} {'ratio':>7}"
+        f" {'cold ms':>10} {'base':>10} {'ratio':>7}"
+    )
+    for r in report["results"]:
+        o = old.get(r["name"])
+        if o is None:
+            print(f"{r['name']:<22} {r['warm_ms']:>10.3f} {'-':>10} {'-':>7}")
+            continue
+        print(
+            f"{r['name']:<22} {r['warm_ms']:>10.3f} {o['warm_ms']:>10.3f}"
+            f" {r['warm_ms'] / o['warm_ms']:>7.2f}"
+            f" {r['cold_ms']:>10.3f} {o['cold_ms']:>10.3f}"
+            f" {r['cold_ms'] / o['cold_ms']:>7.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--core", action="store_true", help="benchmark a core file")
+    parser.add_argument("--repeat", type=int, default=20, help="warm runs per case")
+    parser.add_argument("--filter", default="", help="only run matching cases")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--baseline", help="compare with these JSON results")
+    parser.add_argument("--libstdcxx", help="directory of gcc's python printers")
+    parser.add_argument("--gdb", default=os.environ.get("GDB", "gdb"))
+    parser.add_argument("--cxx", default=os.environ.get("CXX", "g++"))
+    args = parser.parse_args()
+
+    if shutil.which(args.gdb) is None:
+        sys.exit(f"{args.gdb} not found")
+    binary = build_fixture(args.cxx)
+    core = make_core(args.gdb, binary) if args.core else None
+    report = run_gdb(args.gdb, binary, core, args)
+    report["commit"] = git_commit()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    elif not args.baseline:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,48 +3,55 @@ from gdb.types import get_basic_type
 import binascii
 import collections
 import pickle
-import decimal
 import os
 from collections import namedtuple
 from os.path import expanduser
-from rippled.printers import XRPAmount, IOUAmount, STAmount
+from rippled.pretty_printers.amounts import XRPAmount, IOUAmount, STAmount
+from rippled.pretty_printers.amount_format import to_decimal, signed_to_decimal
+from rippled.pretty_printers.layout import layout_of
+from rippled.trace_sink import TraceWriter
+from rippled.flow_columns import ColumnWriter
+from rippled.locations import SourceLocation, resolve_spec
 import re
+import struct
+import time
 
 DEFAULT_OUTPUT_DIR = expanduser('~/py_data_gdb/')
 
-
-def _to_decimal(sign, value, exponent):
-    # Decimal want a tuple of digits, use this ugly hack
-    # until I think of a better way
-    value_tuple = tuple(int(d) for d in tuple('%d' % value))
-    return decimal.Decimal((sign, value_tuple, exponent))
+# Default breakpoint locations. Each one is found by searching the function's
+# source for the statement, and the line numbers they used to be hardcoded
+# to are kept as fallbacks.
+PAYMENT_TX_START = SourceLocation(
+    'ripple::Payment::doApply', r'rc\s*=\s*path::RippleCalc::rippleCalculate',
+    fallback='Payment.cpp:361')
+PAYMENT_TX_FINISH = SourceLocation(
+    'ripple::Payment::doApply', r'pv\.apply\s*\(\s*ctx_\.rawView',
+    fallback='Payment.cpp:374')
+NEW_FLOW_STRAND_CAND = SourceLocation(
+    'ripple::flow', r'if\s*\(\s*f\.ter\s*!=\s*tesSUCCESS',
+    fallback='impl/Flow.h:381')
+OLD_FLOW_STRAND_CAND = SourceLocation(
+    'ripple::path::RippleCalc::rippleCalculate', r'rippleCalculate: AFTER:',
+    fallback='RippleCalc.cpp:369')
+CMP_NEW_OLD_FLOW = SourceLocation(
+    'ripple::path::RippleCalc::rippleCalculate',
+    r'flowV1Output.*!=|!=.*flowV1Output',
+    fallback='RippleCalc.cpp:164')
 
 
 def _st_amt_to_decimal(value):
     sign = int(value['mIsNegative'])
     mantissa = int(value['mValue'])
     exponent = -6 if int(value['mIsNative']) else int(value['mOffset'])
-    return _to_decimal(sign, mantissa, exponent)
+    return to_decimal(sign, mantissa, exponent)
 
 
 def _xrp_amt_to_decimal(value):
-    drops = int(value['drops_'])
-    sign = 0
-    if drops < 0:
-        drops = -drops
-        sign = 1
-    exponent = -6
-    return _to_decimal(sign, drops, exponent)
+    return signed_to_decimal(int(value['drops_']), -6)
 
 
 def _iou_amt_to_decimal(value):
-    mantissa = int(value['mantissa_'])
-    sign = 0
-    if mantissa < 0:
-        mantissa = -mantissa
-        sign = 1
-    exponent = int(value['exponent_'])
-    return _to_decimal(sign, mantissa, exponent)
+    return signed_to_decimal(int(value['mantissa_']), int(value['exponent_']))
 
 
 XRP_AMT_RE = re.compile(XRPAmount.type_name_re)
@@ -81,6 +88,176 @@ def _txid():
     tid = v['ctx_']['tx']['tid_']
     return tid
 
+
+def _int_decoder(off, size, signed=False):
+    def decode(buf, o):
+        return int.from_bytes(buf[o + off:o + off + size], 'little',
+                              signed=signed)
+    return decode
+
+
+def _leaf_decoder(t):
+    '''Return a function (buf, offset) -> value for a value of type t'''
+    bt = get_basic_type(t)
+    name = bt.name or str(bt)
+    if XRP_AMT_RE.match(name):
+        drops = _int_decoder(*_offset_size(bt, 'drops_'), True)
+        return lambda buf, o: signed_to_decimal(drops(buf, o), -6)
+    if IOU_AMT_RE.match(name):
+        mantissa = _int_decoder(*_offset_size(bt, 'mantissa_'), True)
+        exponent = _int_decoder(*_offset_size(bt, 'exponent_'), True)
+        return lambda buf, o: signed_to_decimal(mantissa(buf, o),
+                                                exponent(buf, o))
+    if ST_AMT_RE.match(name):
+        value = _int_decoder(*_offset_size(bt, 'mValue'))
+        offset = _int_decoder(*_offset_size(bt, 'mOffset'), True)
+        native = _int_decoder(*_offset_size(bt, 'mIsNative'))
+        negative = _int_decoder(*_offset_size(bt, 'mIsNegative'))
+
+        def decode(buf, o):
+            exponent = -6 if native(buf, o) else offset(buf, o)
+            return to_decimal(negative(buf, o), value(buf, o), exponent)
+        return decode
+    if bt.code in (gdb.TYPE_CODE_INT, gdb.TYPE_CODE_BOOL, gdb.TYPE_CODE_ENUM):
+        return _int_decoder(0, bt.sizeof, getattr(bt, 'is_signed', True))
+    raise gdb.error('No raw decoder for type %s' % name)
+
+
+def _offset_size(t, *path):
+    return layout_of(t).field(*path)[:2]
+
+
+def _frame_cfa(frame):
+    '''Return the canonical frame address of frame: the caller's stack
+    pointer, where the frame's own stack memory ends'''
+    # inlined frames share the stack memory of the function they are in
+    while frame is not None and frame.type() == gdb.INLINE_FRAME:
+        frame = frame.older()
+    older = frame.older() if frame is not None else None
+    if older is None:
+        raise gdb.error('No caller frame')
+    return int(older.read_register('sp'))
+
+
+class _ProbeLayout:
+    '''Where the values read by a FrameProbe live, relative to the stack
+    pointer, for one pc'''
+
+    def __init__(self, frame, paths):
+        sp = int(frame.read_register('sp'))
+        cfa = _frame_cfa(frame)
+
+        def check_in_frame(addr, size, what):
+            # the offsets are reused with the sp of later hits, which is
+            # only right for memory in the frame itself; a reference or a
+            # static local is somewhere else
+            if addr < sp or addr + size > cfa:
+                raise gdb.error('%s is not in the frame' % what)
+
+        block = frame.block()
+        ptr_size = gdb.lookup_type('void').pointer().sizeof
+        self.ptr_fmt = '<Q' if ptr_size == 8 else '<I'
+        # segment None is the frame, other segments are keyed by the frame
+        # offset of the pointer that is followed to reach them
+        leaves = []
+        for path in paths:
+            sym = gdb.lookup_symbol(path[0], block)[0]
+            if sym is None:
+                raise gdb.error('No symbol %s in frame' % path[0])
+            v = sym.value(frame)
+            base = sp
+            seg = None
+            for name in path[1:]:
+                if v.address is None:
+                    raise gdb.error('%s is not in memory' % path[0])
+                if name == '*':
+                    if seg is not None:
+                        raise gdb.error('Only one dereference is supported')
+                    check_in_frame(int(v.address), v.type.sizeof, path[0])
+                    seg = int(v.address) - base
+                    v = v.dereference()
+                    base = int(v.address)
+                else:
+                    v = v[name]
+            if v.address is None:
+                raise gdb.error('%s is not in memory' % path[0])
+            if seg is None:
+                check_in_frame(int(v.address), v.type.sizeof, path[0])
+            leaves.append((seg, int(v.address) - base, v.type.sizeof,
+                           _leaf_decoder(v.type)))
+
+        def span(items):
+            lo = min(off for off, size in items)
+            hi = max(off + size for off, size in items)
+            return lo, hi - lo
+
+        ptrs = sorted(set(l[0] for l in leaves if l[0] is not None))
+        self.frame_span = span([(l[1], l[2]) for l in leaves if l[0] is None] +
+                               [(p, ptr_size) for p in ptrs])
+        self.ptr_spans = [(p, span([(l[1], l[2]) for l in leaves
+                                    if l[0] == p])) for p in ptrs]
+        self.leaves = []
+        for seg, off, size, decode in leaves:
+            if seg is None:
+                self.leaves.append((None, off - self.frame_span[0], decode))
+            else:
+                i = ptrs.index(seg)
+                self.leaves.append((i, off - self.ptr_spans[i][1][0], decode))
+
+    def read(self, frame):
+        '''Read the raw bytes for this location: one read for the frame and
+        one for each followed pointer'''
+        inferior = gdb.selected_inferior()
+        sp = int(frame.read_register('sp'))
+        lo, length = self.frame_span
+        frame_bytes = bytes(inferior.read_memory(sp + lo, length))
+        ptr_bytes = []
+        for ptr_off, (plo, plength) in self.ptr_spans:
+            p = struct.unpack_from(self.ptr_fmt, frame_bytes, ptr_off - lo)[0]
+            ptr_bytes.append(bytes(inferior.read_memory(p + plo, plength)))
+        return frame_bytes, ptr_bytes
+
+    def decode(self, frame_bytes, ptr_bytes):
+        r = []
+        for seg, off, decode in self.leaves:
+            buf = frame_bytes if seg is None else ptr_bytes[seg]
+            r.append(decode(buf, off))
+        return r
+
+
+class FrameProbe:
+    '''Grab the raw bytes of locals (or fields of locals) in a frame.
+
+    paths is a list of tuples: a local name followed by field names, with '*'
+    to follow a pointer. The offsets are resolved the first time a pc is seen
+    and cached, so later hits cost one memory read (plus one per followed
+    pointer). Decoding is deferred until decode() is called.'''
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.layouts = {}  # pc -> _ProbeLayout, or None if not probeable
+
+    def read(self, frame=None):
+        '''Return a raw record, or None if the values are not in memory'''
+        if frame is None:
+            frame = gdb.selected_frame()
+        pc = frame.pc()
+        if pc not in self.layouts:
+            try:
+                self.layouts[pc] = _ProbeLayout(frame, self.paths)
+            except gdb.error:
+                self.layouts[pc] = None
+        layout = self.layouts[pc]
+        if layout is None:
+            return None
+        return (layout,) + layout.read(frame)
+
+    @staticmethod
+    def decode(record):
+        '''Return the values of the paths, in order'''
+        layout, frame_bytes, ptr_bytes = record
+        return layout.decode(frame_bytes, ptr_bytes)
+
 # dict so we can pickle and load without depending on the rippled namespace
 TX_FLOW = {}
 
@@ -95,15 +272,111 @@ def tx_flow_append(tx_flow, input, output, it):
     tx_flow['iter'].append(it)
 
 
+def tx_flow_append_raw(tx_flow, record, iter_adjust):
+    '''Save a FrameProbe record of (in, out, iteration) for later decoding'''
+    tx_flow.setdefault('raw', []).append((record, iter_adjust))
+
+
+def tx_flow_decode(tx_flow):
+    '''Decode the raw records saved by tx_flow_append_raw'''
+    for record, iter_adjust in tx_flow.pop('raw', []):
+        vin, vout, it = FrameProbe.decode(record)
+        tx_flow_append(tx_flow, vin, vout, it + iter_adjust)
+
+
+def _decode_tx_flows(tx_flows):
+    for tx_flow in tx_flows.values():
+        tx_flow_decode(tx_flow)
+
+
 TX_FLOW = None
 LAST_TX_FLOW = None  # for inspecting directly
 
+# When set, every candidate is also streamed to this TraceWriter
+TRACE_SINK = None
+_STREAMED = {}  # side -> candidates of the current tx written to TRACE_SINK
+
+# When set, every finished transaction is appended to this ColumnWriter
+COLUMN_STORE = None
+
+
+def open_column_store(out_dir=None):
+    '''Append every finished transaction to the column store in out_dir.
+
+    The default is DEFAULT_OUTPUT_DIR/columns. Load it with
+    rippled.flow_columns.load_columns.'''
+    global COLUMN_STORE
+    if out_dir is None:
+        out_dir = os.path.join(DEFAULT_OUTPUT_DIR, 'columns')
+    COLUMN_STORE = ColumnWriter(out_dir)
+    return out_dir
+
+
+def close_column_store():
+    global COLUMN_STORE
+    COLUMN_STORE = None
+
+
+def open_trace_sink(path=None):
+    '''Stream all traces of this session to path. Returns the path.
+
+    The default is a new file in DEFAULT_OUTPUT_DIR. Read it back with
+    rippled.trace_sink.iter_tx_flows.'''
+    global TRACE_SINK
+    close_trace_sink()
+    if path is None:
+        path = os.path.join(DEFAULT_OUTPUT_DIR, 'flow.%s.%d.trace' %
+                            (time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+    TRACE_SINK = TraceWriter(path)
+    _STREAMED.clear()
+    return path
+
+
+def close_trace_sink():
+    global TRACE_SINK
+    if TRACE_SINK is not None:
+        if TX_FLOW:
+            _stream_tx_flows(TX_FLOW)
+        TRACE_SINK.close()
+        TRACE_SINK = None
+
+
+def _stream_side(side, tx_flow):
+    '''Decode pending raw records of one side and write the candidates not
+    yet streamed'''
+    tx_flow_decode(tx_flow)
+    start = _STREAMED.get(side, 0)
+    for vin, vout, it in zip(tx_flow['in'][start:], tx_flow['out'][start:],
+                             tx_flow['iter'][start:]):
+        TRACE_SINK.write(('cand', side, vin, vout, it))
+    _STREAMED[side] = len(tx_flow['in'])
+
+
+def _stream_tx_flows(tx_flows):
+    '''Decode pending raw records and write the candidates not yet streamed'''
+    for side, tx_flow in tx_flows.items():
+        _stream_side(side, tx_flow)
+
+
+def _trace_candidate(side):
+    '''Called after each candidate is added to TX_FLOW[side].
+
+    The candidate is decoded and written right away, so the TraceWriter's
+    flush interval bounds what is lost if gdb dies mid-transaction.'''
+    if TRACE_SINK is None:
+        return
+    _stream_side(side, TX_FLOW[side])
+
 
 def save_tx_flow(out_dir=DEFAULT_OUTPUT_DIR):
     '''Pickle the collected traces. File name will contain the tx id'''
     global TX_FLOW
     if not TX_FLOW:
         return
+    _decode_tx_flows(TX_FLOW)
+    if TRACE_SINK is not None:
+        TRACE_SINK.write(('mismatch', TX_FLOW['new']['txid']))
+        TRACE_SINK.flush()
     file_name = os.path.join(out_dir,
                              'tx.' + TX_FLOW['new']['txid'] + '.pickle')
     with open(file_name, 'wb') as f:
@@ -115,15 +388,18 @@ class BPaymentTxStart(gdb.Breakpoint):
 
     def __init__(self, spec=None):
         if spec is None:
-            spec = 'Payment.cpp:361'
-        super().__init__(spec)
+            spec = PAYMENT_TX_START
+        super().__init__(resolve_spec(spec))
 
     def stop(self):
         global TX_FLOW
         if TX_FLOW:
-            return TRUE  # TDB - this is an error
+            return True  # TDB - this is an error
         tid_hex = _txid_to_hex_str(_txid())
         TX_FLOW = {'old': tx_flow_init(tid_hex), 'new': tx_flow_init(tid_hex)}
+        if TRACE_SINK is not None:
+            _STREAMED.clear()
+            TRACE_SINK.write(('tx_start', tid_hex))
         return False  # Don't actually break
 
 
@@ -132,55 +408,96 @@ class BPaymentTxFinish(gdb.Breakpoint):
 
     def __init__(self, spec=None):
         if spec is None:
-            spec = 'Payment.cpp:374'
-        super().__init__(spec)
+            spec = PAYMENT_TX_FINISH
+        super().__init__(resolve_spec(spec))
 
     def stop(self):
         global TX_FLOW, LAST_TX_FLOW
         if not TX_FLOW:
             return True  # TDB - this is an error
+        if TRACE_SINK is not None:
+            _stream_tx_flows(TX_FLOW)
+            TRACE_SINK.write(('tx_end', TX_FLOW['new']['txid']))
+            TRACE_SINK.flush()
+        _decode_tx_flows(TX_FLOW)
+        if COLUMN_STORE is not None:
+            COLUMN_STORE.append_tx(TX_FLOW)
         LAST_TX_FLOW = TX_FLOW
         TX_FLOW = None
         return True  # Don't actually break
 
 
 class BNewFlowStrandCand(gdb.Breakpoint):
-    '''Candidate liquidity new flow'''
+    '''Candidate liquidity new flow
 
-    def __init__(self, spec=None):
+    With raw=True the locals are grabbed with a FrameProbe and decoded when
+    the transaction finishes.'''
+
+    probe = FrameProbe([('f', 'in'), ('f', 'out'), ('curTry',)])
+
+    def __init__(self, spec=None, raw=True):
         if spec is None:
-            spec = 'impl/Flow.h:381'
-        super().__init__(spec)
+            spec = NEW_FLOW_STRAND_CAND
+        super().__init__(resolve_spec(spec))
+        self.raw = raw
 
     def stop(self):
         global TX_FLOW
         if not TX_FLOW:
             return True  # TDB - this is an error
+        if self.raw:
+            try:
+                record = self.probe.read()
+            except gdb.MemoryError:
+                record = None
+            if record is not None:
+                tx_flow_append_raw(TX_FLOW['new'], record, -1)
+                _trace_candidate('new')
+                return False  # Don't actually break
         v = _value('f')
         vin = _amt_to_decimal(v['in'])
         vout = _amt_to_decimal(v['out'])
         cur_try = int(_value('curTry'))
         tx_flow_append(TX_FLOW['new'], vin, vout, cur_try - 1)
+        _trace_candidate('new')
         return False  # Don't actually break
 
 
 class BOldFlowStrandCand(gdb.Breakpoint):
-    '''Candidate liquidity old flow'''
+    '''Candidate liquidity old flow
 
-    def __init__(self, spec=None):
+    With raw=True the locals are grabbed with a FrameProbe and decoded when
+    the transaction finishes.'''
+
+    probe = FrameProbe([('pathState', '_M_ptr', '*', 'saInPass'),
+                        ('pathState', '_M_ptr', '*', 'saOutPass'),
+                        ('iPass',)])
+
+    def __init__(self, spec=None, raw=True):
         if spec is None:
-            spec = 'RippleCalc.cpp:369'
-        super().__init__(spec)
+            spec = OLD_FLOW_STRAND_CAND
+        super().__init__(resolve_spec(spec))
+        self.raw = raw
 
     def stop(self):
         global TX_FLOW
         if not TX_FLOW:
             return True  # TDB - this is an error
+        if self.raw:
+            try:
+                record = self.probe.read()
+            except gdb.MemoryError:
+                record = None
+            if record is not None:
+                tx_flow_append_raw(TX_FLOW['old'], record, 0)
+                _trace_candidate('old')
+                return False  # Don't actually break
         v = _value('pathState')['_M_ptr'].dereference()
         vin = _amt_to_decimal(v['saInPass'])
         vout = _amt_to_decimal(v['saOutPass'])
         cur_try = int(_value('iPass'))
         tx_flow_append(TX_FLOW['old'], vin, vout, cur_try)
+        _trace_candidate('old')
         return False  # Don't actually break
 
 
@@ -189,8 +506,8 @@ class BCmpNewOldFlow(gdb.Breakpoint):
 
     def __init__(self, spec=None):
         if spec is None:
-            spec = 'RippleCalc.cpp:164'
-        super().__init__(spec)
+            spec = CMP_NEW_OLD_FLOW
+        super().__init__(resolve_spec(spec))
 
     def stop(self):
         save_tx_flow()
@@ -0,0 +1,246 @@
+'''Columnar storage of flow traces.
+
+Each traced strand candidate becomes one row. Rows are stored column by
+column, one raw binary file per column, so millions of candidates can be
+loaded into NumPy arrays without any per row Python work:
+
+    tx           int32  index into txids.txt
+    side         int8   0 for the old flow, 1 for the new flow
+    in_mantissa  int64  signed mantissa of the input amount
+    in_exponent  int8   exponent of the input amount
+    out_mantissa int64
+    out_exponent int8
+    iter         int32  iteration (pass) of the candidate
+
+A transaction's rows are appended to every column, then its id to
+txids.txt, and only then is the number of rows and transactions written to
+commit.json (replaced atomically). If gdb dies in between, the columns can
+be left with different lengths; opening the store with a ColumnWriter cuts
+every file back to the last commit, and load_columns ignores anything
+beyond it.
+
+Writing only needs the standard library, so it works inside gdb. Loading
+needs NumPy.
+'''
+
+import array
+import json
+import os
+import sys
+
+from rippled.trace_sink import iter_tx_flows
+
+COLUMNS = (
+    ('tx', 'i', 'int32'),
+    ('side', 'b', 'int8'),
+    ('in_mantissa', 'q', 'int64'),
+    ('in_exponent', 'b', 'int8'),
+    ('out_mantissa', 'q', 'int64'),
+    ('out_exponent', 'b', 'int8'),
+    ('iter', 'i', 'int32'),
+)
+SIDES = {'old': 0, 'new': 1}
+_INT64_MAX = 2**63 - 1
+
+
+def decimal_to_mantissa_exponent(d):
+    '''Split a Decimal into an int64 mantissa and an int8 exponent'''
+    sign, digits, exponent = d.as_tuple()
+    mantissa = int(''.join(map(str, digits))) if digits else 0
+    while mantissa > _INT64_MAX or exponent < -128:
+        if exponent >= 127:
+            raise OverflowError('%s does not fit the column types' % d)
+        mantissa //= 10
+        exponent += 1
+    while exponent > 127 and mantissa and mantissa * 10 <= _INT64_MAX:
+        mantissa *= 10
+        exponent -= 1
+    if exponent > 127:
+        raise OverflowError('%s does not fit the column types' % d)
+    return (-mantissa if sign else mantissa), exponent
+
+
+COMMIT_FILE = 'commit.json'
+
+
+def read_commit(out_dir):
+    '''Return the committed (rows, txs) of a column store.
+
+    Stores written before commit.json existed count as committed up to
+    their shortest column and their complete txids.txt lines.'''
+    path = os.path.join(out_dir, COMMIT_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            commit = json.load(f)
+        return commit['rows'], commit['txs']
+    rows = None
+    for name, code, _ in COLUMNS:
+        col_path = os.path.join(out_dir, name + '.bin')
+        size = os.path.getsize(col_path) if os.path.exists(col_path) else 0
+        n = size // array.array(code).itemsize
+        rows = n if rows is None else min(rows, n)
+    txs = 0
+    txids_path = os.path.join(out_dir, 'txids.txt')
+    if os.path.exists(txids_path):
+        with open(txids_path) as f:
+            txs = sum(1 for l in f if l.endswith('\n'))
+    return rows, txs
+
+
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        os.truncate(path, size)
+
+
+class ColumnWriter:
+    '''Appends transactions to a column store directory'''
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        meta_path = os.path.join(out_dir, 'columns.json')
+        if not os.path.exists(meta_path):
+            meta = {'byteorder': sys.byteorder,
+                    'columns': [[name, dtype] for name, _, dtype in COLUMNS]}
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+        self.txids_path = os.path.join(out_dir, 'txids.txt')
+        self.num_rows, self.num_txs = read_commit(out_dir)
+        self._recover()
+
+    def _recover(self):
+        '''Cut every file back to the last commit'''
+        for name, code, _ in COLUMNS:
+            _truncate(os.path.join(self.out_dir, name + '.bin'),
+                      self.num_rows * array.array(code).itemsize)
+        if os.path.exists(self.txids_path):
+            with open(self.txids_path, 'rb') as f:
+                size = sum(len(l) for _, l in zip(range(self.num_txs), f))
+            _truncate(self.txids_path, size)
+        self._commit()
+
+    def _commit(self):
+        path = os.path.join(self.out_dir, COMMIT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'rows': self.num_rows, 'txs': self.num_txs}, f)
+        os.replace(path + '.tmp', path)
+
+    def append_tx(self, tx_flows):
+        '''Append one transaction, a dict shaped like flow.TX_FLOW'''
+        tx = self.num_txs
+        cols = {name: array.array(code) for name, code, _ in COLUMNS}
+        txid = None
+        for side, code in SIDES.items():
+            tx_flow = tx_flows.get(side)
+            if not tx_flow:
+                continue
+            txid = tx_flow['txid']
+            for vin, vout, it in zip(tx_flow['in'], tx_flow['out'],
+                                     tx_flow['iter']):
+                in_m, in_e = decimal_to_mantissa_exponent(vin)
+                out_m, out_e = decimal_to_mantissa_exponent(vout)
+                cols['tx'].append(tx)
+                cols['side'].append(code)
+                cols['in_mantissa'].append(in_m)
+                cols['in_exponent'].append(in_e)
+                cols['out_mantissa'].append(out_m)
+                cols['out_exponent'].append(out_e)
+                cols['iter'].append(it)
+        for name, a in cols.items():
+            with open(os.path.join(self.out_dir, name + '.bin'), 'ab') as f:
+                a.tofile(f)
+        with open(self.txids_path, 'a') as f:
+            f.write('%s\n' % txid)
+        self.num_rows += len(cols['tx'])
+        self.num_txs += 1
+        # written last: until then, none of this transaction is committed
+        self._commit()
+        return tx
+
+
+def export_trace(trace_path, out_dir):
+    '''Append every transaction of a trace_sink file to a column store.
+    Returns the number of transactions written.'''
+    writer = ColumnWriter(out_dir)
+    n = 0
+    for tx in iter_tx_flows(trace_path):
+        writer.append_tx(tx)
+        n += 1
+    return n
+
+
+###
+### NumPy loader
+###
+
+
+def load_columns(out_dir, mmap=True):
+    '''Return a dict of column name -> NumPy array, plus 'txids' (a list).
+
+    Only the committed rows and transactions are returned.'''
+    import numpy as np
+
+    with open(os.path.join(out_dir, 'columns.json')) as f:
+        meta = json.load(f)
+    order = '<' if meta['byteorder'] == 'little' else '>'
+    rows, txs = read_commit(out_dir)
+    r = {}
+    for name, dtype in meta['columns']:
+        path = os.path.join(out_dir, name + '.bin')
+        dt = np.dtype(dtype).newbyteorder(order)
+        if rows == 0:
+            r[name] = np.zeros(0, dtype=dt)
+        elif mmap:
+            r[name] = np.memmap(path, dtype=dt, mode='r', shape=(rows,))
+        else:
+            r[name] = np.fromfile(path, dtype=dt, count=rows)
+    r['txids'] = []
+    txids_path = os.path.join(out_dir, 'txids.txt')
+    if os.path.exists(txids_path):
+        with open(txids_path) as f:
+            r['txids'] = [l.strip() for _, l in zip(range(txs), f)]
+    return r
+
+
+def amounts(cols, which):
+    '''Return the 'in' or 'out' amounts as float64'''
+    import numpy as np
+
+    mantissa = cols[which + '_mantissa'].astype(np.float64)
+    exponent = cols[which + '_exponent'].astype(np.float64)
+    return mantissa * np.power(10.0, exponent)
+
+
+def compare_old_new(cols, rtol=1e-9):
+    '''Compare the old and new flow of every transaction, vectorized.
+
+    Returns a dict of per transaction arrays: candidate counts, summed
+    in/out amounts for each side, and 'diverged', a bool array that is True
+    where the counts differ or the summed amounts differ by more than rtol.'''
+    import numpy as np
+
+    num_txs = len(cols['txids'])
+    tx = cols['tx'].astype(np.int64)
+    side = cols['side']
+    r = {}
+    for name, code in SIDES.items():
+        mask = side == code
+        r[name + '_count'] = np.bincount(tx[mask], minlength=num_txs)
+        for which in ('in', 'out'):
+            r['%s_%s' % (name, which)] = np.bincount(
+                tx[mask], weights=amounts(cols, which)[mask],
+                minlength=num_txs).astype(np.float64)
+    diverged = r['old_count'] != r['new_count']
+    for which in ('in', 'out'):
+        diverged |= ~np.isclose(r['old_' + which], r['new_' + which],
+                                rtol=rtol, atol=0.0)
+    r['diverged'] = diverged
+    return r
+
+
+def divergent_txids(cols, rtol=1e-9):
+    '''Return the ids of the transactions where old and new flow disagree'''
+    import numpy as np
+
+    diverged = compare_old_new(cols, rtol)['diverged']
+    return [cols['txids'][i] for i in np.flatnonzero(diverged)]
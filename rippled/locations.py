@@ -0,0 +1,166 @@
+'''Find breakpoint locations by function name and source pattern.
+
+Hardcoded "file:line" specs break every time the source moves. A
+SourceLocation names the function and a regex for the statement instead.
+The first time it is resolved, the function's line table is scanned for the
+first source line matching the pattern. The result is cached on disk per
+binary build-id, so later sessions on the same build skip the search.
+'''
+
+import gdb
+import json
+import os
+import re
+from os.path import expanduser
+
+CACHE_FILE = expanduser('~/.cache/rippled-gdb/locations.json')
+
+
+class SourceLocation:
+    '''A statement in a function, found by a regex over its source lines.
+
+    occurrence picks which match to use if the pattern matches more than one
+    line. fallback is the spec to use if the location can't be resolved.'''
+
+    def __init__(self, function, pattern, fallback=None, occurrence=0):
+        self.function = function
+        self.pattern = pattern
+        self.fallback = fallback
+        self.occurrence = occurrence
+
+    def key(self):
+        return '%s|%s|%d' % (self.function, self.pattern, self.occurrence)
+
+    def __repr__(self):
+        return 'SourceLocation(%r, %r)' % (self.function, self.pattern)
+
+
+def _build_key():
+    '''Identify the binary being debugged: its build-id if it has one'''
+    progspace = gdb.current_progspace()
+    filename = progspace.filename if progspace else None
+    if not filename:
+        return None
+    for objfile in gdb.objfiles():
+        if objfile.filename == filename and objfile.build_id:
+            return objfile.build_id
+    try:
+        return '%s@%d' % (filename, os.stat(filename).st_mtime_ns)
+    except OSError:
+        return None
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp = CACHE_FILE + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass
+
+
+def _function_lines(function):
+    '''Return {symtab filename: (fullname, sorted code lines)} for all the
+    instances of function (every template instantiation and overload)'''
+    try:
+        _, sals = gdb.decode_line(function)
+    except gdb.error:
+        return {}
+    r = {}
+    for sal in sals or ():
+        if sal.symtab is None:
+            continue
+        block = gdb.block_for_pc(sal.pc)
+        while block is not None and block.function is None:
+            block = block.superblock
+        if block is None:
+            continue
+        symtab = sal.symtab
+        lines = set()
+        for entry in symtab.linetable():
+            if block.start <= entry.pc < block.end and entry.line > 0:
+                lines.add(entry.line)
+        fullname, code_lines = r.get(symtab.filename, (symtab.fullname(), set()))
+        r[symtab.filename] = (fullname, code_lines | lines)
+    return {k: (v[0], sorted(v[1])) for k, v in r.items()}
+
+
+def _search(location):
+    '''Search the function's source for the pattern. Returns a spec or None'''
+    pattern = re.compile(location.pattern)
+    matches = []
+    for filename, (fullname, code_lines) in sorted(
+            _function_lines(location.function).items()):
+        if not code_lines:
+            continue
+        try:
+            with open(fullname, errors='replace') as f:
+                source = f.read().splitlines()
+        except OSError:
+            continue
+        first, last = code_lines[0], code_lines[-1]
+        for line in range(first, min(last, len(source)) + 1):
+            if not pattern.search(source[line - 1]):
+                continue
+            # break on the first line with code at or after the match
+            code_line = next((l for l in code_lines if l >= line), None)
+            if code_line is not None:
+                matches.append('%s:%d' % (filename, code_line))
+    if location.occurrence < len(matches):
+        return matches[location.occurrence]
+    return None
+
+
+def resolve(location, use_cache=True):
+    '''Return a breakpoint spec for location.
+
+    Falls back to location.fallback if the statement can't be found.'''
+    build = _build_key() if use_cache else None
+    cache = _load_cache() if build else {}
+    spec = cache.get(build, {}).get(location.key())
+    if spec is not None:
+        return spec
+    spec = _search(location)
+    if spec is None:
+        if location.fallback is None:
+            raise gdb.GdbError('Could not resolve %r' % location)
+        return location.fallback
+    if build:
+        cache.setdefault(build, {})[location.key()] = spec
+        _save_cache(cache)
+    return spec
+
+
+def resolve_spec(spec):
+    '''Breakpoint classes accept either a spec string or a SourceLocation'''
+    if isinstance(spec, SourceLocation):
+        return resolve(spec)
+    return spec
+
+
+class ResolveLocationCommand(gdb.Command):
+    '''Find a statement by function and pattern: rippled-resolve FUNCTION REGEX
+
+    Prints the file:line spec, using and updating the per build cache.'''
+
+    def __init__(self):
+        super().__init__('rippled-resolve', gdb.COMMAND_BREAKPOINTS)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        if len(args) != 2:
+            raise gdb.GdbError('usage: rippled-resolve FUNCTION REGEX')
+        gdb.write('%s\n' % resolve(SourceLocation(args[0], args[1])))
+
+
+ResolveLocationCommand()
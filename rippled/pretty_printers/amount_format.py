@@ -0,0 +1,64 @@
+# encoding: utf-8
+
+# Amount formatting shared by the amount printers and the flow tracer.
+#
+# This module does not depend on gdb so it can be used outside of it.
+
+import decimal
+import functools
+
+from .uint_format import base_uint_to_string
+
+# Number of (sign, mantissa, exponent) results remembered
+AMOUNT_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=AMOUNT_CACHE_SIZE)
+def to_decimal(sign, mantissa, exponent):
+    "Return the Decimal (-1)**sign * mantissa * 10**exponent."
+    # Parsing a string is exact and does not depend on the decimal context
+    return decimal.Decimal(f"{'-' if sign else ''}{mantissa:d}E{exponent:d}")
+
+
+@functools.lru_cache(maxsize=AMOUNT_CACHE_SIZE)
+def amount_to_string(sign, mantissa, exponent, pretty=False):
+    """Format an amount (without its issue).
+
+    If pretty is True, amounts of at least 1 are rounded to 2 decimal places.
+    """
+    d = to_decimal(sign, mantissa, exponent)
+    if pretty and d >= 1:
+        return f"{d:.2f}"
+    return f"{d}"
+
+
+def signed_to_decimal(mantissa, exponent):
+    "Like to_decimal, but the sign is taken from a signed mantissa."
+    if mantissa < 0:
+        return to_decimal(1, -mantissa, exponent)
+    return to_decimal(0, mantissa, exponent)
+
+
+def issue_to_string(currency, account, currency_type, account_type):
+    "Format the raw currency and account of an Issue like the Issue printer."
+    cur_str = base_uint_to_string(currency, currency_type)
+    acc_str = base_uint_to_string(account, account_type)
+    return f"{cur_str}/{acc_str}"
+
+
+def st_amount_to_string(negative, value, offset, native, issue, pretty=False):
+    """Format the fields of an STAmount like the STAmount printer.
+
+    issue is the string from issue_to_string.
+    """
+    exponent = -6 if native else offset
+    return f"{amount_to_string(negative, value, exponent, pretty)}/{issue}"
+
+
+def amount_cache_stats():
+    "Return a dict with the amount cache counters."
+    r = {}
+    for name, f in (("decimal", to_decimal), ("string", amount_to_string)):
+        info = f.cache_info()
+        r[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+    return r
@@ -2,17 +2,108 @@ from rippled.pretty_printers.printers import *
 from rippled.pretty_printers.printers import _register_printer
 
 import re
-import decimal
+import gdb
+
+from . import amount_format
+from .decode_cache import decode_cache
+from gdb.types import get_basic_type
+
+from .layout import layout_of, referenced, value_address
 
 # set to False to print all digits, True to print 2 decimal places
 PRETTY_AMOUNT = False
 
 
-def _to_decimal(sign, value, exponent):
-    # Decimal want a tuple of digits, use this ugly hack
-    # until I think of a better way
-    value_tuple = tuple(int(d) for d in tuple(f"{value:d}"))
-    return decimal.Decimal((sign, value_tuple, exponent))
+def amount_to_string(sign, value, exponent):
+    "Format an amount (without its issue) the way the amount printers do."
+    return amount_format.amount_to_string(sign, value, exponent, PRETTY_AMOUNT)
+
+
+def issue_from_buffer(layout, buf, *path):
+    "Format the Issue at path in buf, the bytes of an object with TypeLayout layout."
+    currency = path + ("currency",)
+    account = path + ("account",)
+    return amount_format.issue_to_string(
+        layout.bytes_at(buf, *currency, "data_"),
+        layout.bytes_at(buf, *account, "data_"),
+        layout.type_name(*currency),
+        layout.type_name(*account),
+    )
+
+
+def st_amount_from_buffer(layout, buf):
+    "Format an STAmount from its bytes, given the TypeLayout of STAmount."
+    return amount_format.st_amount_to_string(
+        layout.int_at(buf, "mIsNegative"),
+        layout.int_at(buf, "mValue"),
+        layout.int_at(buf, "mOffset", signed=True),
+        layout.int_at(buf, "mIsNative"),
+        issue_from_buffer(layout, buf, "mIssue"),
+        PRETTY_AMOUNT,
+    )
+
+
+def _signed_amount_to_string(value, exponent):
+    sign = 0
+    if value < 0:
+        value = -value
+        sign = 1
+    return amount_to_string(sign, value, exponent)
+
+
+def iou_amount_from_buffer(layout, buf):
+    "Format an IOUAmount from its bytes, given the TypeLayout of IOUAmount."
+    value = layout.int_at(buf, "mantissa_", signed=True)
+    exponent = layout.int_at(buf, "exponent_", signed=True)
+    return f"{_signed_amount_to_string(value, exponent)}/IOU"
+
+
+def xrp_amount_from_buffer(layout, buf):
+    "Format an XRPAmount from its bytes, given the TypeLayout of XRPAmount."
+    value = layout.int_at(buf, "drops_", signed=True)
+    return f"{_signed_amount_to_string(value, -6)}/XRP"
+
+
+_AMOUNT_FROM_BUFFER = {
+    "ripple::STAmount": st_amount_from_buffer,
+    "ripple::IOUAmount": iou_amount_from_buffer,
+    "ripple::XRPAmount": xrp_amount_from_buffer,
+}
+
+
+def amount_from_buffer(t, buf):
+    """Format the bytes of an amount of gdb.Type t like its printer does.
+
+    Returns None if t is not STAmount, IOUAmount or XRPAmount.
+    """
+    layout = layout_of(t)
+    decode = _AMOUNT_FROM_BUFFER.get(str(layout.type.unqualified()))
+    if decode is None:
+        return None
+    return decode(layout, buf)
+
+
+def amount_at(layout, buf, *path):
+    "Format the amount at path in buf like its printer does, or return None."
+    off, size, t = layout.field(*path)
+    return amount_from_buffer(t, buf[off : off + size])
+
+
+def _read_object(value):
+    """Return (TypeLayout, bytes) of value with one read, or (None, None).
+
+    References are followed. Callers fall back to gdb.Value lookups when
+    this returns None, or when decoding the bytes raises gdb.error.
+    """
+    value = referenced(value)
+    addr = value_address(value)
+    if addr is None:
+        return None, None
+    try:
+        layout = layout_of(get_basic_type(value.type))
+        return layout, layout.read(addr)
+    except (gdb.error, gdb.MemoryError):
+        return None, None
 
 
 @_register_printer
@@ -29,14 +120,26 @@ class STAmount:
         return self.to_string()
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                # the bytes of an STAmount are all it is decoded from
+                return decode_cache.lookup(
+                    (
+                        value_address(referenced(self.value)),
+                        "ripple::STAmount",
+                        PRETTY_AMOUNT,
+                    ),
+                    bytes(buf),
+                    lambda: st_amount_from_buffer(layout, buf),
+                    persistent=True,
+                )
+            except gdb.error:
+                pass
         sign = int(self.value["mIsNegative"])
         value = int(self.value["mValue"])
         exponent = -6 if int(self.value["mIsNative"]) else int(self.value["mOffset"])
-        d = _to_decimal(sign, value, exponent)
-        if PRETTY_AMOUNT and d >= 1:
-            amt_str = f"{d:.2f}"
-        else:
-            amt_str = f"{d}"
+        amt_str = amount_to_string(sign, value, exponent)
         return f"{amt_str}/{self.value['mIssue']}"
 
 
@@ -51,18 +154,15 @@ class IOUAmount:
         self.value = value
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                return iou_amount_from_buffer(layout, buf)
+            except gdb.error:
+                pass
         value = int(self.value["mantissa_"])
-        sign = 0
-        if value < 0:
-            value = -value
-            sign = 1
         exponent = int(self.value["exponent_"])
-        d = _to_decimal(sign, value, exponent)
-        if PRETTY_AMOUNT and d >= 1:
-            amt_str = f"{d:.2f}"
-        else:
-            amt_str = f"{d}"
-        return f"{amt_str}/IOU"
+        return f"{_signed_amount_to_string(value, exponent)}/IOU"
 
 
 @_register_printer
@@ -76,18 +176,14 @@ class XRPAmount:
         self.value = value
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                return xrp_amount_from_buffer(layout, buf)
+            except gdb.error:
+                pass
         value = int(self.value["drops_"])
-        sign = 0
-        if value < 0:
-            value = -value
-            sign = 1
-        exponent = -6
-        d = _to_decimal(sign, value, exponent)
-        if PRETTY_AMOUNT and d >= 1:
-            amt_str = f"{d:.2f}"
-        else:
-            amt_str = f"{d}"
-        return f"{amt_str}/XRP"
+        return f"{_signed_amount_to_string(value, -6)}/XRP"
 
 
 @_register_printer
@@ -101,4 +197,10 @@ class Issue:
         self.value = value
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                return issue_from_buffer(layout, buf)
+            except gdb.error:
+                pass
         return f"{self.value['currency']}/{self.value['account']}"
@@ -0,0 +1,214 @@
+# encoding: utf-8
+
+# Decoding large values in the background.
+#
+# gdb runs Python on its main thread, so printing a huge STObject blocks the
+# session until it is done. For an STObject, `rippled-json-async EXPR` only
+# reads the memory of its fields on the main thread, then decodes and
+# formats them (base58, decimals, JSON) on a worker thread. The result is
+# written back through gdb.post_event in chunks, so gdb keeps taking
+# commands meanwhile. `rippled-jobs` lists the jobs still running and
+# cancels them.
+#
+# Other values, Json::Value included, are decoded by their printer on the
+# main thread, since walking them is nearly all reads. Only the JSON
+# formatting and writing the result are left to the worker.
+#
+# Workers never call gdb. Account labels are looked up from them, which
+# known_accounts allows, but label files are only reloaded on gdb's thread.
+
+import concurrent.futures
+import functools
+import gdb
+import json
+import time
+
+from .layout import find_field
+from .printers import printer_gen
+from .stobject import _fast_decoder
+
+# Number of worker threads
+ASYNC_WORKERS = 1
+# Characters written per gdb event when a result is shown
+ASYNC_WRITE_CHUNK = 64 << 10
+
+
+class Job:
+    "A value being formatted in the background."
+
+    def __init__(self, job_id, expr, output):
+        self.id = job_id
+        self.expr = expr
+        self.output = output
+        self.future = None
+        self.cancelled = False
+        self.started = time.perf_counter()
+
+    def describe(self):
+        state = "running" if not self.future.done() else "writing"
+        return f"[{self.id}] {state} for {time.perf_counter() - self.started:.1f} s: {self.expr}"
+
+
+def snapshot(value):
+    """Read what formatting value as JSON needs, on gdb's thread.
+
+    Returns a function that formats it without gdb.
+    """
+    t = value.type.strip_typedefs()
+    if t.code == gdb.TYPE_CODE_PTR:
+        value = value.dereference()
+        t = value.type.strip_typedefs()
+    if find_field(t, "v_") is not None and find_field(t, "fName") is not None:
+        # STObject, or a class derived from it such as STLedgerEntry: only
+        # its memory is read here, decoding it is left to the worker
+        try:
+            start, finish = _fast_decoder._vector_bounds(value)
+            decoder = _fast_decoder.snapshot(start, finish)
+        except (gdb.error, gdb.MemoryError):
+            pass
+        else:
+            return lambda: json.dumps(decoder.decode_fields(start, finish), indent=2)
+    printer = printer_gen(value)
+    if printer is None or not hasattr(printer, "to_py_value"):
+        raise gdb.GdbError(f"No rippled printer can decode {value.type}")
+    # Json::Value and the rest are decoded into Python values here: their
+    # decoding is the tree walk, so there is nothing left to do off thread
+    # but the JSON formatting
+    py_value = printer.to_py_value()
+    return lambda: json.dumps(py_value, indent=2)
+
+
+class AsyncDecoder:
+    "The worker threads and the jobs they run."
+
+    def __init__(self):
+        self.executor = None
+        self.jobs = {}
+        self.next_id = 1
+
+    def submit(self, expr, output=None):
+        "Snapshot expr now and format it in the background. Returns the Job."
+        work = snapshot(gdb.parse_and_eval(expr))
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                ASYNC_WORKERS, thread_name_prefix="rippled-decode"
+            )
+        job = Job(self.next_id, expr, output)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, work, output)
+        job.future.add_done_callback(functools.partial(self._done, job))
+        return job
+
+    @staticmethod
+    def _run(work, output):
+        # runs on a worker thread: no gdb calls here
+        text = work()
+        if output is None:
+            return text
+        with open(output, "w") as f:
+            f.write(text + "\n")
+        return None
+
+    def _done(self, job, future):
+        # runs on the worker thread too; gdb.post_event is thread safe
+        gdb.post_event(functools.partial(self._report, job))
+
+    def _report(self, job):
+        if job.cancelled:
+            self.jobs.pop(job.id, None)
+            return
+        try:
+            text = job.future.result()
+        except Exception as e:
+            self.jobs.pop(job.id, None)
+            gdb.write(f"[{job.id}] {job.expr} failed: {e}\n", gdb.STDERR)
+            return
+        seconds = time.perf_counter() - job.started
+        if text is None:
+            self.jobs.pop(job.id, None)
+            gdb.write(
+                f"[{job.id}] {job.expr} written to {job.output} in {seconds:.2f} s\n"
+            )
+            return
+        gdb.write(f"[{job.id}] {job.expr} ({seconds:.2f} s):\n")
+        self._write(job, text, 0)
+
+    def _write(self, job, text, pos):
+        "Write text from pos, a chunk per gdb event, until done or cancelled."
+        if job.cancelled:
+            self.jobs.pop(job.id, None)
+            return
+        end = pos + ASYNC_WRITE_CHUNK
+        gdb.write(text[pos:end])
+        if end < len(text):
+            gdb.post_event(functools.partial(self._write, job, text, end))
+            return
+        gdb.write("\n")
+        self.jobs.pop(job.id, None)
+
+    def cancel(self, job_id):
+        "Cancel a job. Work already started is finished but never shown."
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        job.future.cancel()
+        return True
+
+
+async_decoder = AsyncDecoder()
+
+
+class JsonAsyncCommand(gdb.Command):
+    """Print a value as JSON in the background: rippled-json-async [--output FILE] EXPR
+
+    Like rippled-json, but for an STObject only the memory of its fields is
+    read right away. Decoding and formatting run on a worker thread and the
+    JSON is printed (or written to FILE) when it is ready, while gdb takes
+    other commands. Other values, such as Json::Value, are decoded before
+    the command returns; only their formatting is done in the background."""
+
+    def __init__(self):
+        super().__init__(
+            "rippled-json-async", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION
+        )
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        output = None
+        if args[:1] == ["--output"] and len(args) > 1:
+            args.pop(0)
+            output = args.pop(0)
+        if not args:
+            raise gdb.GdbError("usage: rippled-json-async [--output FILE] EXPR")
+        job = async_decoder.submit(" ".join(args), output)
+        gdb.write(f"[{job.id}] decoding {job.expr} in the background\n")
+
+
+class JobsCommand(gdb.Command):
+    """List or cancel background decodes: rippled-jobs [cancel ID]"""
+
+    def __init__(self):
+        super().__init__("rippled-jobs", gdb.COMMAND_STATUS)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        if not args:
+            if not async_decoder.jobs:
+                gdb.write("No background decodes.\n")
+            for job in async_decoder.jobs.values():
+                gdb.write(job.describe() + "\n")
+            return
+        if args[0] != "cancel" or len(args) != 2:
+            raise gdb.GdbError("usage: rippled-jobs [cancel ID]")
+        try:
+            job_id = int(args[1])
+        except ValueError:
+            raise gdb.GdbError("The job ID is a number")
+        if not async_decoder.cancel(job_id):
+            raise gdb.GdbError(f"No job {job_id}")
+
+
+JsonAsyncCommand()
+JobsCommand()
@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+# Base58 encoding for XRP Ledger identifiers.
+#
+# This module does not depend on gdb so it can be used outside of it.
+
+import functools
+from hashlib import sha256
+
+ALPHABET = b"rpshnaf39wBUDNEGHJKLM4PQRST7VWXYZ2bcdeCg65jkm8oFqi1tuvAxyz"
+_INDEX = {c: i for i, c in enumerate(ALPHABET)}
+
+# Number of encoded AccountIDs remembered by encode_account_id
+ACCOUNT_CACHE_SIZE = 4096
+
+# Divide by 58**10 so most of the work is done on small ints
+_CHUNK_DIGITS = 10
+_CHUNK = 58**_CHUNK_DIGITS
+
+
+def base58_encode(n):
+    l = []
+    while n >= _CHUNK:
+        n, r = divmod(n, _CHUNK)
+        for _ in range(_CHUNK_DIGITS):
+            r, d = divmod(r, 58)
+            l.append(ALPHABET[d])
+    while n > 0:
+        n, r = divmod(n, 58)
+        l.append(ALPHABET[r])
+    return bytes(reversed(l))
+
+
+def base58_encode_padded(s):
+    n = int.from_bytes(s, "big")
+    res = base58_encode(n)
+    pad = len(s) - len(s.lstrip(b"\0"))
+    return bytes([ALPHABET[0]] * pad) + res
+
+
+def base58_decode_padded(s):
+    "Inverse of base58_encode_padded. s is a str or bytes."
+    if isinstance(s, str):
+        s = s.encode("ascii")
+    n = 0
+    for c in s:
+        n = n * 58 + _INDEX[c]
+    body = n.to_bytes((n.bit_length() + 7) // 8, "big") if n else b""
+    pad = len(s) - len(s.lstrip(ALPHABET[0:1]))
+    return b"\0" * pad + body
+
+
+def checksum(b):
+    """Returns a 4-byte checksum of a binary."""
+    return sha256(sha256(b).digest()).digest()[:4]
+
+
+def encode(b, version):
+    vs = bytes((version,)) + b
+    check = checksum(vs)
+    return str(base58_encode_padded(vs + check), "ascii")
+
+
+def decode(s, version):
+    "Return the payload of a checksummed base58 string, or raise ValueError."
+    try:
+        raw = base58_decode_padded(s)
+    except KeyError:
+        raise ValueError(f"Invalid base58 character in {s}")
+    if len(raw) < 5 or checksum(raw[:-4]) != raw[-4:]:
+        raise ValueError(f"Bad checksum: {s}")
+    if raw[0] != version:
+        raise ValueError(f"Unexpected version {raw[0]}: {s}")
+    return raw[1:-4]
+
+
+@functools.lru_cache(maxsize=ACCOUNT_CACHE_SIZE)
+def encode_account_id(raw):
+    "Encode the raw 20 bytes of an AccountID. Results are kept in an LRU cache."
+    return encode(raw, 0)
+
+
+# The cached function itself: encode_account_id is replaced by a timing
+# wrapper while the printers are profiled
+_cached_encode_account_id = encode_account_id
+
+
+def decode_account_id(s):
+    "Return the raw 20 bytes of an encoded AccountID."
+    return decode(s, 0)
+
+
+def encode_many(raws):
+    "Encode a sequence of raw AccountIDs. Returns a list of strings."
+    return [encode_account_id(bytes(raw)) for raw in raws]
+
+
+def account_cache_stats():
+    "Return a dict with the encode_account_id cache counters."
+    info = _cached_encode_account_id.cache_info()
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+    }
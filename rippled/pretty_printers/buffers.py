@@ -1,7 +1,54 @@
 from rippled.pretty_printers.printers import *
-from rippled.pretty_printers.printers import _register_printer
+from rippled.pretty_printers.printers import _dumps, _register_printer
 
 import re
+import gdb
+
+from .layout import read_memory
+from .stobject import decode_serialized
+
+# Number of bytes the Buffer printer shows, None to show all of them
+BUFFER_PREVIEW_BYTES = 256
+# set to True to show Buffers as serialized STObjects when they decode as one
+BUFFER_DECODE_STOBJECT = False
+
+BYTES_PER_LINE = 16
+
+
+def buffer_range(value):
+    "Return (address, size) of the bytes held by a ripple::Buffer."
+    size = int(value["size_"])
+    if not size:
+        return 0, 0
+    return int(value["p_"]["_M_t"]["_M_head_impl"]), size
+
+
+def read_buffer(value, limit=None):
+    "Read the bytes of a ripple::Buffer, at most limit of them, in one read."
+    addr, size = buffer_range(value)
+    if limit is not None:
+        size = min(size, limit)
+    if not size:
+        return memoryview(b"")
+    return read_memory(addr, size)
+
+
+def hex_dump(mv, total=None):
+    """Format bytes as hex, BYTES_PER_LINE to a line.
+
+    If total is more than len(mv), the missing bytes are elided with a marker.
+    """
+    lines = [
+        mv[i : i + BYTES_PER_LINE].hex(" ") for i in range(0, len(mv), BYTES_PER_LINE)
+    ]
+    if total is not None and total > len(mv):
+        lines.append(f"... ({total - len(mv)} more bytes)")
+    return " \n  ".join(lines)
+
+
+def decode_buffer_stobject(value):
+    "Decode a Buffer holding a serialized STObject. Raises ValueError."
+    return decode_serialized(read_buffer(value))
 
 
 @_register_printer
@@ -15,11 +62,59 @@ class Buffer:
         self.value = value
 
     def to_string(self):
-        vals = []
-        array = self.value["p_"]["_M_t"]["_M_head_impl"]
-        for i in range(int(self.value["size_"])):
-            if i > 0 and not (i % 16):
-                vals.append("\n ")
-            vals.append(f"{int(array[i]):.2x}")
-        vals = " ".join(vals)
-        return "(Buffer: %s)\n{ %s }" % (self.value["size_"], vals)
+        size = buffer_range(self.value)[1]
+        if BUFFER_DECODE_STOBJECT and size:
+            try:
+                obj = decode_buffer_stobject(self.value)
+                return "(Buffer: %s)\n%s" % (size, _dumps(obj, indent=1))
+            except (ValueError, IndexError):
+                pass
+        mv = read_buffer(self.value, BUFFER_PREVIEW_BYTES)
+        return "(Buffer: %s)\n{ %s }" % (size, hex_dump(mv, size))
+
+
+class BufferCommand(gdb.Command):
+    """Dump a ripple::Buffer: rippled-buffer [--all | --bytes N] [--stobject] EXPR
+
+    Without options, the first BUFFER_PREVIEW_BYTES bytes are shown as hex.
+    --all shows every byte and --bytes N the first N. --stobject decodes the
+    bytes as a serialized STObject and prints it as JSON."""
+
+    def __init__(self):
+        super().__init__("rippled-buffer", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        limit = BUFFER_PREVIEW_BYTES
+        as_stobject = False
+        while args and args[0].startswith("--"):
+            opt = args.pop(0)
+            if opt == "--all":
+                limit = None
+            elif opt == "--bytes" and args:
+                try:
+                    limit = int(args.pop(0), 0)
+                except ValueError:
+                    raise gdb.GdbError("--bytes takes a number")
+            elif opt == "--stobject":
+                as_stobject = True
+            else:
+                raise gdb.GdbError(f"Unknown option {opt}")
+        if not args:
+            raise gdb.GdbError(
+                "usage: rippled-buffer [--all | --bytes N] [--stobject] EXPR"
+            )
+        value = gdb.parse_and_eval(" ".join(args))
+        if as_stobject:
+            try:
+                obj = decode_buffer_stobject(value)
+            except (ValueError, IndexError) as e:
+                raise gdb.GdbError(f"Not a serialized STObject: {e}")
+            gdb.write(_dumps(obj, indent=2) + "\n")
+            return
+        size = buffer_range(value)[1]
+        mv = read_buffer(value, limit)
+        gdb.write("(Buffer: %s)\n{ %s }\n" % (size, hex_dump(mv, size)))
+
+
+BufferCommand()
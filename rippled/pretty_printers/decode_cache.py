@@ -0,0 +1,123 @@
+# encoding: utf-8
+
+# Decoded values shared across prints.
+#
+# IDE frontends print the same watched values over and over, on every stop
+# and often several times per stop. The printers of the expensive types
+# (STObject, Json::Value, STAmount, strands) keep what they decoded here,
+# keyed by (address, type), along with a digest of memory read with one
+# bulk read. A value is only decoded again when its digest changes.
+#
+# A digest covering everything the value was decoded from makes the entry
+# persistent: it stays valid while the inferior runs. Other digests only
+# cover the start of the object (the root of a Json::Value tree, say), so
+# those entries are dropped whenever the inferior resumes or memory is
+# written from gdb.
+#
+# Decoded values include account labels, so every entry is dropped when
+# the labels change (rippled-load-accounts, or an edited label file).
+
+import collections
+import gdb
+import hashlib
+
+from . import known_accounts
+from .layout import read_memory
+
+# set to False to decode every value on every print
+DECODE_CACHE = True
+# Maximum number of decoded values kept
+DECODE_CACHE_SIZE = 1024
+
+
+def digest(*parts):
+    "Return a digest of bytes-like parts."
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part)
+    return h.digest()
+
+
+def memory_digest(addr, length):
+    "Return a digest of length bytes of memory at addr, read at once."
+    if length <= 0:
+        return digest(addr.to_bytes(8, "little"))
+    return digest(addr.to_bytes(8, "little"), read_memory(addr, length))
+
+
+class DecodeCache:
+    "LRU map of (address, type, ...) keys to a digest and a decoded value."
+
+    def __init__(self):
+        # key -> (digest, value, persistent)
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.labels_generation = known_accounts.registry.generation
+
+    def lookup(self, key, digest, decode, persistent=False):
+        """Return decode(), or what it returned for key when digest was the same.
+
+        Pass persistent=True if digest covers all the memory decode() reads.
+        """
+        if not DECODE_CACHE:
+            return decode()
+        generation = known_accounts.registry.poll()
+        if generation != self.labels_generation:
+            self.entries.clear()
+            self.labels_generation = generation
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == digest:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+        if entry is None:
+            self.misses += 1
+        else:
+            self.stale += 1
+        value = decode()
+        self.entries[key] = (digest, value, persistent)
+        self.entries.move_to_end(key)
+        while len(self.entries) > DECODE_CACHE_SIZE:
+            self.entries.popitem(last=False)
+        return value
+
+    def flush(self, everything=False):
+        "Drop the entries that aren't persistent, or all of them."
+        if everything:
+            self.entries.clear()
+            return
+        for key in [k for k, e in self.entries.items() if not e[2]]:
+            del self.entries[key]
+
+    def clear(self):
+        self.flush(everything=True)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "entries": len(self.entries),
+        }
+
+
+decode_cache = DecodeCache()
+
+
+def _on_resume(event):
+    decode_cache.flush()
+
+
+def _on_inferior_gone(event):
+    decode_cache.clear()
+
+
+gdb.events.cont.connect(_on_resume)
+gdb.events.memory_changed.connect(_on_resume)
+# inferior function calls can write memory too
+if hasattr(gdb.events, "inferior_call"):
+    gdb.events.inferior_call.connect(_on_resume)
+gdb.events.exited.connect(_on_inferior_gone)
+gdb.events.clear_objfiles.connect(_on_inferior_gone)
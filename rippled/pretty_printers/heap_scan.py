@@ -0,0 +1,294 @@
+# encoding: utf-8
+
+# Finding live objects by scanning the inferior's memory for their vtable.
+#
+# `rippled-ledger-entries` reads the heap in large chunks, looks for the
+# STLedgerEntry vtable pointer in each chunk with bytes.find, checks that
+# every match looks like a real STLedgerEntry and summarizes them by
+# LedgerEntryType. The objects themselves are only decoded on request.
+
+import gdb
+import re
+import struct
+import time
+
+from .layout import lookup_layout, pointer_format, read_memory
+from .printers import _dumps
+from .rtti import vtable_pointer
+from .stobject import _fast_decoder
+
+# Bytes read per read_memory call while scanning
+SCAN_CHUNK_SIZE = 64 << 20
+# STObjects with more fields than this are taken for false matches
+MAX_STOBJECT_FIELDS = 4096
+
+_PERMS_RE = re.compile(r"^[r-][w-][x-][ps]$")
+_CORE_SECTION_RE = re.compile(r"^\s*(0x[0-9a-fA-F]+) - (0x[0-9a-fA-F]+) is load\d+")
+
+
+def _process_heap_regions():
+    "The anonymous and [heap] writable mappings of a live process."
+    try:
+        out = gdb.execute("info proc mappings", to_string=True)
+    except gdb.error:
+        return []
+    regions = []
+    for line in out.splitlines():
+        words = line.split()
+        if len(words) < 4 or not words[0].startswith("0x"):
+            continue
+        # gdb 12 added a Perms column before the objfile
+        perms = None
+        rest = words[4:]
+        if rest and _PERMS_RE.match(rest[0]):
+            perms, rest = rest[0], rest[1:]
+        objfile = " ".join(rest)
+        if objfile not in ("", "[heap]") or (perms and "w" not in perms):
+            continue
+        regions.append((int(words[0], 16), int(words[1], 16)))
+    return regions
+
+
+def _core_regions():
+    "The load segments of a core file."
+    try:
+        out = gdb.execute("info files", to_string=True)
+    except gdb.error:
+        return []
+    regions = []
+    for line in out.splitlines():
+        m = _CORE_SECTION_RE.match(line)
+        if m:
+            regions.append((int(m.group(1), 16), int(m.group(2), 16)))
+    return regions
+
+
+def heap_regions():
+    """Return the (start, end) address ranges that may hold heap objects.
+
+    For a live process these are its anonymous and [heap] mappings. Core
+    files only list their file backed mappings there, so for them it's
+    every load segment of the core.
+    """
+    return _process_heap_regions() or _core_regions()
+
+
+def find_objects(regions, vptr, size, chunk_size=SCAN_CHUNK_SIZE):
+    """Yield (address, bytes) of the objects in regions starting with vptr.
+
+    Memory is read chunk_size bytes at a time. bytes are the size bytes at
+    address, taken from the chunk when they fit. Unreadable chunks are
+    skipped.
+    """
+    fmt = pointer_format()
+    needle = struct.pack(fmt, vptr)
+    align = len(needle)
+    for start, end in regions:
+        for chunk in range(start, end, chunk_size):
+            length = min(chunk_size, end - chunk)
+            try:
+                data = bytes(read_memory(chunk, length))
+            except gdb.MemoryError:
+                continue
+            i = data.find(needle)
+            while i >= 0:
+                addr = chunk + i
+                if not addr % align:
+                    if i + size <= length:
+                        yield addr, memoryview(data)[i : i + size]
+                    else:
+                        try:
+                            yield addr, read_memory(addr, size)
+                        except gdb.MemoryError:
+                            pass
+                i = data.find(needle, i + 1)
+
+
+class LedgerEntryLayout:
+    "Where STLedgerEntry keeps its fields, key and type."
+
+    def __init__(self):
+        tl = lookup_layout("ripple::STLedgerEntry")
+        self.layout = tl
+        self.size = tl.sizeof
+        self.vptr = vtable_pointer(tl.type)
+        self.ptr_fmt = pointer_format()
+        self.ptr_size = struct.calcsize(self.ptr_fmt)
+        self.stvar_size = lookup_layout("ripple::detail::STVar").sizeof
+        self.vector_offs = [
+            tl.offset("v_", "_M_impl", member)
+            for member in ("_M_start", "_M_finish", "_M_end_of_storage")
+        ]
+        self.type_off, self.type_size, type_type = tl.field("type_")
+        # LedgerEntryType value -> name
+        self.type_names = {}
+        try:
+            for f in type_type.strip_typedefs().fields():
+                self.type_names[f.enumval] = f.name.rsplit("::", 1)[-1]
+        except (TypeError, AttributeError):
+            pass
+
+    def vector(self, buf):
+        "Return the start, finish and end of storage of v_."
+        fmt = self.ptr_fmt
+        return [struct.unpack_from(fmt, buf, off)[0] for off in self.vector_offs]
+
+    def entry_type(self, buf):
+        return int.from_bytes(
+            buf[self.type_off : self.type_off + self.type_size], "little"
+        )
+
+    def type_name(self, entry_type):
+        name = self.type_names.get(entry_type)
+        return name if name is not None else f"0x{entry_type:04x}"
+
+    def check(self, buf):
+        "Return the LedgerEntryType if buf looks like an STLedgerEntry, else None."
+        start, finish, end = self.vector(buf)
+        if not start <= finish <= end or start % self.ptr_size:
+            return None
+        if (finish - start) % self.stvar_size or (end - start) % self.stvar_size:
+            return None
+        if (end - start) // self.stvar_size > MAX_STOBJECT_FIELDS:
+            return None
+        entry_type = self.entry_type(buf)
+        if self.type_names and entry_type not in self.type_names:
+            return None
+        return entry_type
+
+    def key(self, buf):
+        return self.layout.bytes_at(buf, "key_", "data_").hex().upper()
+
+    def decode(self, addr):
+        "Return (type name, key, fields) of the STLedgerEntry at addr."
+        buf = self.layout.read(addr)
+        start, finish, _ = self.vector(buf)
+        fields = _fast_decoder.decode_fields(start, finish)
+        return self.type_name(self.entry_type(buf)), self.key(buf), fields
+
+
+_entry_layout = None
+
+
+def ledger_entry_layout():
+    "Return the (cached) LedgerEntryLayout of the inferior."
+    global _entry_layout
+    if _entry_layout is None:
+        _entry_layout = LedgerEntryLayout()
+    return _entry_layout
+
+
+def _on_objfiles_changed(event):
+    global _entry_layout
+    _entry_layout = None
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
+
+
+class LedgerEntryScan:
+    "The STLedgerEntrys found in the inferior's heap."
+
+    def __init__(self, keep=0):
+        self.entry_layout = ledger_entry_layout()
+        # LedgerEntryType -> [count, bytes]
+        self.by_type = {}
+        # (address, bytes) of the first keep entries
+        self.kept = []
+        self.keep = keep
+        self.candidates = 0
+        self.scanned = 0
+        self.regions = 0
+        self.seconds = 0.0
+
+    def run(self, regions):
+        L = self.entry_layout
+        begin = time.perf_counter()
+        for addr, buf in find_objects(regions, L.vptr, L.size):
+            self.candidates += 1
+            entry_type = L.check(buf)
+            if entry_type is None:
+                continue
+            start, _, end = L.vector(buf)
+            totals = self.by_type.setdefault(entry_type, [0, 0])
+            totals[0] += 1
+            # the object and its field vector; field payloads too big to
+            # be stored inline in their STVar are not counted
+            totals[1] += L.size + end - start
+            if len(self.kept) < self.keep:
+                self.kept.append((addr, bytes(buf)))
+        self.regions = len(regions)
+        self.scanned = sum(end - start for start, end in regions)
+        self.seconds = time.perf_counter() - begin
+        return self
+
+    def count(self):
+        return sum(c for c, _ in self.by_type.values())
+
+    def summary(self):
+        "Return (type name, count, bytes) rows, most common first."
+        rows = [
+            (self.entry_layout.type_name(t), c, b) for t, (c, b) in self.by_type.items()
+        ]
+        rows.sort(key=lambda r: (-r[1], r[0]))
+        return rows
+
+    def decoded(self):
+        "Yield (address, type name, key, fields) for the entries kept."
+        L = self.entry_layout
+        for addr, buf in self.kept:
+            start, finish, _ = L.vector(buf)
+            try:
+                fields = _fast_decoder.decode_fields(start, finish)
+            except (gdb.error, gdb.MemoryError) as e:
+                fields = {"error": str(e)}
+            yield addr, L.type_name(L.entry_type(buf)), L.key(buf), fields
+
+
+class LedgerEntriesCommand(gdb.Command):
+    """Find the STLedgerEntrys in memory: rippled-ledger-entries [--decode N]
+
+    The heap is scanned for the STLedgerEntry vtable, and the entries found
+    are counted by LedgerEntryType along with the bytes they use. --decode N
+    also prints the first N entries found, one JSON line each."""
+
+    def __init__(self):
+        super().__init__("rippled-ledger-entries", gdb.COMMAND_DATA)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        keep = 0
+        if args[:1] == ["--decode"] and len(args) == 2:
+            try:
+                keep = int(args[1], 0)
+            except ValueError:
+                raise gdb.GdbError("--decode takes a number")
+        elif args:
+            raise gdb.GdbError("usage: rippled-ledger-entries [--decode N]")
+        regions = heap_regions()
+        if not regions:
+            raise gdb.GdbError("No heap mappings found. Is there a process or core?")
+        try:
+            scan = LedgerEntryScan(keep).run(regions)
+        except gdb.error as e:
+            raise gdb.GdbError(f"Cannot scan for ledger entries: {e}")
+
+        gdb.write(
+            f"Scanned {scan.scanned / 2**20:.1f} MiB in {scan.regions} regions"
+            f" in {scan.seconds:.2f} s: {scan.count()} ledger entries"
+            f" ({scan.candidates} vtable matches)\n"
+        )
+        rows = scan.summary()
+        if rows:
+            width = max(len(r[0]) for r in rows)
+            gdb.write(f"  {'type':<{width}} {'count':>9} {'bytes':>12}\n")
+        for name, count, size in rows:
+            gdb.write(f"  {name:<{width}} {count:>9} {size:>12}\n")
+        for addr, name, key, fields in scan.decoded():
+            entry = {"address": f"0x{addr:x}", "type": name, "key": key}
+            entry["fields"] = fields
+            gdb.write(_dumps(entry) + "\n")
+
+
+LedgerEntriesCommand()
@@ -0,0 +1,242 @@
+# encoding: utf-8
+
+# Opt-in profiling of the printers.
+#
+# `rippled-printer-stats on` wraps printer dispatch, every registered
+# printer's to_string, to_py_value and children, base58 encoding, the
+# printers' JSON formatting (printers._dumps) and layout.read_memory with
+# counters. `rippled-printer-stats` shows where the time went. `off` puts
+# the original functions back, so nothing is wrapped, and nothing costs
+# anything, unless profiling is on.
+
+import functools
+import gdb
+import json
+import time
+
+from . import base58
+from . import layout
+from . import printers
+from . import uint_format
+from .amount_format import amount_cache_stats
+from .decode_cache import decode_cache
+from .printers import Printer_Gen, printer_gen
+from .rtti import resolver
+from .snapshot import snapshots
+
+# Printer methods that are timed
+PRINTER_METHODS = ("to_string", "to_py_value", "children")
+
+
+class _Stat:
+    __slots__ = ("calls", "seconds", "reads", "bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.reads = 0
+        self.bytes = 0
+
+
+class _TimedIterator:
+    "Times each step of an iterator, such as the one children() returns."
+
+    def __init__(self, instrumentation, name, it):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.it = it
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.instrumentation.call(self.name, next, self.it, count=False)
+
+
+class Instrumentation:
+    """Call counts, cumulative wall time and memory read by each printer.
+
+    Times are inclusive: a printer's time includes the printers it calls.
+    Memory reads are charged to the innermost printer running.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.stack = []
+        # (owner, attribute, what owner.__dict__ held, or None if inherited)
+        self.patches = []
+
+    def reset(self):
+        self.stats.clear()
+
+    def _stat(self, name):
+        s = self.stats.get(name)
+        if s is None:
+            s = self.stats[name] = _Stat()
+        return s
+
+    def call(self, name, f, *args, count=True, **kwargs):
+        "Call f, charging the call and its time to name."
+        s = self._stat(name)
+        if count:
+            s.calls += 1
+        self.stack.append(s)
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            s.seconds += time.perf_counter() - start
+            self.stack.pop()
+
+    def _read(self, addr, length):
+        s = self._stat("read_memory")
+        s.calls += 1
+        start = time.perf_counter()
+        try:
+            return layout.raw_read_memory(addr, length)
+        finally:
+            s.seconds += time.perf_counter() - start
+            s.reads += 1
+            s.bytes += length
+            if self.stack:
+                self.stack[-1].reads += 1
+                self.stack[-1].bytes += length
+
+    ### Patching
+
+    def _patch(self, owner, attr, wrapper):
+        original = getattr(owner, attr)
+        self.patches.append((owner, attr, vars(owner).get(attr)))
+        patched = functools.wraps(original)(wrapper(original))
+        # keep lru_cache's methods working on the wrapper
+        for name in ("cache_info", "cache_clear"):
+            if hasattr(original, name):
+                setattr(patched, name, getattr(original, name))
+        setattr(owner, attr, patched)
+
+    def _timed(self, name):
+        def wrapper(f):
+            return lambda *args, **kwargs: self.call(name, f, *args, **kwargs)
+
+        return wrapper
+
+    def _timed_iter(self, name):
+        def wrapper(f):
+            def g(*args, **kwargs):
+                it = self.call(name, f, *args, **kwargs)
+                return _TimedIterator(self, name, iter(it))
+
+            return g
+
+        return wrapper
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._patch(Printer_Gen, "__call__", self._timed("dispatch"))
+        self._patch(Printer_Gen, "_lookup", self._timed("dispatch: type matching"))
+        for subprinter in printer_gen.subprinters:
+            Printer = subprinter.Printer
+            for method in PRINTER_METHODS:
+                if not hasattr(Printer, method):
+                    continue
+                name = f"{Printer.printer_name}.{method}"
+                if method == "children":
+                    self._patch(Printer, method, self._timed_iter(name))
+                else:
+                    self._patch(Printer, method, self._timed(name))
+        for module in (base58, uint_format):
+            self._patch(module, "encode_account_id", self._timed("base58"))
+            self._patch(module, "encode_many", self._timed("base58"))
+        printers.dumps_hook = self._timed("json.dumps")(json.dumps)
+        layout.read_hook = self._read
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        layout.read_hook = None
+        printers.dumps_hook = None
+        for owner, attr, original in reversed(self.patches):
+            if original is not None:
+                setattr(owner, attr, original)
+            else:
+                delattr(owner, attr)
+        self.patches.clear()
+        self.stack.clear()
+
+    def report(self):
+        "Return the counters as a list of dicts, slowest first."
+        rows = [
+            {
+                "name": name,
+                "calls": s.calls,
+                "seconds": s.seconds,
+                "reads": s.reads,
+                "bytes": s.bytes,
+            }
+            for name, s in self.stats.items()
+        ]
+        rows.sort(key=lambda r: r["seconds"], reverse=True)
+        return rows
+
+
+instrumentation = Instrumentation()
+
+
+class PrinterStatsCommand(gdb.Command):
+    """Profile the rippled printers: rippled-printer-stats [on|off|reset]
+
+    on starts counting calls, time and memory read per printer, off stops,
+    reset clears the counters. Without an argument the counters are shown,
+    along with the hit rates of the printers' caches."""
+
+    def __init__(self):
+        super().__init__("rippled-printer-stats", gdb.COMMAND_STATUS)
+
+    def invoke(self, arg, from_tty):
+        arg = arg.strip()
+        if arg == "on":
+            instrumentation.enable()
+        elif arg == "off":
+            instrumentation.disable()
+        elif arg == "reset":
+            instrumentation.reset()
+        elif arg:
+            raise gdb.GdbError("usage: rippled-printer-stats [on|off|reset]")
+        else:
+            self._show()
+
+    def _show(self):
+        state = "on" if instrumentation.enabled else "off"
+        gdb.write(f"Profiling is {state}.\n")
+        rows = instrumentation.report()
+        if rows:
+            width = max(len(r["name"]) for r in rows)
+            gdb.write(
+                f"{'':<{width}} {'calls':>9} {'total ms':>10} {'avg us':>9}"
+                f" {'reads':>8} {'bytes':>11}\n"
+            )
+        for r in rows:
+            avg = r["seconds"] * 1e6 / r["calls"] if r["calls"] else 0.0
+            gdb.write(
+                f"{r['name']:<{width}} {r['calls']:>9} {r['seconds'] * 1e3:>10.3f}"
+                f" {avg:>9.1f} {r['reads']:>8} {r['bytes']:>11}\n"
+            )
+        caches = {
+            "dispatch": printer_gen.cache_stats(),
+            "rtti": resolver.stats(),
+            "accounts": base58.account_cache_stats(),
+            "decoded values": decode_cache.stats(),
+            "snapshots": snapshots.stats(),
+            **{f"amounts.{k}": v for k, v in amount_cache_stats().items()},
+        }
+        gdb.write("Caches:\n")
+        for name, c in caches.items():
+            counts = ", ".join(f"{k} {v}" for k, v in c.items())
+            gdb.write(f"  {name}: {counts}\n")
+
+
+PrinterStatsCommand()
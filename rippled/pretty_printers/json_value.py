@@ -1,10 +1,15 @@
 from rippled.pretty_printers.printers import *
-from rippled.pretty_printers.printers import _register_printer
+from rippled.pretty_printers.printers import _dumps, _register_printer
 
 import re
-import json
+import struct
+import gdb
 from libstdcxx.v6.printers import StdMapPrinter
 
+from . import rbtree
+from .decode_cache import decode_cache, memory_digest
+from .layout import field_path, layout_of, read_memory
+
 
 @_register_printer
 class JsonValueCZString:
@@ -40,6 +45,23 @@ class JsonValue:
         self.value = value
 
     def to_py_value(self):
+        try:
+            addr = self._address()
+            return decode_cache.lookup(
+                (addr, "Json::Value"),
+                memory_digest(addr, self.value.type.sizeof),
+                lambda: _walker.decode(addr),
+            )
+        except gdb.error:
+            return self._to_py_value_slow()
+
+    def _address(self):
+        addr = self.value.address
+        if addr is None:
+            raise gdb.error("Json::Value is not in memory")
+        return int(addr)
+
+    def _to_py_value_slow(self):
         value_type = self.value["type_"]
         match value_type:
             case JsonValue.nullValue:
@@ -63,11 +85,221 @@ class JsonValue:
                     if not i % 2:
                         k = v["cstr_"].string()
                     else:
-                        d[k] = JsonValue(v).to_py_value()
+                        d[k] = JsonValue(v)._to_py_value_slow()
                 return d
             case JsonValue.arrayValue:
-                return self.value["value_"]["map_"].dereference()
+                m = self.value["value_"]["map_"].dereference()
+                map_printer = StdMapPrinter(typename="", val=m)
+                return [
+                    JsonValue(v)._to_py_value_slow()
+                    for i, (_, v) in enumerate(map_printer.children())
+                    if i % 2
+                ]
+
+    def _is_container(self):
+        return int(self.value["type_"]) in (JsonValue.objectValue, JsonValue.arrayValue)
+
+    def _map_size(self):
+        m = self.value["value_"]["map_"]
+        if not m:
+            return 0
+        return int(m.dereference()["_M_t"]["_M_impl"]["_M_node_count"])
+
+    def children(self):
+        # Members are decoded as gdb asks for them, so `print elements` and
+        # frontends that page through children only pay for what they show.
+        value_type = int(self.value["type_"])
+        if not self._is_container() or not self._map_size():
+            return
+        try:
+            members = _walker.iter_members(self._address())
+        except gdb.error:
+            members = None
+        if members is not None:
+            for i, (k, v) in enumerate(members):
+                if value_type == JsonValue.objectValue:
+                    yield f"[{2 * i}]", k
+                    yield f"[{2 * i + 1}]", v
+                else:
+                    yield f"[{i}]", v
+            return
+        m = self.value["value_"]["map_"].dereference()
+        map_printer = StdMapPrinter(typename="", val=m)
+        for i, (_, v) in enumerate(map_printer.children()):
+            if value_type == JsonValue.objectValue:
+                if not i % 2:
+                    v = v["cstr_"].string()
+                yield f"[{i}]", v
+            elif i % 2:
+                yield f"[{i // 2}]", v
+
+    def display_hint(self):
+        match int(self.value["type_"]):
+            case JsonValue.objectValue:
+                return "map"
+            case JsonValue.arrayValue:
+                return "array"
+        return None
 
     def to_string(self):
+        if self._is_container():
+            if self._map_size():
+                return None
+            if int(self.value["type_"]) == JsonValue.objectValue:
+                return "{}"
+            return "[]"
         d = self.to_py_value()
-        return json.dumps(d, indent=2)
+        return _dumps(d, indent=2)
+
+
+###
+### Json::Value walker.
+###
+### Decodes a Json::Value by walking the red-black trees of its objects and
+### arrays node by node (one read_memory per node) without recursion.
+### Arrays are maps keyed by index, so they are walked the same way.
+###
+
+
+def _read_cstring(addr, chunk=256):
+    parts = []
+    while True:
+        try:
+            buf = bytes(read_memory(addr, chunk))
+        except gdb.MemoryError:
+            if chunk == 1:
+                raise
+            chunk //= 16
+            continue
+        end = buf.find(b"\0")
+        if end >= 0:
+            parts.append(buf[:end])
+            return b"".join(parts).decode("utf-8", errors="replace")
+        parts.append(buf)
+        addr += chunk
+
+
+def _int_at(mv, base, field, signed=False):
+    off, size = field
+    return int.from_bytes(mv[base + off : base + off + size], "little", signed=signed)
+
+
+class _JsonWalker:
+    "Decodes Json::Values straight from memory."
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.layout = None
+
+    def _layout(self):
+        if self.layout is None:
+            value_t = gdb.lookup_type("Json::Value").strip_typedefs()
+            value_off, holder_t = field_path(value_t, "value_")
+            holder_t = holder_t.strip_typedefs()
+
+            def member(name):
+                off, ft = field_path(holder_t, name)
+                return value_off + off, ft.sizeof
+
+            map_t = field_path(holder_t, "map_")[1].strip_typedefs().target()
+            cz_t = gdb.lookup_type("Json::Value::CZString").strip_typedefs()
+            ptr_size = gdb.lookup_type("void").pointer().sizeof
+            self.layout = {
+                "size": value_t.sizeof,
+                "type": layout_of(value_t).field("type_")[:2],
+                "int": member("int_"),
+                "uint": member("uint_"),
+                "real": member("real_"),
+                "bool": member("bool_"),
+                "string": member("string_"),
+                "map": member("map_"),
+                "cstr": field_path(cz_t, "cstr_")[0],
+                "index": layout_of(cz_t).field("index_")[:2],
+                "tree": rbtree.layout_for(map_t),
+                "value_ptr": value_t.pointer(),
+                "ptr_fmt": "<Q" if ptr_size == 8 else "<I",
+            }
+        return self.layout
+
+    def _members(self, map_addr, value_type):
+        "Iterate over (key, node bytes) of an object's or array's map."
+        L = self.layout
+        tree = L["tree"]
+        for node, node_bytes in tree.iter_nodes(map_addr):
+            key_off = tree.key_off
+            if value_type == JsonValue.objectValue:
+                cstr = struct.unpack_from(L["ptr_fmt"], node_bytes, key_off + L["cstr"])
+                key = _read_cstring(cstr[0])
+            else:
+                key = _int_at(node_bytes, key_off, L["index"])
+            yield key, node, node_bytes
+
+    def iter_members(self, addr):
+        """Iterate over (key, Json::Value gdb.Value) of the object or array at addr.
+
+        Keys are strings for objects and indexes for arrays.
+        """
+        L = self._layout()
+        mv = read_memory(addr, L["size"])
+        value_type = mv[L["type"][0]]
+        map_addr = struct.unpack_from(L["ptr_fmt"], mv, L["map"][0])[0]
+        if not map_addr:
+            return iter(())
+        value_off = L["tree"].value_off
+        return (
+            (key, gdb.Value(node + value_off).cast(L["value_ptr"]).dereference())
+            for key, node, _ in self._members(map_addr, value_type)
+        )
+
+    def decode(self, addr):
+        "Return the Json::Value at addr as Python values."
+        L = self._layout()
+        value_off = L["tree"].value_off
+        result = [None]
+        # (bytes holding the value, offset of the value in them, parent, key)
+        todo = [(read_memory(addr, L["size"]), 0, result, 0)]
+        while todo:
+            mv, off, parent, key = todo.pop()
+            match _int_at(mv, off, L["type"]):
+                case JsonValue.nullValue:
+                    parent[key] = None
+                case JsonValue.intValue:
+                    parent[key] = _int_at(mv, off, L["int"], True)
+                case JsonValue.uintValue:
+                    parent[key] = _int_at(mv, off, L["uint"])
+                case JsonValue.realValue:
+                    parent[key] = struct.unpack_from("<d", mv, off + L["real"][0])[0]
+                case JsonValue.stringValue:
+                    parent[key] = _read_cstring(_int_at(mv, off, L["string"]))
+                case JsonValue.booleanValue:
+                    parent[key] = bool(_int_at(mv, off, L["bool"]))
+                case JsonValue.objectValue | JsonValue.arrayValue as value_type:
+                    map_addr = _int_at(mv, off, L["map"])
+                    members = []
+                    if map_addr:
+                        members = list(self._members(map_addr, value_type))
+                    if value_type == JsonValue.objectValue:
+                        container = {}
+                        for k, _, node_bytes in members:
+                            # keep the map's key order
+                            container[k] = None
+                            todo.append((node_bytes, value_off, container, k))
+                    else:
+                        container = [None] * len(members)
+                        for i, (_, _, node_bytes) in enumerate(members):
+                            todo.append((node_bytes, value_off, container, i))
+                    parent[key] = container
+        return result[0]
+
+
+_walker = _JsonWalker()
+
+
+def _on_objfiles_changed(event):
+    _walker.clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
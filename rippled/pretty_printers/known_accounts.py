@@ -127,3 +127,254 @@ known_accounts = {
     "r4M2Vf2L8DibeSURBFRpNBkSTPje1ftJLj": "XYZ",
     "rrrrrrrrrrrrrrrrrrrrBZbvji": "noAccount (account 1)",
 }
+
+
+###
+### Account label files.
+###
+### Large sets of labels (exchanges, gateways, AMM pseudo-accounts, ...) can be
+### loaded from files. A CSV file has one "address,label" row per account. A
+### JSON file is either an object mapping address to label, or a list of
+### objects with "address" and "label" (or "name") keys. Addresses may be
+### base58 or 40 hex digits. Everything is indexed by the raw 20 byte
+### AccountID, so labelled accounts never need to be base58 encoded.
+###
+### This part of the module does not depend on gdb.
+###
+
+import contextlib
+import csv
+import json
+import mmap
+import os
+import threading
+import time
+
+from .base58 import decode_account_id
+
+# Seconds between checks for changes to loaded files
+RELOAD_CHECK_INTERVAL = 2.0
+# Labels appended to the last CSV file are kept apart, in an overlay, until
+# there are this many; then they are merged into the index
+OVERLAY_MERGE_SIZE = 4096
+
+# What loading a bad, half written or missing label file raises
+LOAD_ERRORS = (OSError, ValueError, KeyError)
+
+
+def _raw_account_id(address):
+    "Return the raw 20 bytes of a base58 or hex address, or None if invalid."
+    address = address.strip()
+    if len(address) == 40:
+        try:
+            return bytes.fromhex(address)
+        except ValueError:
+            pass
+    try:
+        raw = decode_account_id(address)
+    except ValueError:
+        return None
+    return raw if len(raw) == 20 else None
+
+
+class AccountLabelFile:
+    "Account labels read from a CSV or JSON file."
+
+    def __init__(self, path, use_mmap=False):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.use_mmap = use_mmap
+        self.is_json = self.path.endswith(".json")
+        self.labels = {}
+        self.stat = None
+        # end of the last complete CSV line that has been parsed
+        self.offset = 0
+
+    @contextlib.contextmanager
+    def _open(self):
+        "Yield (file-like object, os.stat_result) of the file."
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if self.use_mmap and not self.is_json and st.st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    yield m, st
+            else:
+                yield f, st
+
+    def _parse_json(self, data):
+        labels = {}
+        d = json.loads(data) if data.strip() else {}
+        if isinstance(d, dict):
+            items = d.items()
+        elif isinstance(d, list) and all(isinstance(e, dict) for e in d):
+            items = [(e.get("address"), e.get("label", e.get("name"))) for e in d]
+        else:
+            raise ValueError(f"{self.path}: expected an object or a list of objects")
+        for address, label in items:
+            if not isinstance(address, str):
+                raise ValueError(f"{self.path}: address {address!r} is not a string")
+            raw = _raw_account_id(address)
+            if raw is not None and label is not None:
+                labels[raw] = str(label)
+        return labels
+
+    @staticmethod
+    def _parse_csv(source, start):
+        """Parse the CSV lines of source from start, one line at a time.
+
+        Returns (labels, end of the last complete line). A partial last
+        line is left to be picked up later.
+        """
+        source.seek(start)
+        lines = []
+        end = start
+        for line in iter(source.readline, b""):
+            if not line.endswith(b"\n"):
+                break
+            lines.append(line.decode("utf-8", errors="replace"))
+            end += len(line)
+        labels = {}
+        for row in csv.reader(lines):
+            if len(row) < 2:
+                continue
+            raw = _raw_account_id(row[0])
+            if raw is not None:
+                labels[raw] = row[1].strip()
+        return labels, end
+
+    def load(self):
+        """Read the whole file. Returns the labels.
+
+        Nothing is changed if the file can't be read or parsed.
+        """
+        with self._open() as (source, st):
+            if self.is_json:
+                labels, offset = self._parse_json(source.read()), 0
+            else:
+                labels, offset = self._parse_csv(source, 0)
+        self.stat = st
+        self.labels = labels
+        self.offset = offset
+        return self.labels
+
+    def refresh(self):
+        """Re-read the file if it changed.
+
+        Returns None if nothing changed, a dict of new labels if only complete
+        CSV lines were appended, or True if the file was fully reloaded.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        old = self.stat
+        if old is not None and (st.st_mtime_ns, st.st_size) == (
+            old.st_mtime_ns,
+            old.st_size,
+        ):
+            return None
+        appended = (
+            old is not None
+            and not self.is_json
+            and st.st_ino == old.st_ino
+            and st.st_size > old.st_size
+        )
+        try:
+            if not appended:
+                self.load()
+                return True
+            with self._open() as (source, st):
+                added, offset = self._parse_csv(source, self.offset)
+        except LOAD_ERRORS:
+            # half written or just deleted: keep the labels we have, and
+            # try again on the next check
+            return None
+        self.stat = st
+        self.offset = offset
+        self.labels.update(added)
+        return added
+
+
+class KnownAccounts:
+    """Index of raw AccountID -> label over the built-in names and label files.
+
+    Labels can be looked up from any thread, such as the background decode
+    workers, but the files are only checked from the main thread, and the
+    index and its overlay are replaced rather than changed in place.
+    """
+
+    def __init__(self, builtin):
+        self.builtin = {}
+        for address, label in builtin.items():
+            raw = _raw_account_id(address)
+            if raw is not None:
+                self.builtin[raw] = label
+        self.files = []
+        self.last_check = 0.0
+        # bumped whenever labels change, so formatted values can be dropped
+        self.generation = 0
+        self._rebuild()
+
+    def _rebuild(self):
+        index = dict(self.builtin)
+        for f in self.files:
+            index.update(f.labels)
+        self.index = index
+        self.overlay = {}
+        self.generation += 1
+
+    def load_file(self, path, use_mmap=False):
+        "Load labels from path. Later files take precedence. Returns the count."
+        path = os.path.abspath(os.path.expanduser(path))
+        self.files = [f for f in self.files if f.path != path]
+        f = AccountLabelFile(path, use_mmap)
+        f.load()
+        self.files.append(f)
+        self._rebuild()
+        return len(f.labels)
+
+    def unload_files(self):
+        self.files = []
+        self._rebuild()
+
+    def check_files(self):
+        "Pick up changes to the loaded files."
+        self.last_check = time.monotonic()
+        rebuild = False
+        for i, f in enumerate(self.files):
+            changed = f.refresh()
+            if changed is True or (changed and i != len(self.files) - 1):
+                # a full reload, or new labels that later files may override
+                rebuild = True
+            elif changed:
+                # appended to the last file: only the overlay is copied
+                overlay = dict(self.overlay)
+                overlay.update(changed)
+                if len(overlay) >= OVERLAY_MERGE_SIZE:
+                    rebuild = True
+                else:
+                    self.overlay = overlay
+                    self.generation += 1
+        if rebuild:
+            self._rebuild()
+
+    def poll(self):
+        """Pick up changes to the loaded files if it's time to check again.
+
+        Returns the generation of the labels. Other threads don't check.
+        """
+        if (
+            self.files
+            and time.monotonic() - self.last_check > RELOAD_CHECK_INTERVAL
+            and threading.current_thread() is threading.main_thread()
+        ):
+            self.check_files()
+        return self.generation
+
+    def label(self, raw):
+        "Return the label for the raw 20 byte AccountID, or None."
+        self.poll()
+        label = self.overlay.get(raw)
+        return label if label is not None else self.index.get(raw)
+
+
+registry = KnownAccounts(known_accounts)
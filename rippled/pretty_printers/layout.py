@@ -0,0 +1,187 @@
+# encoding: utf-8
+
+# Type layout cache shared by the printers.
+#
+# A TypeLayout resolves field offsets, sizes and template arguments of a
+# gdb.Type once. Printers can then read sizeof(T) bytes with a single
+# read_memory call and decode fields from that buffer, instead of chaining
+# string-keyed gdb.Value lookups for every field of every value printed.
+#
+# Layouts hold gdb.Types, so they are dropped whenever objfiles change.
+
+import gdb
+import struct
+
+from gdb.types import get_basic_type
+
+
+def find_field(t, name):
+    "Return (byte offset, gdb.Field) of field name in t, searching base classes."
+    for f in t.fields():
+        if f.name == name:
+            return f.bitpos // 8, f
+    for f in t.fields():
+        if f.is_base_class:
+            r = find_field(f.type.strip_typedefs(), name)
+            if r is not None:
+                return f.bitpos // 8 + r[0], r[1]
+    return None
+
+
+def field_path(t, *names):
+    "Return (byte offset, field type) of a nested field path in t."
+    offset = 0
+    for name in names:
+        r = find_field(t.strip_typedefs(), name)
+        if r is None:
+            raise gdb.error(f"No field {name} in {t}")
+        offset += r[0]
+        t = r[1].type
+    return offset, t
+
+
+class TypeLayout:
+    "Field offsets, sizes and template arguments of one gdb.Type."
+
+    def __init__(self, t):
+        self.type = t.strip_typedefs()
+        self.name = str(self.type)
+        self.sizeof = self.type.sizeof
+        self.ptr_fmt = pointer_format()
+        self._fields = {}
+        self._type_names = {}
+        self._template_args = None
+
+    def field(self, *path):
+        "Return (offset, size, gdb.Type) of a field path. Bitfields are supported."
+        r = self._fields.get(path)
+        if r is None:
+            offset, t = field_path(self.type, *path[:-1]) if path[:-1] else (0, None)
+            parent = t.strip_typedefs() if t is not None else self.type
+            found = find_field(parent, path[-1])
+            if found is None:
+                raise gdb.error(f"No field {path[-1]} in {parent}")
+            off, f = found
+            size = f.bitsize // 8 if f.bitsize else f.type.sizeof
+            r = self._fields[path] = (offset + off, size, f.type)
+        return r
+
+    def offset(self, *path):
+        return self.field(*path)[0]
+
+    def size(self, *path):
+        return self.field(*path)[1]
+
+    def field_type(self, *path):
+        return self.field(*path)[2]
+
+    def type_name(self, *path):
+        "Return the name of the basic type of a field, as printers match it."
+        name = self._type_names.get(path)
+        if name is None:
+            name = self._type_names[path] = str(get_basic_type(self.field_type(*path)))
+        return name
+
+    def template_args(self):
+        "Return the template arguments of the type as a tuple."
+        if self._template_args is None:
+            args = []
+            while True:
+                try:
+                    args.append(self.type.template_argument(len(args)))
+                except RuntimeError:
+                    break
+            self._template_args = tuple(args)
+        return self._template_args
+
+    def read(self, addr):
+        "Read the sizeof(T) bytes of the object at addr."
+        return read_memory(addr, self.sizeof)
+
+    def int_at(self, buf, *path, signed=False):
+        off, size, _ = self.field(*path)
+        return int.from_bytes(buf[off : off + size], "little", signed=signed)
+
+    def ptr_at(self, buf, *path):
+        return struct.unpack_from(self.ptr_fmt, buf, self.offset(*path))[0]
+
+    def bytes_at(self, buf, *path):
+        off, size, _ = self.field(*path)
+        return bytes(buf[off : off + size])
+
+
+_layouts = {}
+_lookup_cache = {}
+_ptr_fmt = None
+
+
+def layout_of(t):
+    "Return the cached TypeLayout of a gdb.Type."
+    key = t.name or str(t)
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = TypeLayout(t)
+        _layouts[key] = _layouts[layout.name] = layout
+    return layout
+
+
+def lookup_layout(type_name):
+    "Return the cached TypeLayout of a named type."
+    layout = _lookup_cache.get(type_name)
+    if layout is None:
+        layout = _lookup_cache[type_name] = layout_of(gdb.lookup_type(type_name))
+    return layout
+
+
+def pointer_format():
+    "struct format of a target pointer."
+    global _ptr_fmt
+    if _ptr_fmt is None:
+        size = gdb.lookup_type("void").pointer().sizeof
+        _ptr_fmt = "<Q" if size == 8 else "<I"
+    return _ptr_fmt
+
+
+# Set by instrument.py while profiling; called instead of the plain read.
+read_hook = None
+
+
+def read_memory(addr, length):
+    "Read inferior memory. All bulk reads done by the printers go through here."
+    if read_hook is not None:
+        return read_hook(addr, length)
+    return memoryview(gdb.selected_inferior().read_memory(addr, length))
+
+
+def raw_read_memory(addr, length):
+    "read_memory without the profiling hook."
+    return memoryview(gdb.selected_inferior().read_memory(addr, length))
+
+
+def referenced(value):
+    "Return the value a reference gdb.Value refers to, or value itself."
+    code = value.type.strip_typedefs().code
+    if code == gdb.TYPE_CODE_REF or code == getattr(gdb, "TYPE_CODE_RVALUE_REF", None):
+        return value.referenced_value()
+    return value
+
+
+def value_address(value):
+    "Return the address of a gdb.Value as an int, or None if it isn't in memory."
+    addr = value.address
+    return None if addr is None else int(addr)
+
+
+def clear():
+    global _ptr_fmt
+    _layouts.clear()
+    _lookup_cache.clear()
+    _ptr_fmt = None
+
+
+def _on_objfiles_changed(event):
+    clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
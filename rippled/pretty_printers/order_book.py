@@ -0,0 +1,304 @@
+# encoding: utf-8
+
+# The offers of an order book, from memory.
+#
+# `rippled-book BOOK` finds the offers of a Book (or of a BookStep's book)
+# among the ledger entries of a view and the views it is based on, or
+# among all the live STLedgerEntrys of the heap, and prints the best
+# quality levels. Offers are matched by their BookDirectory: the first 24
+# bytes are the book's directory base, the last 8 its quality. Only the
+# fields the book needs are decoded, with amounts kept as numbers.
+
+import gdb
+import hashlib
+import struct
+import time
+
+from gdb.types import get_basic_type
+
+from . import amount_format
+from .heap_scan import find_objects, heap_regions, ledger_entry_layout
+from .layout import layout_of, referenced, value_address
+from .rtti import resolver as rtti
+from .state_table import find_state_table, state_table_layout
+from .stobject import _fast_decoder
+
+# Number of quality levels rippled-book shows by default
+BOOK_TOP_LEVELS = 10
+
+# LedgerNameSpace::BOOK_DIR
+_BOOK_DIR_SPACE = ord("B")
+_QUALITY_MANTISSA_MASK = (1 << 56) - 1
+
+
+def book_base(in_currency, in_account, out_currency, out_account):
+    "Return the key of a book's directory with quality 0, like getBookBase()."
+    h = hashlib.sha512(
+        struct.pack(">H", _BOOK_DIR_SPACE)
+        + in_currency
+        + out_currency
+        + in_account
+        + out_account
+    )
+    return h.digest()[:24] + bytes(8)
+
+
+def quality_rate(quality):
+    """Return the rate (TakerPays / TakerGets) of a directory quality.
+
+    As in rippled, XRP amounts count in drops for the rate.
+    """
+    exponent = (quality >> 56) - 100
+    return amount_format.to_decimal(0, quality & _QUALITY_MANTISSA_MASK, exponent)
+
+
+class Offer:
+    "The fields of an ltOFFER entry the book needs."
+
+    __slots__ = ("address", "account", "sequence", "quality", "pays", "gets")
+
+    def __init__(self, address):
+        self.address = address
+        self.account = None
+        self.sequence = None
+        self.quality = None
+        self.pays = None
+        self.gets = None
+
+
+def read_book(value):
+    """Return (issue strings, directory base) of a Book or a BookStep's book_.
+
+    Pointers and references to either are followed.
+    """
+    value = referenced(value)
+    if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+        value = value.dereference()
+    if get_basic_type(value.type).tag != "ripple::Book":
+        value = value["book_"]
+    layout = layout_of(get_basic_type(value.type))
+    buf = layout.read(value_address(value))
+    raw = {}
+    for side in ("in", "out"):
+        for part in ("currency", "account"):
+            raw[side, part] = layout.bytes_at(buf, side, part, "data_")
+    issues = [
+        amount_format.issue_to_string(
+            raw[side, "currency"],
+            raw[side, "account"],
+            layout.type_name(side, "currency"),
+            layout.type_name(side, "account"),
+        )
+        for side in ("in", "out")
+    ]
+    base = book_base(
+        raw["in", "currency"],
+        raw["in", "account"],
+        raw["out", "currency"],
+        raw["out", "account"],
+    )
+    return issues, base
+
+
+def view_entries(value):
+    """Iterate over (key, SLE address) of the entries of a view and its bases.
+
+    The views are walked from value to the view it is based on, through
+    base_, until one without a state table (such as a Ledger). Keys already
+    seen in a derived view are skipped, and erased entries have address 0.
+    Raises gdb.error if value itself has no state table.
+    """
+    seen = set()
+    first = True
+    while True:
+        try:
+            table_addr, table_type = find_state_table(value)
+        except gdb.error:
+            if first:
+                raise
+            return
+        first = False
+        for key, action, sle in state_table_layout(table_type).iter_items(table_addr):
+            if key in seen:
+                continue
+            seen.add(key)
+            yield key, 0 if action == "erase" else sle
+        value = referenced(value)
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            value = value.dereference()
+        try:
+            # a view known by a base class such as ApplyView has no base_
+            value = rtti.downcast(value)
+            base = value["base_"]
+            if base.type.strip_typedefs().code != gdb.TYPE_CODE_PTR:
+                # OpenView holds a shared_ptr to its base
+                base = base["_M_ptr"]
+        except gdb.error:
+            return
+        if not int(base):
+            return
+        value = rtti.downcast_pointer(base).dereference()
+
+
+def heap_entries(entry_type):
+    """Iterate over (key, address) of the live STLedgerEntrys of a type.
+
+    Only the first copy found of each key is used.
+    """
+    L = ledger_entry_layout()
+    seen = set()
+    for addr, buf in find_objects(heap_regions(), L.vptr, L.size):
+        if L.check(buf) != entry_type:
+            continue
+        key = L.key(buf)
+        if key not in seen:
+            seen.add(key)
+            yield key, addr
+
+
+class BookReader:
+    "Finds and decodes the offers of one book."
+
+    def __init__(self, base):
+        self.prefix = base[:24]
+        self.entry_layout = ledger_entry_layout()
+        names = {name: value for value, name in self.entry_layout.type_names.items()}
+        self.offer_type = names.get("ltOFFER", 0x6F)
+        self.entries = 0
+
+    def offer(self, addr):
+        "Return the Offer at addr if it is an offer of the book, else None."
+        L = self.entry_layout
+        buf = L.layout.read(addr)
+        if L.entry_type(buf) != self.offer_type:
+            return None
+        start, finish, _ = L.vector(buf)
+        decoder = _fast_decoder._decoder()
+        offer = Offer(addr)
+        for name, spec, mv, p in decoder.iter_raw(start, finish):
+            if name == "BookDirectory":
+                directory = decoder.uint_bytes(spec, mv)
+                if directory[:24] != self.prefix:
+                    return None
+                offer.quality = int.from_bytes(directory[24:], "big")
+            elif name == "TakerPays":
+                offer.pays = decoder.amount_parts(spec, mv)
+            elif name == "TakerGets":
+                offer.gets = decoder.amount_parts(spec, mv)
+            elif name in ("Account", "Sequence"):
+                setattr(offer, name.lower(), decoder.decode_value(spec, mv, p))
+        if None in (offer.quality, offer.pays, offer.gets):
+            return None
+        return offer
+
+    def offers(self, entries):
+        "Return the offers of the book among (key, SLE address) entries."
+        r = []
+        for _, addr in entries:
+            self.entries += 1
+            if not addr:
+                continue
+            try:
+                offer = self.offer(addr)
+            except (gdb.error, gdb.MemoryError):
+                continue
+            if offer is not None:
+                r.append(offer)
+        return r
+
+
+def book_levels(offers):
+    """Group offers by quality, best first.
+
+    Returns (rate, offers, total TakerGets, total TakerPays) per level.
+    """
+    levels = {}
+    for offer in offers:
+        levels.setdefault(offer.quality, []).append(offer)
+    to_decimal = amount_format.to_decimal
+    return [
+        (
+            quality_rate(quality),
+            level,
+            sum(to_decimal(*o.gets[:3]) for o in level),
+            sum(to_decimal(*o.pays[:3]) for o in level),
+        )
+        for quality, level in sorted(levels.items())
+    ]
+
+
+class BookCommand(gdb.Command):
+    """Show the offers of a book: rippled-book [--top N] [--offers] [--view VIEW] BOOK
+
+    BOOK is a Book or a BookStep. The offers are looked for in the ledger
+    entries of VIEW and the views it is based on (an ApplyView or OpenView,
+    such as a PaymentSandbox), or without --view in every STLedgerEntry on
+    the heap. The best N quality levels (BOOK_TOP_LEVELS by default) are
+    shown with their offer counts and totals; --offers lists their offers."""
+
+    def __init__(self):
+        super().__init__("rippled-book", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        top = BOOK_TOP_LEVELS
+        list_offers = False
+        view = None
+        while args and args[0].startswith("--"):
+            opt = args.pop(0)
+            if opt == "--top" and args:
+                try:
+                    top = int(args.pop(0), 0)
+                except ValueError:
+                    raise gdb.GdbError("--top takes a number")
+            elif opt == "--offers":
+                list_offers = True
+            elif opt == "--view" and args:
+                view = gdb.parse_and_eval(args.pop(0))
+            else:
+                raise gdb.GdbError(f"Unknown option {opt}")
+        if not args:
+            raise gdb.GdbError(
+                "usage: rippled-book [--top N] [--offers] [--view VIEW] BOOK"
+            )
+        try:
+            (in_issue, out_issue), base = read_book(gdb.parse_and_eval(" ".join(args)))
+        except (gdb.error, gdb.MemoryError) as e:
+            raise gdb.GdbError(f"Not a Book or BookStep: {e}")
+
+        begin = time.perf_counter()
+        reader = BookReader(base)
+        if view is not None:
+            source = "view"
+            entries = view_entries(view)
+        else:
+            source = "heap"
+            entries = heap_entries(reader.offer_type)
+        try:
+            offers = reader.offers(entries)
+        except gdb.error as e:
+            raise gdb.GdbError(str(e))
+        levels = book_levels(offers)
+        seconds = time.perf_counter() - begin
+
+        gdb.write(
+            f"Book {in_issue} -> {out_issue}: {len(offers)} offers in"
+            f" {len(levels)} quality levels, from {reader.entries} {source}"
+            f" entries in {seconds:.2f} s\n"
+        )
+        if not levels:
+            return
+        gdb.write(f"  {'rate':<24} {'offers':>6} {'TakerGets':>24} {'TakerPays':>24}\n")
+        for rate, level, gets, pays in levels[:top]:
+            gdb.write(f"  {rate!s:<24} {len(level):>6} {gets!s:>24} {pays!s:>24}\n")
+            if not list_offers:
+                continue
+            for o in level:
+                gdb.write(
+                    f"    0x{o.address:x} {o.account} #{o.sequence}"
+                    f" gets {amount_format.to_decimal(*o.gets[:3])}"
+                    f" pays {amount_format.to_decimal(*o.pays[:3])}\n"
+                )
+
+
+BookCommand()
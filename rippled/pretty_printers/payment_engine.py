@@ -2,9 +2,24 @@ from rippled.pretty_printers.printers import *
 from rippled.pretty_printers.printers import _register_printer
 
 import re
+import struct
 import gdb
 from libstdcxx.v6.printers import is_specialization_of
 
+from .amounts import _read_object, amount_at, amount_from_buffer, issue_from_buffer
+from .base_uint import base_uint_to_string
+from .decode_cache import decode_cache, memory_digest
+from .layout import (
+    find_field,
+    layout_of,
+    lookup_layout,
+    pointer_format,
+    read_memory,
+    referenced,
+    value_address,
+)
+from .rtti import resolver as rtti
+
 
 @_register_printer
 class BoostOptionalStepCache:
@@ -38,6 +53,9 @@ class BoostOptionalStepCache:
 
 STEP_DETAIL_NS = ""
 
+# set to True to print strands as one line summaries instead of step by step
+STRAND_SUMMARY = False
+
 
 @_register_printer
 class DirectStepICache:
@@ -68,11 +86,23 @@ class DirectStepI:
         self.value = value
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                currency, src, dst = (
+                    base_uint_to_string(
+                        layout.bytes_at(buf, name, "data_"), layout.type_name(name)
+                    )
+                    for name in ("currency_", "src_", "dst_")
+                )
+            except gdb.error:
+                layout = None
+        if layout is None:
+            currency = self.value["currency_"]
+            src = self.value["src_"]
+            dst = self.value["dst_"]
         return "\n{currency} {src} -> {dst}\n  ({cache})".format(
-            currency=self.value["currency_"],
-            src=self.value["src_"],
-            dst=self.value["dst_"],
-            cache=self.value["cache_"],
+            currency=currency, src=src, dst=dst, cache=self.value["cache_"]
         )
 
 
@@ -103,6 +133,15 @@ class Book:
         self.value = value
 
     def to_string(self):
+        layout, buf = _read_object(self.value)
+        if layout is not None:
+            try:
+                return "{src} -> {dst}".format(
+                    src=issue_from_buffer(layout, buf, "in"),
+                    dst=issue_from_buffer(layout, buf, "out"),
+                )
+            except gdb.error:
+                pass
         return "{src} -> {dst}".format(src=self.value["in"], dst=self.value["out"])
 
 
@@ -154,7 +193,7 @@ class PayStepUniquePtr:
         except:
             # old implementation
             impl = self.value["_M_t"]["_M_head_impl"]
-        dyn_type = impl.cast(impl.dynamic_type).dereference()
+        dyn_type = rtti.downcast_pointer(impl).dereference()
         return f"{dyn_type}"
 
         # Old implementation of printer - `is_specialization` would not work
@@ -202,8 +241,13 @@ class PayStrand:
 
     def __init__(self, value):
         self.value = value
+        self.summary = None
+        if STRAND_SUMMARY:
+            self.summary = _step_decoder.cached_strand_summary(value)
 
     def children(self):
+        if self.summary is not None:
+            return iter(())
         return self._iterator(
             self.value["_M_impl"]["_M_start"], self.value["_M_impl"]["_M_finish"]
         )
@@ -212,9 +256,232 @@ class PayStrand:
         return "array"
 
     def to_string(self):
+        if self.summary is not None:
+            return f"Paystrand: {self.summary}"
         start = self.value["_M_impl"]["_M_start"]
         finish = self.value["_M_impl"]["_M_finish"]
         size = int(finish - start)
         if size == 0:
             return "Paystrand (empty)"
         return f"Paystrand ({size:d})"
+
+
+###
+### Strand summaries.
+###
+### All the step pointers of a strand are read with one read_memory call,
+### each step's vtable pointer is mapped to its dynamic type through the RTTI
+### cache, and the fields the summary shows are decoded from one read of each
+### step.
+###
+
+
+class _StepDecoder:
+    "Decodes the steps of payment strands into one line summaries."
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # step type name -> function (layout, buf) -> summary
+        self.formatters = {}
+        self.step_type = None
+        # sizeof the largest step type seen, read speculatively with the vptr
+        self.max_size = 0
+
+    def _dynamic_type(self, vptr, addr):
+        if self.step_type is None:
+            self.step_type = lookup_layout("ripple::Step").type
+        t = rtti.type_at(addr, self.step_type, vptr)
+        self.max_size = max(self.max_size, t.sizeof)
+        return t
+
+    @staticmethod
+    def _optional(layout, name):
+        "Return the paths to the engaged flag and to the value of an optional."
+        opt_name = layout.type_name(name)
+        if opt_name.startswith("boost::optional"):
+            engaged = (name, "m_initialized")
+            value = (name, "m_storage")
+        else:
+            engaged = (name, "_M_payload", "_M_engaged")
+            value = (name, "_M_payload", "_M_payload", "_M_value")
+        return engaged, value
+
+    def _cache(self, layout, buf):
+        "Format the in and out amounts of a step's cache_, if it has one."
+        if find_field(layout.type, "cache_") is None:
+            return ""
+        engaged, value = self._optional(layout, "cache_")
+        if not layout.int_at(buf, *engaged):
+            return ""
+        off, size, t = layout.field(*value)
+        cache_t = t
+        if layout.type_name("cache_").startswith("boost::optional"):
+            cache_t = layout_of(layout.field_type("cache_")).template_args()[0]
+        cache = layout_of(cache_t)
+        cache_buf = buf[off : off + cache.sizeof]
+        if find_field(cache.type, "in") is not None:
+            amounts = [
+                amount_at(cache, cache_buf, "in"),
+                amount_at(cache, cache_buf, "out"),
+            ]
+        else:
+            # XRPEndpointStep caches a single amount
+            amounts = [amount_from_buffer(cache_t, cache_buf)]
+        return " [" + " -> ".join(a or "?" for a in amounts) + "]"
+
+    def _uint(self, layout, buf, name):
+        return base_uint_to_string(
+            layout.bytes_at(buf, name, "data_"), layout.type_name(name)
+        )
+
+    def _formatter(self, t):
+        name = t.tag or str(t)
+        f = self.formatters.get(name)
+        if f is not None:
+            return f
+
+        def has(field):
+            return find_field(t, field) is not None
+
+        if has("src_") and has("dst_") and has("currency_"):
+
+            def f(layout, buf):
+                return "{currency} {src} -> {dst}{cache}".format(
+                    currency=self._uint(layout, buf, "currency_"),
+                    src=self._uint(layout, buf, "src_"),
+                    dst=self._uint(layout, buf, "dst_"),
+                    cache=self._cache(layout, buf),
+                )
+
+        elif has("book_"):
+
+            def f(layout, buf):
+                return "book {src} -> {dst}{cache}".format(
+                    src=issue_from_buffer(layout, buf, "book_", "in"),
+                    dst=issue_from_buffer(layout, buf, "book_", "out"),
+                    cache=self._cache(layout, buf),
+                )
+
+        elif has("acc_"):
+
+            def f(layout, buf):
+                acc = self._uint(layout, buf, "acc_")
+                return f"XRP {acc}{self._cache(layout, buf)}"
+
+        else:
+
+            def f(layout, buf):
+                return name
+
+        self.formatters[name] = f
+        return f
+
+    def _step_summary(self, addr):
+        ptr_size = struct.calcsize(pointer_format())
+        buf = None
+        if self.max_size:
+            try:
+                buf = read_memory(addr, self.max_size)
+            except gdb.MemoryError:
+                pass
+        vptr_buf = buf if buf is not None else read_memory(addr, ptr_size)
+        vptr = struct.unpack_from(pointer_format(), vptr_buf)[0]
+        t = self._dynamic_type(vptr, addr)
+        if buf is None or len(buf) < t.sizeof:
+            buf = read_memory(addr, t.sizeof)
+        return self._formatter(t)(layout_of(t), buf)
+
+    def step_summaries(self, strand):
+        "Return the summaries of the steps of a strand (a vector of unique_ptrs)."
+        impl = strand["_M_impl"]
+        start = int(impl["_M_start"])
+        finish = int(impl["_M_finish"])
+        if start == finish:
+            return []
+        fmt = pointer_format()
+        ptrs = read_memory(start, finish - start)
+        return [self._step_summary(p) for (p,) in struct.iter_unpack(fmt, ptrs)]
+
+    def strand_summary(self, strand):
+        "Return a strand as one line, or None if it can't be decoded."
+        try:
+            steps = self.step_summaries(strand)
+        except (gdb.error, gdb.MemoryError):
+            return None
+        if not steps:
+            return "(empty)"
+        return " | ".join(steps)
+
+    def cached_strand_summary(self, strand):
+        """strand_summary() through the decode cache.
+
+        The digest covers the step pointers; the steps' caches change as the
+        payment engine runs, so the summary is only reused while stopped.
+        """
+        addr = value_address(strand)
+        if addr is None:
+            return self.strand_summary(strand)
+        impl = strand["_M_impl"]
+        start = int(impl["_M_start"])
+        finish = int(impl["_M_finish"])
+        try:
+            fingerprint = memory_digest(start, finish - start)
+        except gdb.MemoryError:
+            return None
+        return decode_cache.lookup(
+            (addr, "PayStrand"), fingerprint, lambda: self.strand_summary(strand)
+        )
+
+
+_step_decoder = _StepDecoder()
+
+
+def _on_objfiles_changed(event):
+    _step_decoder.clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
+
+
+class StrandsCommand(gdb.Command):
+    """Print payment strands one line each: rippled-strands EXPR
+
+    EXPR is a strand (a vector of Step unique_ptrs) or a vector of strands."""
+
+    def __init__(self):
+        super().__init__("rippled-strands", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        value = referenced(gdb.parse_and_eval(arg))
+        t = value.type.strip_typedefs()
+        strand_re = re.compile(PayStrand.type_name_re)
+        if strand_re.search(str(t)):
+            strands = [value]
+        else:
+            error = gdb.GdbError(f"{arg} is not a strand or vector of strands")
+            try:
+                # RuntimeError if t is not a template (gdb.error is one too)
+                elem = t.template_argument(0)
+            except RuntimeError:
+                raise error
+            if not strand_re.search(str(elem.strip_typedefs())):
+                raise error
+            try:
+                impl = value["_M_impl"]
+                start, finish = impl["_M_start"], impl["_M_finish"]
+                count = int(finish - start)
+            except gdb.error:
+                raise error
+            strands = [(start + i).dereference() for i in range(count)]
+        width = len(str(len(strands)))
+        for i, strand in enumerate(strands):
+            summary = _step_decoder.strand_summary(strand)
+            if summary is None:
+                summary = "<unreadable>"
+            gdb.write(f"[{i:>{width}}] {summary}\n")
+
+
+StrandsCommand()
@@ -9,10 +9,21 @@
 
 import gdb
 import gdb.printing
+import json
 import re
 
 from gdb.types import get_basic_type
 
+# Set by instrument.py while profiling; called instead of json.dumps.
+dumps_hook = None
+
+
+def _dumps(obj, **kwargs):
+    "json.dumps for the printers and commands, so that profiling can time it."
+    if dumps_hook is not None:
+        return dumps_hook(obj, **kwargs)
+    return json.dumps(obj, **kwargs)
+
 
 class GDB_Value_Wrapper(gdb.Value):
     "Wrapper class for gdb.Value that allows setting extra properties."
@@ -27,9 +38,10 @@ class Printer_Gen:
         def match_re(self, v):
             return self.re.search(str(v.basic_type)) != None
 
-        def __init__(self, Printer):
+        def __init__(self, Printer, owner):
             self.name = f"{Printer.printer_name}-{Printer.version}"
-            self.enabled = True
+            self.owner = owner
+            self._enabled = True
             if hasattr(Printer, "supports"):
                 self.re = None
                 self.supports = Printer.supports
@@ -38,6 +50,17 @@ class Printer_Gen:
                 self.supports = self.match_re
             self.Printer = Printer
 
+        # gdb's `enable/disable pretty-printer` commands set this attribute;
+        # cached dispatch decisions are stale once it changes.
+        @property
+        def enabled(self):
+            return self._enabled
+
+        @enabled.setter
+        def enabled(self, value):
+            self._enabled = value
+            self.owner.clear_cache()
+
         def __call__(self, v):
             if not self.enabled:
                 return None
@@ -50,40 +73,139 @@ class Printer_Gen:
         self.name = name
         self.enabled = True
         self.subprinters = []
+        # objfile -> {type key -> (subprinter or None, basic type)}
+        self.dispatch_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     def add(self, Printer):
-        self.subprinters.append(Printer_Gen.SubPrinter_Gen(Printer))
+        self.subprinters.append(Printer_Gen.SubPrinter_Gen(Printer, self))
+        self.clear_cache()
+
+    def clear_cache(self, objfile=None):
+        "Forget cached dispatch decisions, for one objfile or for all of them."
+        if objfile is None:
+            self.dispatch_cache.clear()
+        else:
+            self.dispatch_cache.pop(objfile, None)
+
+    def cache_stats(self):
+        "Return a dict with the dispatch cache counters."
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "entries": sum(len(c) for c in self.dispatch_cache.values()),
+        }
+
+    @staticmethod
+    def _type_key(t):
+        # Type.name is cheap, but it is None for pointers, references and
+        # anonymous types; fall back to the full type string for those.
+        return t.name or str(t)
+
+    def _lookup(self, v):
+        "Run every subprinter on v. Return (printer, subprinter, cacheable)."
+        cacheable = True
+        for subprinter_gen in self.subprinters:
+            if subprinter_gen.re is None:
+                # supports() may look at the value, not only at the type
+                cacheable = False
+            printer = subprinter_gen(v)
+            if printer != None:
+                return printer, subprinter_gen, cacheable
+        return None, None, cacheable
 
     def __call__(self, value):
+        t = value.type
+        type_cache = self.dispatch_cache.setdefault(getattr(t, "objfile", None), {})
+        key = Printer_Gen._type_key(t)
+        entry = type_cache.get(key)
+        if entry is not None:
+            subprinter_gen, basic_type = entry
+            if subprinter_gen is None:
+                self.cache_hits += 1
+                return None
+            if subprinter_gen.enabled:
+                self.cache_hits += 1
+                v = GDB_Value_Wrapper(value)
+                v.basic_type = basic_type
+                v.type_name = str(basic_type)
+                return subprinter_gen.Printer(v)
+
+        self.cache_misses += 1
         v = GDB_Value_Wrapper(value)
-        v.basic_type = get_basic_type(v.type)
+        v.basic_type = get_basic_type(t)
         if not v.basic_type:
             return None
-        for subprinter_gen in self.subprinters:
-            printer = subprinter_gen(v)
-            if printer != None:
-                return printer
-        return None
+        printer, subprinter_gen, cacheable = self._lookup(v)
+        if cacheable:
+            type_cache[key] = (subprinter_gen, v.basic_type)
+        return printer
 
 
 printer_gen = Printer_Gen("rippled")
 
 
+def _on_new_objfile(event):
+    printer_gen.clear_cache(event.new_objfile)
+
+
+def _on_free_objfile(event):
+    printer_gen.clear_cache(event.objfile)
+
+
+def _on_clear_objfiles(event):
+    printer_gen.clear_cache()
+
+
+gdb.events.new_objfile.connect(_on_new_objfile)
+gdb.events.clear_objfiles.connect(_on_clear_objfiles)
+# free_objfile was added in gdb 13
+if hasattr(gdb.events, "free_objfile"):
+    gdb.events.free_objfile.connect(_on_free_objfile)
+
+
 # This function registers the top-level Printer generator with gdb.
 # This should be called from .gdbinit.
 def register_rippled_printers(obj):
     "Register printer generator with objfile obj."
     from . import amounts
+    from . import async_decode
     from . import base_uint
     from . import buffers
+    from . import heap_scan
+    from . import instrument
     from . import json_value
+    from . import order_book
     from . import payment_engine
+    from . import snapshot
+    from . import state_table
     from . import stobject
 
     global printer_gen
     gdb.printing.register_pretty_printer(obj, printer_gen, replace=True)
 
 
+class JsonCommand(gdb.Command):
+    """Print a value as JSON: rippled-json EXPR
+
+    Works for values whose printer can decode them into Python values, such
+    as STObject and Json::Value. The printers themselves show these values as
+    gdb children, which only decodes what gdb displays."""
+
+    def __init__(self):
+        super().__init__("rippled-json", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        printer = printer_gen(gdb.parse_and_eval(arg))
+        if printer is None or not hasattr(printer, "to_py_value"):
+            raise gdb.GdbError(f"No rippled printer can decode {arg}")
+        gdb.write(_dumps(printer.to_py_value(), indent=2) + "\n")
+
+
+JsonCommand()
+
+
 # Register individual Printer with the top-level Printer generator.
 def _register_printer(Printer):
     "Registers a Printer"
@@ -107,24 +229,3 @@ def _register_printer(Printer):
 ###     re. (Either supports() or type_name_re is required.)
 ### - '__init__' : Its only argument is a GDB_Value_Wrapper.
 ###
-
-
-@_register_printer
-class Buffer:
-    "Pretty printer for Buffer"
-    printer_name = "Buffer"
-    version = "1.0"
-    type_name_re = "^ripple::Buffer$"
-
-    def __init__(self, value):
-        self.value = value
-
-    def to_string(self):
-        vals = []
-        array = self.value["p_"]["_M_t"]["_M_head_impl"]
-        for i in range(int(self.value["size_"])):
-            if i > 0 and not (i % 16):
-                vals.append("\n ")
-            vals.append(f"{int(array[i]):.2x}")
-        vals = " ".join(vals)
-        return "(Buffer: %s)\n{ %s }" % (self.value["size_"], vals)
@@ -0,0 +1,105 @@
+# encoding: utf-8
+
+# Direct walking of libstdc++ red-black trees (std::map, std::set).
+#
+# Nodes are read with one read_memory call each and the traversal is
+# iterative, so large maps neither recurse in Python nor go through
+# gdb.Value for every node.
+
+import gdb
+import struct
+
+from rippled.pretty_printers.layout import field_path, read_memory
+
+
+class RbTreeLayout:
+    "Node layout of one std::map<K, V> (or std::set<K>) type."
+
+    def __init__(self, map_type):
+        t = map_type.strip_typedefs()
+        rep_off, rep_t = field_path(t, "_M_t")
+        rep_t = rep_t.strip_typedefs()
+        self.header_off = rep_off + field_path(rep_t, "_M_impl", "_M_header")[0]
+        self.count_off = rep_off + field_path(rep_t, "_M_impl", "_M_node_count")[0]
+        node_base = gdb.lookup_type("std::_Rb_tree_node_base")
+        self.parent_off = field_path(node_base, "_M_parent")[0]
+        self.left_off = field_path(node_base, "_M_left")[0]
+        self.right_off = field_path(node_base, "_M_right")[0]
+        ptr_size = gdb.lookup_type("void").pointer().sizeof
+        self.ptr_fmt = "<Q" if ptr_size == 8 else "<I"
+
+        self.key_type = t.template_argument(0)
+        try:
+            self.mapped_type = t.template_argument(1)
+        except RuntimeError:
+            # std::set
+            self.mapped_type = None
+        try:
+            link_t = gdb.lookup_type(str(rep_t) + "::_Link_type")
+            node_t = link_t.strip_typedefs().target().strip_typedefs()
+            self.storage_off = field_path(node_t, "_M_storage")[0]
+            self.node_size = node_t.sizeof
+        except gdb.error:
+            self.storage_off = node_base.sizeof
+            self.node_size = None
+        self.key_off = self.storage_off
+        self.value_off = None
+        if self.mapped_type is not None:
+            align = getattr(self.mapped_type, "alignof", 0) or min(
+                self.mapped_type.sizeof, ptr_size
+            )
+            second = -(-self.key_type.sizeof // align) * align
+            self.value_off = self.storage_off + second
+        if self.node_size is None:
+            end = self.value_off if self.value_off is not None else self.key_off
+            size_t = self.mapped_type or self.key_type
+            self.node_size = end + size_t.sizeof
+
+    def _ptr(self, buf, off):
+        return struct.unpack_from(self.ptr_fmt, buf, off)[0]
+
+    def size(self, map_bytes):
+        "Number of elements, given the bytes of the map object."
+        return self._ptr(map_bytes, self.count_off)
+
+    def root(self, map_bytes):
+        return self._ptr(map_bytes, self.header_off + self.parent_off)
+
+    def iter_nodes(self, map_addr, map_bytes=None):
+        """Iterate over (node address, node bytes) in key order.
+
+        The key is at key_off and the mapped value at value_off in the bytes.
+        """
+        if map_bytes is None:
+            size = self.count_off + struct.calcsize(self.ptr_fmt)
+            map_bytes = read_memory(map_addr, size)
+        node = self.root(map_bytes)
+        stack = []
+        while stack or node:
+            while node:
+                node_bytes = read_memory(node, self.node_size)
+                stack.append((node, node_bytes))
+                node = self._ptr(node_bytes, self.left_off)
+            node, node_bytes = stack.pop()
+            yield node, node_bytes
+            node = self._ptr(node_bytes, self.right_off)
+
+
+_layouts = {}
+
+
+def layout_for(map_type):
+    "Return the (cached) RbTreeLayout of a std::map/std::set type."
+    key = str(map_type.strip_typedefs())
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = _layouts[key] = RbTreeLayout(map_type)
+    return layout
+
+
+def _on_objfiles_changed(event):
+    _layouts.clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
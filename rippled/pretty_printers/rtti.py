@@ -0,0 +1,137 @@
+# encoding: utf-8
+
+# Dynamic type resolution shared by the polymorphic printers.
+#
+# gdb's Value.dynamic_type reads an object's vtable pointer and looks up the
+# vtable's symbol every time it is asked. Objects with the same vtable
+# always have the same dynamic type, so the result is cached by vtable
+# address, per objfile holding the vtable. gdb is only asked on a miss.
+
+import gdb
+import struct
+
+from .layout import pointer_format, read_memory, referenced
+
+_REFERENCE_CODES = {gdb.TYPE_CODE_REF, getattr(gdb, "TYPE_CODE_RVALUE_REF", None)}
+
+
+class RttiResolver:
+    "Maps vtable addresses to dynamic gdb.Types."
+
+    def __init__(self):
+        # (static type name, vptr) -> dynamic gdb.Type
+        self.types = {}
+        # objfile holding the vtable (or None if unknown) -> keys in types
+        self.objfile_keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self, objfile=None):
+        "Forget the types whose vtables are in objfile, or all of them."
+        if objfile is None:
+            self.types.clear()
+            self.objfile_keys.clear()
+            return
+        # entries whose objfile could not be determined may be stale too
+        for o in (objfile, None):
+            for key in self.objfile_keys.pop(o, ()):
+                self.types.pop(key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.types)}
+
+    @staticmethod
+    def _objfile(vptr):
+        # Progspace.objfile_for_address was added in gdb 13
+        try:
+            return gdb.current_progspace().objfile_for_address(vptr)
+        except (AttributeError, gdb.error):
+            return None
+
+    def vptr_at(self, addr):
+        "Read the vtable pointer of the object at addr."
+        fmt = pointer_format()
+        return struct.unpack(fmt, read_memory(addr, struct.calcsize(fmt)))[0]
+
+    def type_at(self, addr, static_type, vptr=None):
+        """Return the dynamic type of the object at addr.
+
+        static_type is the (polymorphic) gdb.Type the object is known as. Pass
+        vptr if it has already been read, for example by a bulk read.
+        """
+        if vptr is None:
+            vptr = self.vptr_at(addr)
+        static_type = static_type.strip_typedefs()
+        if static_type.code in _REFERENCE_CODES:
+            static_type = static_type.target().strip_typedefs()
+        key = (static_type.tag or str(static_type), vptr)
+        t = self.types.get(key)
+        if t is not None:
+            self.hits += 1
+            return t
+        self.misses += 1
+        v = gdb.Value(addr).cast(static_type.pointer()).dereference()
+        t = self.types[key] = v.dynamic_type.strip_typedefs()
+        self.objfile_keys.setdefault(self._objfile(vptr), set()).add(key)
+        return t
+
+    def dynamic_type(self, value):
+        """Like value.dynamic_type, for a value of polymorphic class type.
+
+        References are followed: the dynamic type of the object referred to
+        is returned.
+        """
+        value = referenced(value)
+        addr = value.address
+        if addr is None:
+            return value.dynamic_type
+        try:
+            return self.type_at(int(addr), value.type)
+        except (gdb.error, gdb.MemoryError):
+            return value.dynamic_type
+
+    def downcast(self, value):
+        "Cast a value (or reference) of polymorphic class type to its dynamic type."
+        value = referenced(value)
+        return value.cast(self.dynamic_type(value))
+
+    def downcast_pointer(self, ptr):
+        "Cast a pointer to a polymorphic class to a pointer to its dynamic type."
+        if not int(ptr):
+            return ptr
+        return self.downcast(ptr.dereference()).address
+
+
+resolver = RttiResolver()
+
+
+def vtable_pointer(t):
+    """Return the vtable pointer objects of exactly type t hold.
+
+    That's the address of the vtable's first virtual function, two pointers
+    past the start of the Itanium ABI vtable symbol. Raises gdb.error if t
+    has no vtable in the inferior.
+    """
+    tag = t.strip_typedefs().tag
+    vtable = gdb.parse_and_eval(f"&'vtable for {tag}'")
+    ptr_size = struct.calcsize(pointer_format())
+    return int(vtable.cast(gdb.lookup_type("long").unsigned)) + 2 * ptr_size
+
+
+def _on_new_objfile(event):
+    resolver.clear(event.new_objfile)
+
+
+def _on_free_objfile(event):
+    resolver.clear(event.objfile)
+
+
+def _on_clear_objfiles(event):
+    resolver.clear()
+
+
+gdb.events.new_objfile.connect(_on_new_objfile)
+gdb.events.clear_objfiles.connect(_on_clear_objfiles)
+# free_objfile was added in gdb 13
+if hasattr(gdb.events, "free_objfile"):
+    gdb.events.free_objfile.connect(_on_free_objfile)
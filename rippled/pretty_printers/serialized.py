@@ -0,0 +1,266 @@
+# encoding: utf-8
+
+# Decoder for rippled's binary serialization of STObjects.
+#
+# This reads the bytes a Serializer produces (transactions, ledger entries,
+# metadata) without any help from the inferior, so it works on a Buffer or
+# Blob that was read with a single read_memory call.
+#
+# This module does not depend on gdb so it can be used outside of it.
+
+import struct
+
+from . import amount_format
+
+# Serialized type ids (SerializedTypeID in rippled's SField.h)
+STI_UINT16 = 1
+STI_UINT32 = 2
+STI_UINT64 = 3
+STI_UINT128 = 4
+STI_UINT256 = 5
+STI_AMOUNT = 6
+STI_VL = 7
+STI_ACCOUNT = 8
+STI_OBJECT = 14
+STI_ARRAY = 15
+STI_UINT8 = 16
+STI_UINT160 = 17
+STI_PATHSET = 18
+STI_VECTOR256 = 19
+STI_UINT96 = 20
+STI_UINT192 = 21
+STI_UINT384 = 22
+STI_UINT512 = 23
+STI_ISSUE = 24
+STI_CURRENCY = 26
+
+# Fixed size hashes: type id -> number of bits
+_HASH_BITS = {
+    STI_UINT128: 128,
+    STI_UINT256: 256,
+    STI_UINT160: 160,
+    STI_UINT96: 96,
+    STI_UINT192: 192,
+    STI_UINT384: 384,
+    STI_UINT512: 512,
+}
+
+_UINTS = {STI_UINT8: ">B", STI_UINT16: ">H", STI_UINT32: ">I", STI_UINT64: ">Q"}
+
+# (type, field) of the end markers of objects and arrays
+_OBJECT_END = (STI_OBJECT, 1)
+_ARRAY_END = (STI_ARRAY, 1)
+
+# PathSet framing bytes and path element flags
+_PATH_BOUNDARY = 0xFF
+_PATH_END = 0x00
+_PATH_ACCOUNT = 0x01
+_PATH_CURRENCY = 0x10
+_PATH_ISSUER = 0x20
+
+_ZERO_ACCOUNT = bytes(20)
+_ZERO_CURRENCY = bytes(20)
+# Exponent STAmount gives a zero IOU amount in memory
+_ZERO_IOU_EXPONENT = -100
+
+
+def field_code(type_id, field_id):
+    "Return the code rippled uses as the key of SField::knownCodeToField."
+    return (type_id << 16) | field_id
+
+
+def default_field_name(type_id, field_id):
+    return f"Field({type_id},{field_id})"
+
+
+def hex_uint(mem, tag):
+    "Format a base_uint without the help of the BaseUInt printer."
+    return mem.hex().upper()
+
+
+class SerializedDecoder:
+    """Decodes the fields of a serialized STObject into Python values.
+
+    field_name(type_id, field_id) returns a field's name, and
+    format_uint(mem, tag) formats the raw bytes of a base_uint, where tag
+    is "AccountID", "Currency" or the number of bits of a hash. The values
+    match those of the STObject printer's to_py_value() when the printers'
+    own formatting is passed in.
+    """
+
+    def __init__(self, field_name=default_field_name, format_uint=hex_uint):
+        self.field_name = field_name
+        self.format_uint = format_uint
+
+    def decode(self, data):
+        "Decode a whole serialized object. Raises ValueError on bad input."
+        mv = memoryview(data)
+        obj, pos = self._object(mv, 0, len(mv), inner=False)
+        return obj
+
+    ### Framing
+
+    @staticmethod
+    def _header(mv, pos):
+        "Return (type id, field id, new pos) of the field header at pos."
+        b = mv[pos]
+        pos += 1
+        type_id = b >> 4
+        field_id = b & 0x0F
+        if type_id == 0:
+            type_id = mv[pos]
+            pos += 1
+        if field_id == 0:
+            field_id = mv[pos]
+            pos += 1
+        return type_id, field_id, pos
+
+    @staticmethod
+    def _vl_length(mv, pos):
+        "Return (length, new pos) of the variable length prefix at pos."
+        b1 = mv[pos]
+        if b1 <= 192:
+            return b1, pos + 1
+        if b1 <= 240:
+            return 193 + (b1 - 193) * 256 + mv[pos + 1], pos + 2
+        if b1 <= 254:
+            return 12481 + (b1 - 241) * 65536 + mv[pos + 1] * 256 + mv[pos + 2], pos + 3
+        raise ValueError(f"Invalid variable length prefix at {pos}")
+
+    @staticmethod
+    def _take(mv, pos, n):
+        if pos + n > len(mv):
+            raise ValueError(f"Truncated at {pos}: need {n} bytes")
+        return bytes(mv[pos : pos + n]), pos + n
+
+    def _object(self, mv, pos, end, inner):
+        r = {}
+        while pos < end:
+            type_id, field_id, pos = self._header(mv, pos)
+            if inner and (type_id, field_id) == _OBJECT_END:
+                return r, pos
+            name = self.field_name(type_id, field_id)
+            r[name], pos = self._value(mv, pos, type_id)
+        if inner:
+            raise ValueError("Object is missing its end marker")
+        return r, pos
+
+    def _array(self, mv, pos):
+        r = []
+        while pos < len(mv):
+            type_id, field_id, pos = self._header(mv, pos)
+            if (type_id, field_id) == _ARRAY_END:
+                return r, pos
+            if type_id != STI_OBJECT:
+                raise ValueError(f"Array element of type {type_id} at {pos}")
+            obj, pos = self._object(mv, pos, len(mv), inner=True)
+            r.append({self.field_name(type_id, field_id): obj})
+        raise ValueError("Array is missing its end marker")
+
+    ### Values
+
+    def _value(self, mv, pos, type_id):
+        fmt = _UINTS.get(type_id)
+        if fmt is not None:
+            size = struct.calcsize(fmt)
+            raw, pos = self._take(mv, pos, size)
+            return struct.unpack(fmt, raw)[0], pos
+        bits = _HASH_BITS.get(type_id)
+        if bits is not None:
+            raw, pos = self._take(mv, pos, bits // 8)
+            return self.format_uint(raw, bits), pos
+        if type_id == STI_AMOUNT:
+            return self._amount(mv, pos)
+        if type_id == STI_VL:
+            n, pos = self._vl_length(mv, pos)
+            raw, pos = self._take(mv, pos, n)
+            return raw.hex().upper(), pos
+        if type_id == STI_ACCOUNT:
+            n, pos = self._vl_length(mv, pos)
+            raw, pos = self._take(mv, pos, n)
+            return self.format_uint(raw, "AccountID"), pos
+        if type_id == STI_OBJECT:
+            return self._object(mv, pos, len(mv), inner=True)
+        if type_id == STI_ARRAY:
+            return self._array(mv, pos)
+        if type_id == STI_PATHSET:
+            return self._pathset(mv, pos)
+        if type_id == STI_VECTOR256:
+            n, pos = self._vl_length(mv, pos)
+            raw, pos = self._take(mv, pos, n)
+            hashes = [self.format_uint(raw[i : i + 32], 256) for i in range(0, n, 32)]
+            return hashes, pos
+        if type_id == STI_ISSUE:
+            return self._issue(mv, pos)
+        if type_id == STI_CURRENCY:
+            raw, pos = self._take(mv, pos, 20)
+            return self.format_uint(raw, "Currency"), pos
+        raise ValueError(f"Unsupported serialized type {type_id} at {pos}")
+
+    def _issue(self, mv, pos):
+        currency, pos = self._take(mv, pos, 20)
+        account = _ZERO_ACCOUNT
+        if currency != _ZERO_CURRENCY:
+            account, pos = self._take(mv, pos, 20)
+        return self._issue_string(currency, account), pos
+
+    def _issue_string(self, currency, account):
+        return (
+            f"{self.format_uint(currency, 'Currency')}/"
+            f"{self.format_uint(account, 'AccountID')}"
+        )
+
+    def _amount(self, mv, pos):
+        raw, pos = self._take(mv, pos, 8)
+        v = int.from_bytes(raw, "big")
+        is_iou = v >> 63
+        positive = (v >> 62) & 1
+        if not is_iou:
+            if (v >> 61) & 1:
+                # MPT amount: 8 byte value after the flags byte, then the id
+                raw, pos = self._take(mv, pos - 7, 8)
+                mpt_id, pos = self._take(mv, pos, 24)
+                value = int.from_bytes(raw, "big")
+                amt = amount_format.amount_to_string(0 if positive else 1, value, 0)
+                return f"{amt}/(MPT) {mpt_id.hex().upper()}", pos
+            drops = v & ((1 << 61) - 1)
+            amt = amount_format.amount_to_string(0 if positive else 1, drops, -6)
+            return f"{amt}/{self._issue_string(_ZERO_CURRENCY, _ZERO_ACCOUNT)}", pos
+        mantissa = v & ((1 << 54) - 1)
+        exponent = ((v >> 54) & 0xFF) - 97
+        negative = 0 if positive else 1
+        if mantissa == 0:
+            # serialized as 0x8000000000000000, which has the sign bit clear;
+            # show it like the in-memory STAmount printer does
+            negative = 0
+            exponent = _ZERO_IOU_EXPONENT
+        currency, pos = self._take(mv, pos, 20)
+        account, pos = self._take(mv, pos, 20)
+        amt = amount_format.amount_to_string(negative, mantissa, exponent)
+        return f"{amt}/{self._issue_string(currency, account)}", pos
+
+    def _pathset(self, mv, pos):
+        paths = []
+        path = []
+        while True:
+            if pos >= len(mv):
+                raise ValueError("PathSet is missing its end marker")
+            flags = mv[pos]
+            pos += 1
+            if flags in (_PATH_BOUNDARY, _PATH_END):
+                paths.append(path)
+                path = []
+                if flags == _PATH_END:
+                    return paths, pos
+                continue
+            element = {}
+            if flags & _PATH_ACCOUNT:
+                raw, pos = self._take(mv, pos, 20)
+                element["account"] = self.format_uint(raw, "AccountID")
+            if flags & _PATH_CURRENCY:
+                raw, pos = self._take(mv, pos, 20)
+                element["currency"] = self.format_uint(raw, "Currency")
+            if flags & _PATH_ISSUER:
+                raw, pos = self._take(mv, pos, 20)
+                element["issuer"] = self.format_uint(raw, "AccountID")
+            path.append(element)
@@ -0,0 +1,164 @@
+# encoding: utf-8
+
+# Field level diffs of STObjects across stops.
+#
+# `rippled-diff EXPR` decodes an STObject (or STLedgerEntry, STTx...) and
+# remembers it, keyed by its key_ if it has one and by its address if not.
+# Later calls print only the fields that changed since. The memory the
+# decoder reads is hashed first, and when the hash matches the snapshot's
+# nothing is decoded at all.
+
+import gdb
+
+from .layout import value_address
+from .printers import _dumps
+from .stobject import _fast_decoder
+
+
+class _Snapshot:
+    __slots__ = ("address", "fingerprint", "fields")
+
+    def __init__(self, address, fingerprint, fields):
+        self.address = address
+        self.fingerprint = fingerprint
+        self.fields = fields
+
+
+def diff_fields(old, new, path=""):
+    """Yield (path, old value, new value) for the fields that differ.
+
+    Nested objects are compared field by field, with dotted paths. Fields
+    only in old have a new value of None, and the other way round.
+    """
+    for name, value in new.items():
+        p = f"{path}{name}"
+        if name not in old:
+            yield p, None, value
+        elif isinstance(value, dict) and isinstance(old[name], dict):
+            yield from diff_fields(old[name], value, p + ".")
+        elif old[name] != value:
+            yield p, old[name], value
+    for name, value in old.items():
+        if name not in new:
+            yield f"{path}{name}", value, None
+
+
+class Snapshots:
+    "The last decoding of each STObject passed to rippled-diff."
+
+    def __init__(self):
+        self.snapshots = {}
+        self.reused = 0
+        self.decoded = 0
+
+    def clear(self):
+        self.snapshots.clear()
+
+    def stats(self):
+        return {
+            "reused": self.reused,
+            "decoded": self.decoded,
+            "entries": len(self.snapshots),
+        }
+
+    @staticmethod
+    def key(value):
+        "The snapshot key of an STObject gdb.Value: its key_, or its address."
+        try:
+            return "key " + str(value["key_"])
+        except gdb.error:
+            pass
+        addr = value_address(value)
+        if addr is None:
+            raise gdb.GdbError("The object is not in memory")
+        return f"address 0x{addr:x}"
+
+    def update(self, value):
+        """Decode value, unless unchanged, and remember it.
+
+        Return (key, previous snapshot or None, new snapshot).
+        """
+        key = self.key(value)
+        start, finish = _fast_decoder._vector_bounds(value)
+        fingerprint = _fast_decoder.fingerprint(start, finish)
+        old = self.snapshots.get(key)
+        if old is not None and fingerprint is not None:
+            if old.fingerprint == fingerprint:
+                self.reused += 1
+                return key, old, old
+        fields = _fast_decoder.decode_fields(start, finish)
+        self.decoded += 1
+        new = self.snapshots[key] = _Snapshot(value_address(value), fingerprint, fields)
+        return key, old, new
+
+
+snapshots = Snapshots()
+
+
+def _on_inferior_gone(event):
+    snapshots.clear()
+
+
+gdb.events.exited.connect(_on_inferior_gone)
+gdb.events.clear_objfiles.connect(_on_inferior_gone)
+
+
+def _format(value):
+    return _dumps(value)
+
+
+class DiffCommand(gdb.Command):
+    """Show what changed in an STObject: rippled-diff [--reset] [EXPR]
+
+    The first time an object is given, all its fields are printed and the
+    decoding is kept. After that only the fields that changed since the last
+    rippled-diff of the same object are. Objects are matched by key_ (for
+    ledger entries) or by address. --reset forgets EXPR, or all objects."""
+
+    def __init__(self):
+        super().__init__("rippled-diff", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        arg = arg.strip()
+        reset = arg.startswith("--reset")
+        if reset:
+            arg = arg[len("--reset") :].strip()
+            if not arg:
+                snapshots.clear()
+                return
+        if not arg:
+            raise gdb.GdbError("usage: rippled-diff [--reset] [EXPR]")
+        value = gdb.parse_and_eval(arg)
+        if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+            value = value.dereference()
+        if reset:
+            snapshots.snapshots.pop(snapshots.key(value), None)
+            return
+        try:
+            key, old, new = snapshots.update(value)
+        except (gdb.error, gdb.MemoryError) as e:
+            raise gdb.GdbError(f"Cannot decode {arg} as an STObject: {e}")
+
+        if old is None:
+            gdb.write(f"{key}: new snapshot\n")
+            for name, v in new.fields.items():
+                gdb.write(f"  {name} = {_format(v)}\n")
+            return
+        if old is new:
+            gdb.write(f"{key}: unchanged\n")
+            return
+        changes = list(diff_fields(old.fields, new.fields))
+        moved = ""
+        if None not in (old.address, new.address) and old.address != new.address:
+            moved = f", moved from 0x{old.address:x} to 0x{new.address:x}"
+        gdb.write(f"{key}: {len(changes)} changed fields{moved}\n")
+        for path, before, after in changes:
+            if before is None:
+                gdb.write(f"+ {path} = {_format(after)}\n")
+            elif after is None:
+                gdb.write(f"- {path} = {_format(before)}\n")
+            else:
+                gdb.write(f"  {path}: {_format(before)} -> {_format(after)}\n")
+
+
+DiffCommand()
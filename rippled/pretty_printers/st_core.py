@@ -0,0 +1,445 @@
+# encoding: utf-8
+
+# gdb-independent STObject decoding.
+#
+# An STLayout describes where rippled keeps things in memory: the offsets in
+# STVar, STBase and STObject, what kind of ST type each vtable address
+# belongs to with the offsets of its payload, and the names of the SFields.
+# STDecoder uses it to decode STObjects from any Memory: a live process
+# through gdb (see stobject.py), or a core file or raw memory dumps in a
+# plain Python process. decode_objects() spreads the work of decoding many
+# objects from dumps over a process pool.
+#
+# The layout is extracted in gdb with `rippled-export-layout FILE`.
+#
+# This module does not depend on gdb so it can be used outside of it:
+#
+#   python -m rippled.pretty_printers.st_core LAYOUT MEMORY ADDR...
+#
+# where MEMORY is a core file or a comma separated list of FILE@ADDRESS raw
+# dumps (for example from gdb's `dump binary memory`).
+
+import argparse
+import bisect
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+from . import amount_format
+from .uint_format import base_uint_to_string
+
+### Kinds of ST types, the first element of a type spec. The rest is:
+###
+###   ABSENT  (kind, name, size)                 STBase: field not present
+###   INTEGER (kind, name, size, off, vsize, signed)
+###   UINT    (kind, name, size, off, vsize, type name)
+###   AMOUNT  (kind, name, size, value off, value size, offset off,
+###            offset size, native off, negative off, currency off,
+###            account off, currency type name, account type name)
+###   OBJECT  (kind, name, size)
+###   OTHER   (kind, name, size)                 no decoder here
+
+ABSENT = "absent"
+INTEGER = "integer"
+UINT = "uint"
+AMOUNT = "amount"
+OBJECT = "object"
+OTHER = "other"
+
+
+class MemoryFault(Exception):
+    "An address that is not in the memory being decoded."
+
+
+class STLayout:
+    "Offsets and type specs the decoder needs. Serializable to JSON."
+
+    BASE_FIELDS = (
+        "ptr_size",
+        "stvar_size",
+        "p_off",
+        "d_off",
+        "d_size",
+        "fname_off",
+        "start_off",
+        "finish_off",
+    )
+
+    def __init__(self, **base):
+        for name in STLayout.BASE_FIELDS:
+            setattr(self, name, base[name])
+        self.ptr_fmt = "<Q" if self.ptr_size == 8 else "<I"
+        # vtable address -> type spec
+        self.types = {}
+        # SField address -> field name
+        self.sfields = {}
+
+    def to_dict(self):
+        return {
+            **{name: getattr(self, name) for name in STLayout.BASE_FIELDS},
+            "types": {str(vptr): list(spec) for vptr, spec in self.types.items()},
+            "sfields": {str(addr): name for addr, name in self.sfields.items()},
+        }
+
+    @staticmethod
+    def from_dict(d):
+        layout = STLayout(**{name: d[name] for name in STLayout.BASE_FIELDS})
+        layout.types = {int(k): tuple(v) for k, v in d.get("types", {}).items()}
+        layout.sfields = {int(k): v for k, v in d.get("sfields", {}).items()}
+        return layout
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return STLayout.from_dict(json.load(f))
+
+
+###
+### Memory.
+###
+### STDecoder reads through any object with a read(addr, length) method that
+### returns a bytes-like object: RegionMemory, RecordingMemory and
+### ReplayMemory here, which raise MemoryFault for memory they don't have, or
+### GdbMemory in stobject.py.
+###
+
+
+class RegionMemory:
+    "Memory made of (base address, bytes-like) regions, such as dumps."
+
+    def __init__(self, regions=()):
+        self.starts = []
+        self.regions = []
+        for base, data in regions:
+            self.add(base, data)
+
+    def add(self, base, data):
+        i = bisect.bisect(self.starts, base)
+        self.starts.insert(i, base)
+        self.regions.insert(i, (base, memoryview(data)))
+
+    def read(self, addr, length):
+        i = bisect.bisect(self.starts, addr) - 1
+        if i >= 0:
+            base, data = self.regions[i]
+            if addr + length <= base + len(data):
+                return data[addr - base : addr - base + length]
+        raise MemoryFault(f"Cannot access memory at 0x{addr:x}")
+
+    @staticmethod
+    def _map(path):
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def from_dumps(dumps):
+        "Memory of raw dump files, given as (path, base address) pairs."
+        return RegionMemory((base, RegionMemory._map(path)) for path, base in dumps)
+
+    @staticmethod
+    def from_core(path):
+        "Memory of the PT_LOAD segments of a 64 bit little endian ELF core file."
+        m = RegionMemory._map(path)
+        if m[:4] != b"\x7fELF" or m[4] != 2 or m[5] != 1:
+            raise ValueError(f"{path} is not a 64 bit little endian ELF file")
+        (phoff,) = struct.unpack_from("<Q", m, 0x20)
+        phentsize, phnum = struct.unpack_from("<HH", m, 0x36)
+        memory = RegionMemory()
+        view = memoryview(m)
+        for i in range(phnum):
+            p_type, _, offset, vaddr, _, filesz = struct.unpack_from(
+                "<IIQQQQ", m, phoff + i * phentsize
+            )
+            if p_type == 1 and filesz:  # PT_LOAD
+                memory.add(vaddr, view[offset : offset + filesz])
+        return memory
+
+    @staticmethod
+    def open(spec):
+        "Memory from a core file path, or from 'FILE@ADDRESS,...' dumps."
+        if "@" not in spec:
+            return RegionMemory.from_core(spec)
+        dumps = []
+        for part in spec.split(","):
+            path, base = part.rsplit("@", 1)
+            dumps.append((path, int(base, 0)))
+        return RegionMemory.from_dumps(dumps)
+
+
+class RecordingMemory:
+    """Reads through another memory and keeps what was read.
+
+    Decoding the same objects again from replay() reads exactly the same
+    ranges, so it needs nothing else, and nothing from the original memory.
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.reads = {}
+
+    def read(self, addr, length):
+        data = self.reads.get((addr, length))
+        if data is None:
+            data = self.reads[addr, length] = bytes(self.memory.read(addr, length))
+        return memoryview(data)
+
+    def replay(self):
+        return ReplayMemory(self.reads)
+
+
+class ReplayMemory:
+    "The reads recorded by a RecordingMemory, and nothing else."
+
+    def __init__(self, reads):
+        self.reads = reads
+
+    def read(self, addr, length):
+        data = self.reads.get((addr, length))
+        if data is None:
+            raise MemoryFault(f"0x{addr:x} ({length} bytes) was not recorded")
+        return memoryview(data)
+
+
+###
+### Decoding.
+###
+
+
+class STDecoder:
+    """Decodes STObjects from memory, with the values STObject.to_py_value() gives.
+
+    resolve_type(vptr, addr) is called for vtables the layout doesn't know
+    and returns a type spec. field_name(addr) is called for unknown SFields.
+    decode_other(spec, addr) decodes the types this module can't, such as
+    STArray. Without them the values are placeholders.
+    """
+
+    def __init__(
+        self,
+        layout,
+        memory,
+        resolve_type=None,
+        field_name=None,
+        decode_other=None,
+        pretty=False,
+    ):
+        self.layout = layout
+        self.memory = memory
+        self.resolve_type = resolve_type
+        self.resolve_field_name = field_name
+        self.decode_other = decode_other
+        self.pretty = pretty
+
+    def type_spec(self, vptr, addr):
+        spec = self.layout.types.get(vptr)
+        if spec is None:
+            if self.resolve_type is None:
+                return (OTHER, f"<vtable 0x{vptr:x}>", self.layout.ptr_size)
+            spec = self.layout.types[vptr] = self.resolve_type(vptr, addr)
+        return spec
+
+    def field_name(self, addr):
+        name = self.layout.sfields.get(addr)
+        if name is None:
+            if self.resolve_field_name is None:
+                return f"<SField 0x{addr:x}>"
+            name = self.layout.sfields[addr] = self.resolve_field_name(addr)
+        return name
+
+    def iter_raw(self, start, finish):
+        """Iterate over (name, spec, bytes, address) of the STVars in [start, finish).
+
+        bytes hold the object at address, starting at its vtable pointer.
+        Fields that are not present are skipped.
+        """
+        L = self.layout
+        if finish <= start:
+            return
+        buf = self.memory.read(start, finish - start)
+        ptr_fmt = L.ptr_fmt
+        for elt in range(0, finish - start, L.stvar_size):
+            p = struct.unpack_from(ptr_fmt, buf, elt + L.p_off)[0]
+            d_begin = start + elt + L.d_off
+            if d_begin <= p < d_begin + L.d_size:
+                # small object stored inline in the STVar
+                mv = buf[p - start :]
+                spec = self.type_spec(struct.unpack_from(ptr_fmt, mv, 0)[0], p)
+            else:
+                vptr = struct.unpack(ptr_fmt, self.memory.read(p, L.ptr_size))[0]
+                spec = self.type_spec(vptr, p)
+                mv = self.memory.read(p, spec[2])
+            if spec[0] == ABSENT:
+                continue
+            fname = struct.unpack_from(ptr_fmt, mv, L.fname_off)[0]
+            yield self.field_name(fname), spec, mv, p
+
+    def decode_value(self, spec, mv, addr):
+        "Decode the object of type spec held by mv, found at addr."
+        kind = spec[0]
+        if kind == INTEGER:
+            off, size, signed = spec[3:6]
+            return int.from_bytes(mv[off : off + size], "little", signed=signed)
+        if kind == UINT:
+            off, size, type_name = spec[3:6]
+            return base_uint_to_string(bytes(mv[off : off + size]), type_name)
+        if kind == AMOUNT:
+            return self._amount(spec, mv)
+        if kind == OBJECT:
+            L = self.layout
+            start = struct.unpack_from(L.ptr_fmt, mv, L.start_off)[0]
+            finish = struct.unpack_from(L.ptr_fmt, mv, L.finish_off)[0]
+            return self.decode_fields(start, finish)
+        if self.decode_other is not None:
+            return self.decode_other(spec, addr)
+        return f"<{spec[1]}>"
+
+    @staticmethod
+    def amount_parts(spec, mv):
+        """Return (negative, mantissa, exponent, native) of an AMOUNT spec object.
+
+        Native amounts are in drops, so their exponent is -6 for XRP.
+        """
+        value_off, value_size, offset_off, offset_size = spec[3:7]
+        native_off, negative_off = spec[7:9]
+        native = mv[native_off]
+        if native:
+            exponent = -6
+        else:
+            exponent = int.from_bytes(
+                mv[offset_off : offset_off + offset_size], "little", signed=True
+            )
+        mantissa = int.from_bytes(mv[value_off : value_off + value_size], "little")
+        return mv[negative_off], mantissa, exponent, native
+
+    @staticmethod
+    def uint_bytes(spec, mv):
+        "Return the bytes of the base_uint of a UINT spec object."
+        off, size = spec[3:5]
+        return bytes(mv[off : off + size])
+
+    def _amount(self, spec, mv):
+        cur_off, acc_off, cur_type, acc_type = spec[9:13]
+        issue = amount_format.issue_to_string(
+            bytes(mv[cur_off : cur_off + 20]),
+            bytes(mv[acc_off : acc_off + 20]),
+            cur_type,
+            acc_type,
+        )
+        negative, mantissa, exponent, native = self.amount_parts(spec, mv)
+        return amount_format.st_amount_to_string(
+            negative, mantissa, exponent, native, issue, self.pretty
+        )
+
+    def decode_fields(self, start, finish):
+        "Decode the STVars in [start, finish) into a dict."
+        return {
+            name: self.decode_value(spec, mv, p)
+            for name, spec, mv, p in self.iter_raw(start, finish)
+        }
+
+    def fingerprint(self, start, finish):
+        """Return a digest of the memory decode_fields(start, finish) reads.
+
+        It changes whenever the decoded fields could, and is much cheaper to
+        compute: nothing is formatted. Types without a decoder here may hold
+        pointers to memory that isn't hashed, so objects with such fields
+        have no fingerprint and None is returned.
+        """
+        h = hashlib.blake2b(digest_size=16)
+        if not self._hash_fields(h, start, finish):
+            return None
+        return h.digest()
+
+    def _hash_fields(self, h, start, finish):
+        L = self.layout
+        h.update(struct.pack("<QQ", start, finish))
+        for name, spec, mv, p in self.iter_raw(start, finish):
+            kind = spec[0]
+            if kind == OTHER:
+                return False
+            h.update(mv[: spec[2]])
+            if kind == OBJECT:
+                nested_start = struct.unpack_from(L.ptr_fmt, mv, L.start_off)[0]
+                nested_finish = struct.unpack_from(L.ptr_fmt, mv, L.finish_off)[0]
+                if not self._hash_fields(h, nested_start, nested_finish):
+                    return False
+        return True
+
+    def decode_object(self, addr):
+        "Decode the STObject (or STObject subclass, such as STLedgerEntry) at addr."
+        L = self.layout
+        mv = self.memory.read(addr, max(L.start_off, L.finish_off) + L.ptr_size)
+        start = struct.unpack_from(L.ptr_fmt, mv, L.start_off)[0]
+        finish = struct.unpack_from(L.ptr_fmt, mv, L.finish_off)[0]
+        return self.decode_fields(start, finish)
+
+
+###
+### Decoding in parallel.
+###
+
+_worker_decoder = None
+
+
+def _init_worker(layout_dict, memory_spec, pretty):
+    global _worker_decoder
+    layout = STLayout.from_dict(layout_dict)
+    _worker_decoder = STDecoder(layout, RegionMemory.open(memory_spec), pretty=pretty)
+
+
+def _decode_chunk(addrs):
+    r = []
+    for addr in addrs:
+        try:
+            r.append(_worker_decoder.decode_object(addr))
+        except (MemoryFault, struct.error, IndexError) as e:
+            r.append({"error": str(e)})
+    return r
+
+
+def decode_objects(
+    layout, memory_spec, addrs, workers=None, chunk_size=256, pretty=False
+):
+    """Decode the STObjects at addrs, in order, using a pool of processes.
+
+    memory_spec is what RegionMemory.open() takes; each worker maps the
+    files itself. Objects that can't be read decode to {"error": message}.
+    """
+    addrs = list(addrs)
+    chunks = [addrs[i : i + chunk_size] for i in range(0, len(addrs), chunk_size)]
+    initargs = (layout.to_dict(), memory_spec, pretty)
+    if workers == 1 or len(chunks) <= 1:
+        _init_worker(*initargs)
+        return [obj for chunk in chunks for obj in _decode_chunk(chunk)]
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=initargs
+    ) as pool:
+        return [obj for objs in pool.map(_decode_chunk, chunks) for obj in objs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode STObjects from memory dumps.")
+    parser.add_argument("layout", help="layout file from rippled-export-layout")
+    parser.add_argument("memory", help="core file, or FILE@ADDRESS[,FILE@ADDRESS...]")
+    parser.add_argument("addrs", nargs="+", help="addresses of STObjects")
+    parser.add_argument("--workers", type=int, help="number of processes")
+    args = parser.parse_args(argv)
+
+    layout = STLayout.load(args.layout)
+    addrs = [int(a, 0) for a in args.addrs]
+    objs = decode_objects(layout, args.memory, addrs, args.workers)
+    for addr, obj in zip(addrs, objs):
+        json.dump({"address": f"0x{addr:x}", "object": obj}, sys.stdout)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
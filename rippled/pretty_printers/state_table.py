@@ -0,0 +1,246 @@
+from rippled.pretty_printers.printers import _dumps, _register_printer
+
+import gdb
+import struct
+
+from . import rbtree
+from .heap_scan import ledger_entry_layout
+from .layout import (
+    field_path,
+    find_field,
+    lookup_layout,
+    read_memory,
+    referenced,
+    value_address,
+)
+from .rtti import resolver as rtti
+
+# Longest field summary shown per entry by rippled-view without --json
+VIEW_SUMMARY_WIDTH = 120
+
+
+###
+### State tables.
+###
+### RawStateTable (in OpenView) and ApplyStateTable (in ApplyViewBase, and so
+### in Sandbox and PaymentSandbox) keep the ledger entries a view changed in
+### an items_ map from key to an action and the SLE. The map is walked with
+### rbtree, one read per node, and the SLEs are decoded by the fast STObject
+### decoder.
+###
+
+
+class StateTableLayout:
+    "Where the key, action and SLE of each item of a state table are."
+
+    def __init__(self, table_type):
+        table_type = table_type.strip_typedefs()
+        self.items_off, map_type = field_path(table_type, "items_")
+        self.tree = rbtree.layout_for(map_type)
+        mapped = self.tree.mapped_type.strip_typedefs()
+        # ApplyStateTable maps to std::pair<Action, std::shared_ptr<SLE>>,
+        # RawStateTable to a sleAction struct in newer versions
+        for action_name, sle_name in (("first", "second"), ("action", "sle")):
+            if find_field(mapped, action_name) and find_field(mapped, sle_name):
+                break
+        else:
+            raise gdb.error(f"Unknown state table item type {mapped}")
+        action_off, action_type = field_path(mapped, action_name)
+        sle_off, sle_type = field_path(mapped, sle_name)
+        self.action_off = self.tree.value_off + action_off
+        self.action_size = action_type.sizeof
+        self.sle_off = self.tree.value_off + sle_off + field_path(sle_type, "_M_ptr")[0]
+        self.key_off = self.tree.key_off + field_path(self.tree.key_type, "data_")[0]
+        self.key_size = self.tree.key_type.sizeof
+        self.ptr_fmt = self.tree.ptr_fmt
+        # Action value -> name
+        self.actions = {}
+        for f in action_type.strip_typedefs().fields():
+            self.actions[f.enumval] = f.name.rsplit("::", 1)[-1]
+
+    def map_address(self, table_addr):
+        return table_addr + self.items_off
+
+    def size(self, table_addr):
+        map_addr = self.map_address(table_addr)
+        length = self.tree.count_off + struct.calcsize(self.ptr_fmt)
+        return self.tree.size(read_memory(map_addr, length))
+
+    def iter_items(self, table_addr):
+        "Iterate over (key, action, SLE address) of the items, in key order."
+        for _, node in self.tree.iter_nodes(self.map_address(table_addr)):
+            key = bytes(node[self.key_off : self.key_off + self.key_size])
+            action = int.from_bytes(
+                node[self.action_off : self.action_off + self.action_size], "little"
+            )
+            sle = struct.unpack_from(self.ptr_fmt, node, self.sle_off)[0]
+            yield key.hex().upper(), self.actions.get(action, str(action)), sle
+
+
+_layouts = {}
+
+
+def state_table_layout(table_type):
+    "Return the (cached) StateTableLayout of a state table type."
+    key = str(table_type.strip_typedefs())
+    layout = _layouts.get(key)
+    if layout is None:
+        layout = _layouts[key] = StateTableLayout(table_type)
+    return layout
+
+
+def _on_objfiles_changed(event):
+    _layouts.clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
+
+
+def find_state_table(value):
+    """Return (address, type) of the state table of a view or state table value.
+
+    Views keep their state table in items_, and state tables keep their map
+    in items_, so items_ is followed until it is a std::map. Pointers and
+    references are followed, and a view known by a base class such as
+    ApplyView is downcast to its dynamic type first.
+    """
+    value = referenced(value)
+    if value.type.strip_typedefs().code == gdb.TYPE_CODE_PTR:
+        value = value.dereference()
+    if find_field(value.type.strip_typedefs(), "items_") is None:
+        try:
+            value = rtti.downcast(value)
+        except gdb.error:
+            pass
+    t = value.type.strip_typedefs()
+    addr = value_address(value)
+    if addr is None:
+        raise gdb.error(f"{t} is not in memory")
+    while True:
+        found = find_field(t, "items_")
+        if found is None:
+            raise gdb.error(f"{t} is not a view or a state table")
+        items_type = found[1].type.strip_typedefs()
+        if find_field(items_type, "_M_t") is not None:
+            return addr, t
+        addr += found[0]
+        t = items_type
+
+
+@_register_printer
+class StateTable:
+    "Pretty printer for ripple::detail::RawStateTable and ApplyStateTable"
+    printer_name = "StateTable"
+    version = "1.0"
+    type_name_re = "^ripple::detail::(Raw|Apply)StateTable$"
+
+    def __init__(self, value):
+        self.value = value
+
+    def _layout(self):
+        return state_table_layout(self.value.type)
+
+    def to_string(self):
+        name = self.value.type.strip_typedefs().tag.rsplit("::", 1)[-1]
+        addr = value_address(self.value)
+        if addr is None:
+            return name
+        return f"{name} ({self._layout().size(addr)} items)"
+
+    def children(self):
+        # Items are read as gdb asks for them; the SLEs are printed by the
+        # STObject printer only if gdb shows them.
+        addr = value_address(self.value)
+        if addr is None:
+            return
+        sle_ptr = lookup_layout("ripple::STLedgerEntry").type.pointer()
+        for i, (key, action, sle) in enumerate(self._layout().iter_items(addr)):
+            yield f"[{2 * i}]", f"{action} {key}"
+            if sle:
+                yield f"[{2 * i + 1}]", gdb.Value(sle).cast(sle_ptr).dereference()
+            else:
+                yield f"[{2 * i + 1}]", "(none)"
+
+    def display_hint(self):
+        return "map"
+
+
+def iter_view_entries(value, cached=False):
+    """Iterate over the entries of a view's state table, decoded.
+
+    Yields (action, type name, key, fields). Entries only read through an
+    ApplyView (the "cache" action) are skipped unless cached is True.
+    """
+    table_addr, table_type = find_state_table(value)
+    layout = state_table_layout(table_type)
+    entry_layout = ledger_entry_layout()
+    for key, action, sle in layout.iter_items(table_addr):
+        if action == "cache" and not cached:
+            continue
+        if not sle:
+            yield action, None, key, None
+            continue
+        try:
+            entry_type, _, fields = entry_layout.decode(sle)
+        except (gdb.error, gdb.MemoryError) as e:
+            entry_type, fields = None, {"error": str(e)}
+        yield action, entry_type, key, fields
+
+
+def _summary(fields):
+    s = _dumps(fields)
+    if len(s) > VIEW_SUMMARY_WIDTH:
+        s = s[: VIEW_SUMMARY_WIDTH - 3] + "..."
+    return s
+
+
+class ViewCommand(gdb.Command):
+    """Dump the ledger entries a view changed: rippled-view [--json] [--all] EXPR
+
+    EXPR is an OpenView, an ApplyView such as a Sandbox or PaymentSandbox,
+    or their RawStateTable or ApplyStateTable. Every inserted, modified and
+    erased entry is decoded and printed as it is read, one line each: a
+    table row, or a JSON object with --json. --all also shows the entries
+    an ApplyView only read."""
+
+    def __init__(self):
+        super().__init__("rippled-view", gdb.COMMAND_DATA, gdb.COMPLETE_EXPRESSION)
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        as_json = cached = False
+        while args and args[0].startswith("--"):
+            opt = args.pop(0)
+            if opt == "--json":
+                as_json = True
+            elif opt == "--all":
+                cached = True
+            else:
+                raise gdb.GdbError(f"Unknown option {opt}")
+        if not args:
+            raise gdb.GdbError("usage: rippled-view [--json] [--all] EXPR")
+        value = gdb.parse_and_eval(" ".join(args))
+        counts = {}
+        try:
+            for action, entry_type, key, fields in iter_view_entries(value, cached):
+                counts[action] = counts.get(action, 0) + 1
+                if as_json:
+                    entry = {"action": action, "type": entry_type, "key": key}
+                    entry["fields"] = fields
+                    gdb.write(_dumps(entry) + "\n")
+                else:
+                    gdb.write(
+                        f"{action:<8} {entry_type or '-':<22} {key}"
+                        f" {_summary(fields) if fields is not None else '-'}\n"
+                    )
+                gdb.flush()
+        except gdb.error as e:
+            raise gdb.GdbError(str(e))
+        if not as_json:
+            total = sum(counts.values())
+            by_action = "".join(f", {n} {a}" for a, n in sorted(counts.items()))
+            gdb.write(f"{total} entries{by_action}\n")
+
+
+ViewCommand()
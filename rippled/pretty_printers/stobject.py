@@ -1,12 +1,116 @@
 from rippled.pretty_printers.printers import *
 from rippled.pretty_printers.printers import _register_printer
 from rippled.pretty_printers.printers import printer_gen
-from rippled.pretty_printers.base_uint import BaseUInt
+from rippled.pretty_printers.base_uint import BaseUInt, base_uint_to_string
+from rippled.pretty_printers import amounts, st_core
 from rippled.pretty_printers.amounts import STAmount
-
+from rippled.pretty_printers.serialized import (
+    SerializedDecoder,
+    default_field_name,
+    field_code,
+)
+from rippled.pretty_printers.layout import (
+    layout_of,
+    lookup_layout,
+    pointer_format,
+    read_memory,
+    value_address,
+)
+from rippled.pretty_printers.decode_cache import decode_cache, memory_digest
+from rippled.pretty_printers.rtti import resolver as rtti, vtable_pointer
+
+import itertools
 import re
 import json
-from libstdcxx.v6.printers import StdVectorPrinter
+import struct
+import gdb
+from libstdcxx.v6.printers import StdMapPrinter, StdVectorPrinter
+
+# set to False to decode every STObject field through gdb.Value
+FAST_DECODE = True
+# set to False to fill the SField name cache one field at a time instead of
+# walking rippled's SField::knownCodeToField map on the first lookup
+PREWARM_SFIELDS = True
+
+
+def _read_std_string(v):
+    try:
+        p = v["_M_dataplus"]["_M_p"]
+        return p.string(length=int(v["_M_string_length"]))
+    except gdb.error:
+        return str(v)[1:-1]
+
+
+class _SFieldRegistry:
+    """Maps SField addresses to field names.
+
+    SFields are static singletons in rippled, so a name never changes for the
+    lifetime of the inferior process.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.names = {}
+        # field code -> name, as used by serialized objects
+        self.codes = {}
+        self.prewarmed = False
+        self.sfield_ptr = None
+
+    def prewarm(self):
+        "Read the names of all the SFields in SField::knownCodeToField."
+        self.prewarmed = True
+        try:
+            m = gdb.parse_and_eval("ripple::SField::knownCodeToField")
+            map_printer = StdMapPrinter(typename="", val=m)
+            code = None
+            for i, (_, v) in enumerate(map_printer.children()):
+                if not i % 2:
+                    code = int(v)
+                    continue
+                name = _read_std_string(v.dereference()["fieldName"])
+                self.names[int(v)] = name
+                self.codes[code] = name
+        except gdb.error:
+            pass
+        return len(self.names)
+
+    def code_name(self, type_id, field_id):
+        "Return the name of the field with a serialized (type, field) id."
+        if not self.prewarmed:
+            self.prewarm()
+        n = self.codes.get(field_code(type_id, field_id))
+        return n if n is not None else default_field_name(type_id, field_id)
+
+    def name(self, addr, sfield=None):
+        "Return the name of the SField at addr. sfield is its gdb.Value, if known."
+        n = self.names.get(addr)
+        if n is not None:
+            return n
+        if PREWARM_SFIELDS and not self.prewarmed:
+            self.prewarm()
+            n = self.names.get(addr)
+            if n is not None:
+                return n
+        if sfield is None:
+            if self.sfield_ptr is None:
+                self.sfield_ptr = gdb.lookup_type("ripple::SField").pointer()
+            sfield = gdb.Value(addr).cast(self.sfield_ptr).dereference()
+        n = _read_std_string(sfield["fieldName"])
+        self.names[addr] = n
+        return n
+
+
+_sfield_registry = _SFieldRegistry()
+
+
+def _on_inferior_gone(event):
+    _sfield_registry.clear()
+
+
+gdb.events.exited.connect(_on_inferior_gone)
+gdb.events.clear_objfiles.connect(_on_inferior_gone)
 
 
 @_register_printer
@@ -20,7 +124,10 @@ class SField:
         self.value = value
 
     def to_string(self):
-        return str(self.value["fieldName"])[1:-1]
+        addr = self.value.address
+        if addr is None:
+            return _read_std_string(self.value["fieldName"])
+        return _sfield_registry.name(int(addr), self.value)
 
 
 @_register_printer
@@ -37,11 +144,11 @@ class STVar:
 
     def to_py_value(self):
         if self.proxy_printer is None:
-            return f"No printer for type: {str(self.proxy_value.dynamic_type)}"
+            return f"No printer for type: {rtti.dynamic_type(self.proxy_value)}"
         return self.proxy_printer.to_py_value()
 
     def fname(self):
-        return SField(self.proxy_value["fName"].dereference()).to_string()
+        return _sfield_registry.name(int(self.proxy_value["fName"]))
 
     def is_empty(self):
         return (
@@ -64,18 +171,17 @@ class STBase:
     type_name_re = "^ripple::STBase$"
 
     def __init__(self, value):
-        self.value = value.cast(value.dynamic_type)
+        self.value = rtti.downcast(value)
 
     def is_empty(self):
-        return self.value.dynamic_type.tag == "ripple::STBase"
+        return self.value.type.strip_typedefs().tag == "ripple::STBase"
 
     def to_py_value(self):
-        dt = self.value.dynamic_type
+        dt = self.value.type.strip_typedefs()
         if dt.tag.startswith("ripple::STInteger"):
             return STInteger(self.value).to_py_value()
         if dt.tag.startswith("ripple::STBitString"):
             return STBitString(self.value).to_py_value()
-        sf = SField(self.value["fName"].dereference()).to_string()
         match dt.tag:
             case "ripple::STBase":
                 return "Not Present"
@@ -158,6 +264,10 @@ class STObject:
         self.enabled = True
 
     def to_py_value(self):
+        if FAST_DECODE:
+            r = _fast_decoder.decode_stobject(self.value)
+            if r is not None:
+                return r
         v = self.value["v_"]
         v_printer = StdVectorPrinter(typename="", val=v)
         r = {}
@@ -168,6 +278,342 @@ class STObject:
             r[stvar.fname()] = stvar.to_py_value()
         return r
 
+    def _iter_fields(self):
+        if FAST_DECODE:
+            fields = _fast_decoder.iter_stobject(self.value)
+            if fields is not None:
+                return fields
+        return self._iter_fields_slow()
+
+    def _iter_fields_slow(self):
+        v_printer = StdVectorPrinter(typename="", val=self.value["v_"])
+        for i, o in v_printer.children():
+            stvar = STVar(o)
+            if stvar.is_empty():
+                continue
+            proxy = stvar.proxy_value
+            yield stvar.fname(), rtti.downcast(proxy)
+
+    def children(self):
+        # Fields are decoded as gdb asks for them, so `print elements` and
+        # frontends that page through children only pay for what they show.
+        for i, (name, value) in enumerate(self._iter_fields()):
+            yield f"[{2 * i}]", name
+            yield f"[{2 * i + 1}]", value
+
+    def display_hint(self):
+        return "map"
+
     def to_string(self):
-        d = self.to_py_value()
-        return json.dumps(d, indent=2)
+        v = self.value["v_"]["_M_impl"]
+        if v["_M_start"] == v["_M_finish"]:
+            return "{}"
+        return None
+
+
+###
+### Fast STObject decoding.
+###
+### The decoding itself is done by st_core, which doesn't depend on gdb. This
+### adapter gives it the layout of the inferior, resolves vtables through the
+### shared RTTI cache and SField names through the registry, and hands the
+### types st_core can't decode back to the gdb.Value printers above.
+###
+
+
+class GdbMemory:
+    "The memory of the inferior, for st_core."
+
+    def read(self, addr, length):
+        return read_memory(addr, length)
+
+
+def _type_spec(t):
+    "Return the st_core type spec of an ST type."
+    t = t.strip_typedefs()
+    tag = t.tag
+    if tag == "ripple::STBase":
+        return (st_core.ABSENT, tag, t.sizeof)
+    if tag.startswith("ripple::STInteger"):
+        off, size, ft = layout_of(t).field("value_")
+        signed = getattr(ft.strip_typedefs(), "is_signed", False)
+        return (st_core.INTEGER, tag, t.sizeof, off, size, signed)
+    if tag.startswith("ripple::STBitString") or tag == "ripple::STAccount":
+        tl = layout_of(t)
+        off, size, _ = tl.field("value_", "data_")
+        return (st_core.UINT, tag, t.sizeof, off, size, tl.type_name("value_"))
+    if tag == "ripple::STAmount":
+        tl = layout_of(t)
+        return (
+            st_core.AMOUNT,
+            tag,
+            t.sizeof,
+            *tl.field("mValue")[:2],
+            *tl.field("mOffset")[:2],
+            tl.offset("mIsNative"),
+            tl.offset("mIsNegative"),
+            tl.offset("mIssue", "currency", "data_"),
+            tl.offset("mIssue", "account", "data_"),
+            tl.type_name("mIssue", "currency"),
+            tl.type_name("mIssue", "account"),
+        )
+    if tag == "ripple::STObject":
+        return (st_core.OBJECT, tag, t.sizeof)
+    return (st_core.OTHER, tag, t.sizeof)
+
+
+def st_layout():
+    "Return an st_core.STLayout of the inferior's STVar, STBase and STObject."
+    stvar = lookup_layout("ripple::detail::STVar")
+    stbase = lookup_layout("ripple::STBase")
+    stobject = lookup_layout("ripple::STObject")
+    return st_core.STLayout(
+        ptr_size=struct.calcsize(pointer_format()),
+        stvar_size=stvar.sizeof,
+        p_off=stvar.offset("p_"),
+        d_off=stvar.offset("d_"),
+        d_size=stvar.size("d_"),
+        fname_off=stbase.offset("fName"),
+        start_off=stobject.offset("v_", "_M_impl", "_M_start"),
+        finish_off=stobject.offset("v_", "_M_impl", "_M_finish"),
+    )
+
+
+class _FastDecoder:
+    "Decodes STObjects of the inferior with st_core."
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.decoder = None
+        self.stbase_type = None
+
+    def _decoder(self):
+        if self.decoder is None:
+            self.stbase_type = lookup_layout("ripple::STBase").type
+            self.decoder = st_core.STDecoder(
+                st_layout(),
+                GdbMemory(),
+                resolve_type=self._resolve_type,
+                field_name=_sfield_registry.name,
+                decode_other=self._decode_other,
+            )
+        self.decoder.pretty = amounts.PRETTY_AMOUNT
+        return self.decoder
+
+    def _resolve_type(self, vptr, addr):
+        return _type_spec(rtti.type_at(addr, self.stbase_type, vptr))
+
+    def _value(self, addr):
+        "The gdb.Value of the ST object at addr, as its dynamic type."
+        v = gdb.Value(addr).cast(self.stbase_type.pointer()).dereference()
+        return rtti.downcast(v)
+
+    def _decode_other(self, spec, addr):
+        return STBase(self._value(addr)).to_py_value()
+
+    def iter_fields(self, start, finish, lazy=False):
+        """Return an iterator of (name, value) over the STVars in [start, finish).
+
+        The STVar array is read before this returns, the fields are decoded as
+        the iterator advances. With lazy=True, nested STObjects and types
+        without a fast decoder are returned as gdb.Values, for gdb to print.
+        """
+        decoder = self._decoder()
+        raw = decoder.iter_raw(start, finish)
+        # read the STVar array now, so errors are raised here
+        first = next(raw, None)
+        if first is None:
+            return iter(())
+        return self._iter_decoded(decoder, first, raw, lazy)
+
+    def _iter_decoded(self, decoder, first, raw, lazy):
+        for name, spec, mv, p in itertools.chain((first,), raw):
+            if lazy and spec[0] in (st_core.OBJECT, st_core.OTHER):
+                yield name, self._value(p)
+            else:
+                yield name, decoder.decode_value(spec, mv, p)
+
+    def decode_fields(self, start, finish):
+        "Decode the STVars in [start, finish) into a dict."
+        return self._decoder().decode_fields(start, finish)
+
+    def snapshot(self, start, finish):
+        """Read what decoding the STVars in [start, finish) needs, and no more.
+
+        Returns an st_core.STDecoder that decodes them from a copy of that
+        memory, without gdb, so it can run in another thread. Types st_core
+        can't decode are decoded now, through gdb.
+        """
+        decoder = self._decoder()
+        memory = st_core.RecordingMemory(decoder.memory)
+        recorder = st_core.STDecoder(
+            decoder.layout,
+            memory,
+            resolve_type=self._resolve_type,
+            field_name=_sfield_registry.name,
+        )
+        others = {}
+        L = decoder.layout
+        todo = [(start, finish)]
+        while todo:
+            for name, spec, mv, p in recorder.iter_raw(*todo.pop()):
+                if spec[0] == st_core.OBJECT:
+                    nested_start = struct.unpack_from(L.ptr_fmt, mv, L.start_off)[0]
+                    nested_finish = struct.unpack_from(L.ptr_fmt, mv, L.finish_off)[0]
+                    todo.append((nested_start, nested_finish))
+                elif spec[0] == st_core.OTHER:
+                    others[p] = self._decode_other(spec, p)
+        return st_core.STDecoder(
+            st_core.STLayout.from_dict(L.to_dict()),
+            memory.replay(),
+            decode_other=lambda spec, addr: others[addr],
+            pretty=amounts.PRETTY_AMOUNT,
+        )
+
+    def fingerprint(self, start, finish):
+        "A digest of the STVars in [start, finish), see STDecoder.fingerprint."
+        return self._decoder().fingerprint(start, finish)
+
+    def _vector_bounds(self, value):
+        v = value["v_"]["_M_impl"]
+        return int(v["_M_start"]), int(v["_M_finish"])
+
+    def decode_stobject(self, value):
+        "Decode an STObject gdb.Value. Return None if it can't be done fast."
+        try:
+            start, finish = self._vector_bounds(value)
+            addr = value_address(value)
+            if addr is None:
+                return self.decode_fields(start, finish)
+            # the fingerprint covers everything decoded, when there is one
+            fingerprint = self.fingerprint(start, finish)
+            persistent = fingerprint is not None
+            if not persistent:
+                fingerprint = memory_digest(start, finish - start)
+            return decode_cache.lookup(
+                (addr, "ripple::STObject", amounts.PRETTY_AMOUNT),
+                fingerprint,
+                lambda: self.decode_fields(start, finish),
+                persistent,
+            )
+        except (gdb.error, gdb.MemoryError):
+            return None
+
+    def iter_stobject(self, value):
+        "Like iter_fields(lazy=True) for an STObject. None if it can't be done fast."
+        try:
+            return self.iter_fields(*self._vector_bounds(value), lazy=True)
+        except (gdb.error, gdb.MemoryError):
+            return None
+
+
+_fast_decoder = _FastDecoder()
+
+
+def _on_objfiles_changed(event):
+    _fast_decoder.clear()
+
+
+gdb.events.new_objfile.connect(_on_objfiles_changed)
+gdb.events.clear_objfiles.connect(_on_objfiles_changed)
+
+# ST types whose vtables are put in exported layouts, so st_core can tell
+# them apart without gdb. Types missing from the inferior are skipped.
+EXPORTED_ST_TYPES = (
+    "ripple::STBase",
+    "ripple::STObject",
+    "ripple::STAmount",
+    "ripple::STAccount",
+    "ripple::STInteger<unsigned char>",
+    "ripple::STInteger<unsigned short>",
+    "ripple::STInteger<unsigned int>",
+    "ripple::STInteger<unsigned long>",
+    "ripple::STBitString<128>",
+    "ripple::STBitString<160>",
+    "ripple::STBitString<192>",
+    "ripple::STBitString<256>",
+    "ripple::STArray",
+    "ripple::STBlob",
+    "ripple::STVector256",
+    "ripple::STPathSet",
+    "ripple::STIssue",
+    "ripple::STCurrency",
+    "ripple::STNumber",
+    "ripple::STXChainBridge",
+)
+
+
+def export_layout():
+    """Return an st_core.STLayout of the inferior for decoding without gdb.
+
+    It holds the vtables of EXPORTED_ST_TYPES, those resolved so far, and the
+    names of every SField in SField::knownCodeToField.
+    """
+    layout = _fast_decoder._decoder().layout
+    for name in EXPORTED_ST_TYPES:
+        try:
+            t = gdb.lookup_type(name)
+            vptr = vtable_pointer(t)
+        except gdb.error:
+            continue
+        if vptr not in layout.types:
+            layout.types[vptr] = _type_spec(t)
+    if not _sfield_registry.prewarmed:
+        _sfield_registry.prewarm()
+    layout.sfields.update(_sfield_registry.names)
+    return layout
+
+
+class ExportLayoutCommand(gdb.Command):
+    """Save what st_core needs to decode STObjects: rippled-export-layout FILE
+
+    The file is JSON and is given to `python -m rippled.pretty_printers.st_core`
+    to decode STObjects from a core file or memory dumps without gdb."""
+
+    def __init__(self):
+        super().__init__(
+            "rippled-export-layout", gdb.COMMAND_DATA, gdb.COMPLETE_FILENAME
+        )
+
+    def invoke(self, arg, from_tty):
+        args = gdb.string_to_argv(arg)
+        if len(args) != 1:
+            raise gdb.GdbError("usage: rippled-export-layout FILE")
+        layout = export_layout()
+        layout.save(args[0])
+        gdb.write(
+            f"Saved {len(layout.types)} ST types and {len(layout.sfields)} SFields"
+            f" to {args[0]}\n"
+        )
+
+
+ExportLayoutCommand()
+
+
+###
+### Serialized STObjects.
+###
+### Buffers and Blobs often hold a serialized transaction or ledger entry.
+### These are decoded in Python from the raw bytes, with field names from
+### the SField registry and values formatted like the printers above.
+###
+
+_SERIALIZED_UINT_TYPES = {
+    "AccountID": "ripple::base_uint<160, ripple::detail::AccountIDTag>",
+    "Currency": "ripple::base_uint<160, ripple::detail::CurrencyTag>",
+}
+
+
+def _format_serialized_uint(mem, tag):
+    type_name = _SERIALIZED_UINT_TYPES.get(tag)
+    if type_name is None:
+        type_name = f"ripple::base_uint<{tag}, void>"
+    return base_uint_to_string(mem, type_name)
+
+
+def decode_serialized(data):
+    "Decode the bytes of a serialized STObject like STObject.to_py_value()."
+    decoder = SerializedDecoder(_sfield_registry.code_name, _format_serialized_uint)
+    return decoder.decode(data)
@@ -0,0 +1,65 @@
+# encoding: utf-8
+
+# base_uint formatting shared by the BaseUInt printer and the decoders.
+#
+# This module does not depend on gdb so it can be used outside of it.
+
+import binascii
+import functools
+import re
+
+from . import known_accounts
+from .base58 import encode_account_id, encode_many
+
+BASE_UINT_RE = re.compile(r"^ripple::base_uint<(\d+)[^,]*,\s*([^>]*)>$")
+
+
+@functools.lru_cache(maxsize=None)
+def base_uint_params(type_name):
+    "Return (num_bits, tag_name) for a base_uint type name, or (None, None)."
+    res = BASE_UINT_RE.match(type_name)
+    if not res:
+        return None, None
+    num_bits, tag_name = res.groups()
+    if tag_name.endswith("Tag"):
+        tag_name = tag_name[:-3]
+    sw = "ripple::detail::"
+    if tag_name.startswith(sw):
+        tag_name = tag_name[len(sw) :]
+    return int(num_bits), tag_name
+
+
+def base_uint_to_string(mem, type_name):
+    "Format the raw bytes of a base_uint the way the BaseUInt printer does."
+    num_bits, tag_name = base_uint_params(type_name)
+    if tag_name == "AccountID":
+        if not any(mem):
+            return "RootAccount"
+        name = known_accounts.registry.label(mem)
+        if name is not None:
+            return name
+        return f"({tag_name}) {encode_account_id(mem)}"
+    if tag_name == "Currency":
+        if not any(mem[0:12]) and not any(mem[16:]):
+            if not any(mem[12:15]):
+                return "XRP"
+            return str(mem[12:15], "ascii")
+        return f"({tag_name}) {binascii.hexlify(mem).upper().decode('utf-8')}"
+    return f"({type_name}) {binascii.hexlify(mem).upper().decode('utf-8')}"
+
+
+def account_ids_to_strings(raws):
+    "Format a batch of raw AccountIDs the way the BaseUInt printer does."
+    raws = [bytes(raw) for raw in raws]
+    labels = [known_accounts.registry.label(raw) for raw in raws]
+    todo = [raw for raw, l in zip(raws, labels) if l is None and any(raw)]
+    encoded = dict(zip(todo, encode_many(todo)))
+    r = []
+    for raw, l in zip(raws, labels):
+        if not any(raw):
+            r.append("RootAccount")
+        elif l is not None:
+            r.append(l)
+        else:
+            r.append(f"(AccountID) {encoded[raw]}")
+    return r
@@ -0,0 +1,187 @@
+'''Append-only trace files.
+
+A trace file starts with a short header, followed by records. Each record is
+a little endian (length, crc32) pair followed by `length` bytes of pickled
+payload. Records are only ever appended, so a file that was cut short (gdb
+died, the machine rebooted) is still readable up to the last complete record.
+
+This module does not depend on gdb, so traces can be read in a normal Python
+process.
+'''
+
+import mmap
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+MAGIC = b'RTRC\x01\x00\x00\x00'
+_RECORD_HEADER = struct.Struct('<II')
+
+DEFAULT_FLUSH_EVERY = 1024  # records
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+
+
+class TraceWriter:
+    '''Appends records to a trace file.
+
+    Records are flushed to the OS every `flush_every` records, and a
+    background thread flushes whatever is left every `flush_interval`
+    seconds, so the last records of a session don't wait for the next
+    write. close() also fsyncs the file.'''
+
+    def __init__(self, path, flush_every=DEFAULT_FLUSH_EVERY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # A writer that died may have left a torn record at the end, and
+        # readers stop there: append after the last complete record.
+        end = valid_length(path) if os.path.exists(path) else 0
+        self.f = open(path, 'r+b' if end else 'wb')
+        self.f.truncate(end)
+        self.f.seek(end)
+        if end == 0:
+            self.f.write(MAGIC)
+        self.unflushed = 0
+        self.count = 0
+        # the flusher thread and write() both flush
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.flusher = None
+        if flush_interval:
+            self.flusher = threading.Thread(target=self._flush_periodically,
+                                            name='trace-flush', daemon=True)
+            self.flusher.start()
+
+    def _flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            with self.lock:
+                if self.unflushed and not self.f.closed:
+                    self._flush()
+
+    def write(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.f.write(_RECORD_HEADER.pack(len(payload),
+                                             zlib.crc32(payload)))
+            self.f.write(payload)
+            self.count += 1
+            self.unflushed += 1
+            if self.unflushed >= self.flush_every:
+                self._flush()
+
+    def _flush(self):
+        self.f.flush()
+        self.unflushed = 0
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.closed.set()
+        if self.flusher is not None:
+            self.flusher.join()
+        with self.lock:
+            if not self.f.closed:
+                self._flush()
+                os.fsync(self.f.fileno())
+                self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _records(m, path):
+    '''Yield (payload, end offset) of the complete records of a trace in m'''
+    if m[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a trace file' % path)
+    pos = len(MAGIC)
+    end = len(m)
+    while pos + _RECORD_HEADER.size <= end:
+        length, crc = _RECORD_HEADER.unpack_from(m, pos)
+        pos += _RECORD_HEADER.size
+        if pos + length > end:
+            return
+        payload = m[pos:pos + length]
+        if zlib.crc32(payload) != crc:
+            return
+        pos += length
+        yield payload, pos
+
+
+def valid_length(path):
+    '''Return the length of the readable part of the trace file at path:
+    everything up to the end of its last complete record'''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < len(MAGIC):
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            end = len(MAGIC)
+            for _, end in _records(m, path):
+                pass
+            return end
+
+
+class TraceReader:
+    '''Iterates over the records of a trace file without loading all of it.
+
+    The file is mmap'd. Iteration stops at the first incomplete or corrupt
+    record, which is where a writer that died would have stopped.'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(MAGIC):
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for payload, _ in _records(m, self.path):
+                    yield pickle.loads(payload)
+
+
+def read_trace(path):
+    '''Iterate over the records in the trace file at path'''
+    return iter(TraceReader(path))
+
+
+def iter_tx_flows(path):
+    '''Rebuild the per transaction dicts of a flow.py trace, one at a time.
+
+    Yields dicts shaped like flow.TX_FLOW: {'old': tx_flow, 'new': tx_flow},
+    with an extra 'mismatch' key that is True if old and new flow disagreed.
+    A transaction that was still running when the trace ended is yielded
+    with 'complete' set to False.'''
+    tx = None
+    for record in read_trace(path):
+        kind = record[0]
+        if kind == 'tx_start':
+            if tx is not None:
+                yield tx
+            txid = record[1]
+            tx = {side: {'txid': txid, 'in': [], 'out': [], 'iter': []}
+                  for side in ('old', 'new')}
+            tx['mismatch'] = False
+            tx['complete'] = False
+        elif tx is None:
+            continue
+        elif kind == 'cand':
+            _, side, vin, vout, it = record
+            tx[side]['in'].append(vin)
+            tx[side]['out'].append(vout)
+            tx[side]['iter'].append(it)
+        elif kind == 'mismatch':
+            tx['mismatch'] = True
+        elif kind == 'tx_end':
+            tx['complete'] = True
+            yield tx
+            tx = None
+    if tx is not None:
+        yield tx